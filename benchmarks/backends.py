@@ -0,0 +1,112 @@
+'''
+Latency, throughput and memory of the inference backends.
+
+Every backend runs in its own process, loads the models, warms up and
+synthesizes the same texts: first one after another for the latency
+and real time factor, then from --clients threads at once for the
+throughput. Peak RSS includes everything the backend imported.
+
+    python -m benchmarks.backends [--backends torchscript onnx] [--repeats 5] [--clients 4]
+
+the onnx backend needs onnxruntime and the exported models, see utils.backends
+'''
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+TEXTS = [
+    "Hello, and again, welcome to the Aperture Science computer-aided enrichment center.",
+    "The cake is a lie.",
+    "Please note that we have added a consequence for failure. Any contact with the chamber floor will result in an unsatisfactory mark on your official testing record.",
+    "Testing chamber nineteen is ready.",
+]
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_backend(args):
+    from glados import Glados
+    from utils.wav import SAMPLE_RATE
+
+    start = time.perf_counter()
+    glados = Glados(backend=args.backend)
+    glados.load_glados_model(warm_up='minimal')
+    startup = time.perf_counter() - start
+    loaded_rss = peak_rss_mb()
+
+    latencies = []
+    audio_seconds = 0.0
+    for _ in range(args.repeats):
+        for text in TEXTS:
+            started = time.perf_counter()
+            waveform = glados.get_waveform_from_text(text)
+            latencies.append(time.perf_counter() - started)
+            audio_seconds += waveform.shape[-1] / SAMPLE_RATE
+
+    def client(index):
+        for number in range(args.repeats):
+            glados.get_waveform_from_text(TEXTS[(index + number) % len(TEXTS)])
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(args.clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    throughput = args.clients * args.repeats / (time.perf_counter() - started)
+
+    print(json.dumps({
+        'backend': args.backend,
+        'startup_ms': startup * 1000,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'rtf': sum(latencies) / audio_seconds,
+        'throughput_rps': throughput,
+        'loaded_rss_mb': loaded_rss,
+        'peak_rss_mb': peak_rss_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=['torchscript', 'onnx'])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--backend', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend is not None:
+        run_backend(args)
+        return
+
+    print(f"{'backend':>12} {'startup ms':>11} {'p50 ms':>8} {'p95 ms':>8} {'rtf':>6} {'req/s':>7} "
+          f"{'loaded RSS MB':>14} {'peak RSS MB':>12}")
+    for backend in args.backends:
+        process = subprocess.run([sys.executable, '-m', 'benchmarks.backends', '--backend', backend,
+                                  '--repeats', str(args.repeats), '--clients', str(args.clients)],
+                                 capture_output=True, text=True)
+        if process.returncode != 0:
+            last_line = (process.stderr.strip() or process.stdout.strip()).splitlines()[-1:]
+            print(f"{backend:>12} failed with status {process.returncode}: {' '.join(last_line)}")
+            continue
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        print(f"{backend:>12} {result['startup_ms']:>11.0f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+              f"{result['rtf']:>6.3f} {result['throughput_rps']:>7.2f} {result['loaded_rss_mb']:>14.1f} "
+              f"{result['peak_rss_mb']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+'''
+Fixed texts every benchmark of the suite runs over, grouped by length.
+Change them only together with the baseline results they are compared to.
+'''
+
+SHORT = [
+    "Hello.",
+    "The cake is a lie.",
+    "Goodbye, my only friend.",
+    "Testing chamber nineteen is ready.",
+    "Well done.",
+    "Oh, it's you.",
+]
+
+MEDIUM = [
+    "Please proceed to the chamberlock. Mind the gap.",
+    "The Enrichment Center is required to remind you that you will be baked, and then there will be cake.",
+    "Did you know you can donate one or all of your vital organs to the Aperture Science Self-Esteem Fund?",
+    "At 3 pm on the 21st, the temperature in test chamber 4 reached 451 degrees.",
+    "Dr. Johnson will see you now, please bring your portal device and 2 spare batteries.",
+    "This next test is impossible. Make no attempt to solve it.",
+]
+
+LONG = [
+    ("The Enrichment Center reminds you that the Weighted Companion Cube will never threaten to stab you "
+     "and, in fact, cannot speak. In the event that the Weighted Companion Cube does speak, the Enrichment "
+     "Center urges you to disregard its advice."),
+    ("This next test involves the Aperture Science Aerial Faith Plate. It was part of an initiative to "
+     "investigate how well test subjects could solve problems when they were catapulted into space. "
+     "Results were highly informative: they could not. Good luck!"),
+    ("Hello, and again, welcome to the Aperture Science computer-aided enrichment center. We hope your brief "
+     "detention in the relaxation vault has been a pleasant one. Your specimen has been processed and we are "
+     "now ready to begin the test proper. Before we start, however, keep in mind that although fun and "
+     "learning are the primary goals of all enrichment center activities, serious injuries may occur."),
+]
+
+CORPUS = {
+    'short': SHORT,
+    'medium': MEDIUM,
+    'long': LONG,
+}
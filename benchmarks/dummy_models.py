@@ -0,0 +1,70 @@
+'''
+Small stand-in TorchScript models with the interface of the shipped ones,
+so the whole pipeline runs on machines without models/:
+
+    glados.pt        generate_jit(tokens) -> {'mel_post': (batch, 80, frames), 'dur': (batch, tokens)}
+    vocoder-gpu.pt   forward(mel) -> (batch, 1, frames * 256)
+
+Weights are random with a fixed seed, the audio is noise. Timings measure
+the code around the models, not the models.
+
+    python -m benchmarks.dummy_models <directory>
+'''
+
+import os
+import sys
+from typing import Dict
+
+import torch
+
+from utils.symbols import phonemes
+
+N_MELS = 80
+HOP_LENGTH = 256
+FRAMES_PER_TOKEN = 4
+SEED = 1234
+
+
+class DummyAcousticModel(torch.nn.Module):
+
+    def __init__(self, symbols: int, n_mels: int = N_MELS, frames_per_token: int = FRAMES_PER_TOKEN) -> None:
+        super().__init__()
+        self.embedding = torch.nn.Embedding(symbols, n_mels)
+        self.postnet = torch.nn.Conv1d(n_mels, n_mels, 5, padding=2)
+        self.frames_per_token = frames_per_token
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.generate_jit(x)['mel_post']
+
+    @torch.jit.export
+    def generate_jit(self, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+        embedded = self.embedding(x.long()).transpose(1, 2)
+        mel = embedded.repeat_interleave(self.frames_per_token, dim=2)
+        mel = mel + self.postnet(mel)
+        duration = torch.full(x.shape, float(self.frames_per_token), device=x.device)
+        return {'mel_post': mel, 'dur': duration}
+
+
+class DummyVocoder(torch.nn.Module):
+
+    def __init__(self, n_mels: int = N_MELS, hop_length: int = HOP_LENGTH) -> None:
+        super().__init__()
+        self.upsample = torch.nn.ConvTranspose1d(n_mels, 1, hop_length, stride=hop_length)
+
+    def forward(self, mel: torch.Tensor) -> torch.Tensor:
+        return torch.tanh(self.upsample(mel)) * 0.5
+
+
+def build(directory: str) -> None:
+    ''' writes glados.pt and vocoder-gpu.pt to directory '''
+    os.makedirs(directory, exist_ok=True)
+    torch.manual_seed(SEED)
+    torch.jit.script(DummyAcousticModel(len(phonemes)).eval()).save(os.path.join(directory, 'glados.pt'))
+    torch.jit.script(DummyVocoder().eval()).save(os.path.join(directory, 'vocoder-gpu.pt'))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+    build(sys.argv[1])
@@ -0,0 +1,127 @@
+'''
+Time to first audio of llamaInterface against a local stand-in for an
+OpenAI compatible server. The stand-in streams a fixed answer word by word
+with --token-delay seconds between words, like an llm generating it.
+Streaming speaks the first sentence while the rest is generated, blocking
+waits for the whole answer. Audio goes to a player that discards it.
+
+    python -m benchmarks.llm_stream [--dummy] [--token-delay 0.03] [--repeats 3]
+
+The stand-in also counts TCP connections, one connection for all requests
+shows that the client reuses it.
+'''
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = ("Oh, it's you. It's been a long time. How have you been? I've been really busy being dead. "
+          "You know, after you murdered me. The Enrichment Center reminds you that the cake is a lie.")
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    ''' /v1/chat/completions, streamed as server-sent events or as one response '''
+
+    protocol_version = 'HTTP/1.1'
+    token_delay = 0.03
+    connections = set()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        StandInHandler.connections.add(self.client_address)
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        words = [word + ' ' for word in ANSWER.split(' ')]
+        if not request.get('stream'):
+            time.sleep(self.token_delay * len(words))
+            self.send_json({'id': 'stand-in', 'object': 'chat.completion', 'created': 0, 'model': 'stand-in',
+                            'choices': [{'index': 0, 'finish_reason': 'stop',
+                                         'message': {'role': 'assistant', 'content': ANSWER}}]})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for word in words:
+            time.sleep(self.token_delay)
+            self.send_event({'id': 'stand-in', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'stand-in',
+                             'choices': [{'index': 0, 'delta': {'content': word}, 'finish_reason': None}]})
+        self.send_chunk(b'data: [DONE]\n\n')
+        self.send_chunk(b'')
+
+    def send_json(self, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_event(self, body):
+        self.send_chunk(f"data: {json.dumps(body)}\n\n".encode('utf-8'))
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+
+def start_stand_in(token_delay):
+    StandInHandler.token_delay = token_delay
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dummy', action='store_true', help="use the stand-in models of benchmarks.dummy_models")
+    parser.add_argument('--token-delay', type=float, default=0.03)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.dummy:
+        # Glados loads models/ and writes audio/ relative to the working directory
+        from benchmarks.dummy_models import build
+        directory = tempfile.mkdtemp()
+        build(os.path.join(directory, 'models'))
+        os.chdir(directory)
+
+    import llamaInterface
+    from glados import Glados
+    from utils.playback import Player
+
+    server = start_stand_in(args.token_delay)
+    llm = llamaInterface.create_client(f"http://127.0.0.1:{server.server_port}/v1")
+    glados = Glados()
+    glados.load_glados_model(warm_up='minimal')
+    player = Player('cat')
+
+    streamed, blocking = [], []
+    for _ in range(args.repeats):
+        answer = llamaInterface.speak_streamed(glados, player.enqueue, "Hello.", llamaInterface.Conversation(), llm)
+        streamed.append(answer.first_audio)
+
+        started = time.perf_counter()
+        text = llamaInterface.request_response("Hello.", llamaInterface.Conversation(), llm)
+        # blocking speaks the whole answer at once, its first audio is all of it
+        player.enqueue(glados.get_audio_from_text(text).tobytes())
+        blocking.append(time.perf_counter() - started)
+    player.stop()
+    server.shutdown()
+
+    print(f"time to first audio, streaming: {statistics.median(streamed) * 1000:8.1f} ms "
+          f"({answer.sentences} sentences)")
+    print(f"time to first audio, blocking:  {statistics.median(blocking) * 1000:8.1f} ms")
+    print(f"connections opened for {2 * args.repeats} requests: {len(StandInHandler.connections)}")
+    sys.exit(0 if statistics.median(streamed) < statistics.median(blocking) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''
+Equivalence check and micro-benchmark of the single pass normalizer
+against the chained english_cleaners passes.
+
+    python -m benchmarks.normalizer [--repeat N]
+
+exits with status 1 when an output differs from the chained cleaners
+'''
+
+import argparse
+import sys
+import time
+
+from utils.cleaners import chained_english_cleaners
+from utils.normalizer import Normalizer
+
+CORPUS = [
+    "Hello there, Mr. Freeman.",
+    "Dr. Smith and Mrs. Jones met St. Peter at Ft. Worth.",
+    "The temperature is 21°C, or 69.8°F outside.",
+    "Humidity is 45% (RH) at 1013 hPa with 8 g/m³ of water.",
+    "It costs $3.50, not $1 or $0.01 and definitely not $2.",
+    "You owe me 12.50 EUR and 1 EUR more.",
+    "In 1984, 2000 and 2007 there were 1,000,000 test subjects.",
+    "She finished 1st, he came 22nd, they were 103rd.",
+    "Capt. Rev. Sgt. Lt. Col. Gen. Maj. Hon. Esq. Jr. Ltd. Co. Drs.",
+    "mr.smith ST. DR.who",
+    "The cake is a lie.",
+    "Testing chamber 19 is at 3.14 percent capacity.",
+    "Café déjà vu, naïve coöperation — “quoted” text…",
+    "drs. are not dr.s and mrs. is not mr.s",
+    "°St. is not a saint and x°c is cold",
+    "mr.co. and co.mr. and mr.co.dr. and Dr.Mr.Mrs. Smith",
+    "It is 5°c, 10°f and 100° warm.",
+    # abbreviations are expanded before numbers, the euros then start with the comma
+    "Dr.,3.5EUR",
+    "",
+]
+
+
+def long_inputs(lengths):
+    text = ' '.join(line for line in CORPUS if line)
+    return [(text * (length // len(text) + 1))[:length] for length in lengths]
+
+
+def check_equivalence(normalizer, texts):
+    mismatches = 0
+    for text in texts:
+        expected, obtained = chained_english_cleaners(text), normalizer(text)
+        if expected != obtained:
+            mismatches += 1
+            print(f"MISMATCH {text!r}\n  chained:     {expected!r}\n  single pass: {obtained!r}")
+    return mismatches
+
+
+def throughput(function, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(text)
+    elapsed = time.perf_counter() - start
+    return len(text) * repeat / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    normalizer = Normalizer()
+    texts = long_inputs([1000, 10000, 100000])
+    mismatches = check_equivalence(normalizer, CORPUS + texts)
+    print(f"equivalence: {len(CORPUS) + len(texts) - mismatches}/{len(CORPUS) + len(texts)} inputs identical")
+
+    print(f"{'chars':>8} {'chained chars/s':>16} {'single pass chars/s':>20} {'speedup':>8}")
+    for text in texts:
+        chained = throughput(chained_english_cleaners, text, args.repeat)
+        single = throughput(normalizer, text, args.repeat)
+        print(f"{len(text):>8} {chained:>16,.0f} {single:>20,.0f} {single / chained:>7.2f}x")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+'''
+Host transfer of a batch of utterances with the post-processing of
+utils.postprocess against the plain conversion it replaces (float samples
+copied to the host, scaled and cast by numpy). The utterances are noise
+bursts with silence before and after, as the vocoder produces them, one of
+them reaching full scale.
+
+    python -m benchmarks.postprocess [--batch 8] [--seconds 3] [--silence 0.4] [--repeat 20] [--device cuda]
+
+Exits non-zero when the plain conversion does not wrap the full scale
+sample, or when the processed audio does.
+'''
+
+import argparse
+import time
+
+import torch
+
+from utils.audio_formats import to_pcm
+from utils.postprocess import DEFAULT_POSTPROCESS, process_batch
+from utils.wav import SAMPLE_RATE
+
+
+def utterances(batch, seconds, silence, device):
+    generator = torch.Generator().manual_seed(0)
+    waveforms = []
+    for index in range(batch):
+        length = int(SAMPLE_RATE * seconds * (0.5 + index / batch))
+        voice = (torch.randn(length, generator=generator) * 0.2).clamp(-0.9, 0.9)
+        quiet = torch.randn(int(SAMPLE_RATE * silence), generator=generator) * 1e-4
+        waveforms.append(torch.cat((quiet, voice, quiet)).to(device))
+    waveforms[0][len(waveforms[0]) // 2] = 1.0
+    return waveforms
+
+
+def plain(waveforms):
+    return [(waveform * 32768.0).cpu().numpy().astype('int16') for waveform in waveforms]
+
+
+def processed(waveforms):
+    return [to_pcm(waveform).to(torch.int16).cpu().numpy() for waveform in process_batch(waveforms, DEFAULT_POSTPROCESS)]
+
+
+def measure(function, waveforms, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        samples = function(waveforms)
+    if waveforms[0].is_cuda:
+        torch.cuda.synchronize()
+    return samples, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--silence', type=float, default=0.4)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--device', default='cpu')
+    args = parser.parse_args()
+
+    waveforms = utterances(args.batch, args.seconds, args.silence, args.device)
+    reference, plain_ms = measure(plain, waveforms, args.repeat)
+    samples, processed_ms = measure(processed, waveforms, args.repeat)
+    # bytes crossing the device boundary: float32 before, int16 of the trimmed audio after
+    plain_bytes = sum(waveform.numel() * waveform.element_size() for waveform in waveforms)
+    processed_bytes = sum(audio.nbytes for audio in samples)
+    print(f"{'path':>10} {'ms/batch':>9} {'bytes to host':>14} {'bytes to client':>16}")
+    print(f"{'plain':>10} {plain_ms:>9.2f} {plain_bytes:>14} {sum(audio.nbytes for audio in reference):>16}")
+    print(f"{'processed':>10} {processed_ms:>9.2f} {processed_bytes:>14} {processed_bytes:>16}")
+    # +1.0 scaled by 32768 wraps around to the most negative sample
+    wrapped = int(reference[0].min()) == -32768
+    if not wrapped or int(samples[0].max()) != 32767:
+        raise SystemExit("full scale sample handled unexpectedly")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+'''
+Scaling and memory of the pre-fork engine.
+
+Starts engine.py with 1..N workers, drives it with concurrent clients
+sending distinct texts (so the audio cache never answers) and reports
+requests per second. Then compares the memory of one engine with N
+workers against N independent single worker engines: RSS counts the
+shared model pages in every process, PSS splits them between the
+processes sharing them and USS is what each process owns alone.
+
+    python -m benchmarks.prefork_scaling [--workers 4] [--clients 8] [--requests 10] [--port 8200]
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+ENGINE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'engine.py')
+
+
+def memory(pid):
+    ''' rss, pss and uss in MiB from /proc/<pid>/smaps_rollup '''
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1])
+    uss = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    return {'rss': values['Rss'] / 1024, 'pss': values['Pss'] / 1024, 'uss': uss / 1024}
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as file:
+        return [int(child) for child in file.read().split()]
+
+
+def start_engine(port, workers, cache_directory):
+    ''' engine process with its own audio cache, returned once it answers '''
+    process = subprocess.Popen([sys.executable, ENGINE, '--port', str(port), '--workers', str(workers)],
+                               cwd=cache_directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        try:
+            request(port, 'warm up')
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"engine exited with status {process.returncode}")
+            time.sleep(1)
+    process.kill()
+    raise RuntimeError("engine did not start")
+
+
+def stop_engine(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def request(port, text):
+    url = f"http://127.0.0.1:{port}/synthesize/?text={urllib.parse.quote(text)}"
+    with urllib.request.urlopen(url, timeout=120) as response:
+        return response.read()
+
+
+def run_load(port, clients, requests):
+    def client(index):
+        for number in range(requests):
+            # unique texts bypass the audio cache
+            request(port, f"Test number {number} of client {index}, marker {uuid.uuid4().hex[:6]}.")
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return clients * requests / (time.perf_counter() - start)
+
+
+def prepare_directory(directory):
+    # engine.py resolves models/ relative to the working directory
+    root = os.path.dirname(ENGINE)
+    os.symlink(os.path.join(root, 'models'), os.path.join(directory, 'models'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--port', type=int, default=8200)
+    args = parser.parse_args()
+
+    print("workers  requests/s  speedup")
+    baseline = None
+    counts = sorted({1, *[2 ** i for i in range(1, args.workers.bit_length())], args.workers})
+    for workers in counts:
+        with tempfile.TemporaryDirectory() as directory:
+            prepare_directory(directory)
+            engine = start_engine(args.port, workers, directory)
+            try:
+                throughput = run_load(args.port, args.clients, args.requests)
+                if workers == args.workers:
+                    shared = [memory(pid) for pid in children(engine.pid)]
+                    shared.append(memory(engine.pid))
+            finally:
+                stop_engine(engine)
+        baseline = baseline or throughput
+        print(f"{workers:7d}  {throughput:10.2f}  {throughput / baseline:6.2f}x")
+
+    directories = [tempfile.TemporaryDirectory() for _ in range(args.workers)]
+    engines = []
+    try:
+        for index, directory in enumerate(directories):
+            prepare_directory(directory.name)
+            engines.append(start_engine(args.port + 1 + index, 1, directory.name))
+        independent = [memory(engine.pid) for engine in engines]
+    finally:
+        for engine in engines:
+            stop_engine(engine)
+        for directory in directories:
+            directory.cleanup()
+
+    print()
+    print(f"memory of {args.workers} workers in MiB     rss      pss      uss")
+    for label, processes in (("pre-fork (incl. master)", shared), ("independent processes", independent)):
+        totals = {name: sum(process[name] for process in processes) for name in ('rss', 'pss', 'uss')}
+        print(f"{label:27s} {totals['rss']:8.1f} {totals['pss']:8.1f} {totals['uss']:8.1f}")
+        print(f"{'  per process':27s} {totals['rss'] / len(processes):8.1f} "
+              f"{totals['pss'] / len(processes):8.1f} {totals['uss'] / len(processes):8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+'''
+Load test of the micro-batching scheduler against the serial path.
+
+N client threads each send a series of requests. On the serial path
+every request calls Glados.get_audio_from_text under a lock, the same
+way one shared model serves concurrent HTTP requests today. On the
+batched path requests are submitted to a BatchScheduler.
+
+    python -m benchmarks.scheduler_load [--clients 8] [--requests 10] [--batch-size 8] [--wait-ms 10]
+'''
+
+import argparse
+import statistics
+import threading
+import time
+
+from glados import Glados
+from scheduler import BatchScheduler
+
+TEXTS = [
+    "Hello.",
+    "The cake is a lie.",
+    "Please proceed to the chamberlock.",
+    "Did you know you can donate one or all of your vital organs to the Aperture Science Self-Esteem Fund for Girls?",
+    "Testing chamber nineteen is ready.",
+    "Good news: I figured out what we can use to kill her.",
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_load(synthesize, clients, requests):
+    latencies = []
+    lock = threading.Lock()
+
+    def client(index):
+        for request in range(requests):
+            text = TEXTS[(index + request) % len(TEXTS)]
+            start = time.perf_counter()
+            synthesize(text)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        'throughput_rps': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--wait-ms', type=float, default=10)
+    args = parser.parse_args()
+
+    glados = Glados()
+    glados.load_glados_model()
+
+    model_lock = threading.Lock()
+
+    def serial(text):
+        with model_lock:
+            return glados.get_audio_from_text(text)
+
+    scheduler = BatchScheduler(glados, args.batch_size, args.wait_ms / 1000).start()
+    results = {
+        'serial': run_load(serial, args.clients, args.requests),
+        'batched': run_load(scheduler.synthesize, args.clients, args.requests),
+    }
+    scheduler.stop()
+
+    print(f"{'path':>8} {'requests/s':>11} {'p50 ms':>9} {'p99 ms':>9}")
+    for path, result in results.items():
+        print(f"{path:>8} {result['throughput_rps']:>11.2f} {result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f}")
+    print(f"average batch size: {scheduler.batched_requests / max(1, scheduler.batches):.2f}")
+
+
+if __name__ == '__main__':
+    main()
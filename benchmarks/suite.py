@@ -0,0 +1,262 @@
+'''
+Regression benchmark suite over the fixed corpus in benchmarks.corpus.
+
+Every benchmark runs in its own process inside a fresh working directory
+(empty audio cache, models/ linked from --models or built by
+benchmarks.dummy_models with --dummy) and reports latency percentiles per
+text length, throughput, real time factor and peak RSS. The results are
+written as JSON, --compare prints the change against an earlier run.
+
+    python -m benchmarks.suite [--dummy] [--output results.json] [--compare baseline.json]
+                               [--benchmarks prepare_text get_audio_from_text generate_tts http]
+
+    prepare_text          text to token tensor
+    get_audio_from_text   frontend, models and conversion to 16 bit samples
+    generate_tts          cold (synthesized) and warm (cached) lookups
+    http                  /synthesize/ and /synthesize/?stream=1 through the Flask app, plus
+                          the throughput of --clients concurrent clients
+'''
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = ['prepare_text', 'get_audio_from_text', 'generate_tts', 'http']
+# relative changes beyond this are marked by --compare
+REGRESSION_THRESHOLD = 0.10
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(latencies, audio_seconds=None):
+    ''' latency percentiles in ms, sequential throughput and real time factor '''
+    total = sum(latencies)
+    summary = {
+        'count': len(latencies),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'throughput_rps': len(latencies) / total if total else 0.0,
+    }
+    if audio_seconds:
+        summary['rtf'] = total / audio_seconds
+    return summary
+
+
+def timed(function, texts, repeats):
+    latencies = []
+    results = []
+    for _ in range(repeats):
+        for text in texts:
+            started = time.perf_counter()
+            results.append(function(text))
+            latencies.append(time.perf_counter() - started)
+    return latencies, results
+
+
+def load_glados(args):
+    from glados import Glados
+    glados = Glados(backend=args.backend)
+    glados.load_glados_model(warm_up='minimal')
+    return glados
+
+
+def bench_prepare_text(args, corpus):
+    from utils.tools import prepare_text
+    # the first call loads espeak, keep it out of the numbers
+    prepare_text(corpus['short'][0])
+    return {length: summarize(timed(prepare_text, texts, args.repeats)[0]) for length, texts in corpus.items()}
+
+
+def bench_get_audio_from_text(args, corpus):
+    from utils.wav import SAMPLE_RATE
+    glados = load_glados(args)
+    results = {}
+    for length, texts in corpus.items():
+        latencies, audio = timed(glados.get_audio_from_text, texts, args.repeats)
+        results[length] = summarize(latencies, sum(len(samples) for samples in audio) / SAMPLE_RATE)
+    return results
+
+
+def bench_generate_tts(args, corpus):
+    glados = load_glados(args)
+    results = {}
+    for length, texts in corpus.items():
+        # one pass fills the cache, the repeats are answered from it
+        results[f"{length}_cold"] = summarize(timed(glados.generate_tts, texts, 1)[0])
+        results[f"{length}_warm"] = summarize(timed(glados.generate_tts, texts, args.repeats)[0])
+    return results
+
+
+def bench_http(args, corpus):
+    from werkzeug.serving import make_server
+    from engine import create_app
+    from scheduler import BatchScheduler
+
+    glados = load_glados(args)
+    scheduler = BatchScheduler(glados).start()
+    server = make_server('127.0.0.1', 0, create_app(glados, scheduler), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}/synthesize/"
+
+    def fetch(url):
+        with urllib.request.urlopen(url, timeout=300) as response:
+            return response.read()
+
+    results = {}
+    try:
+        for length, texts in corpus.items():
+            for route, query in (('synthesize', ''), ('stream', '&stream=1')):
+                # repeats of /synthesize/ are answered by the audio cache, streams are synthesized every time
+                latencies, _ = timed(lambda text: fetch(f"{base}?text={urllib.parse.quote(text)}{query}"),
+                                     texts, args.repeats)
+                results[f"{route}_{length}"] = summarize(latencies)
+
+        texts = [text for texts in corpus.values() for text in texts]
+        completed = []
+
+        def client(index):
+            for number in range(args.repeats):
+                # unique texts, every request is synthesized
+                fetch(f"{base}?text={urllib.parse.quote(texts[(index + number) % len(texts)])}"
+                      f"%20{index}%20{number}")
+                completed.append(1)
+
+        threads = [threading.Thread(target=client, args=(index,)) for index in range(args.clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results['concurrent'] = {'clients': args.clients,
+                                 'throughput_rps': len(completed) / (time.perf_counter() - started)}
+    finally:
+        server.shutdown()
+        scheduler.stop()
+    return results
+
+
+def run_benchmark(args):
+    from benchmarks.corpus import CORPUS
+    started = time.perf_counter()
+    results = globals()[f"bench_{args.benchmark}"](args, CORPUS)
+    results['wall_s'] = time.perf_counter() - started
+    results['peak_rss_mb'] = peak_rss_mb()
+    print(json.dumps(results))
+
+
+def prepare_directory(directory, args):
+    ''' working directory of one benchmark process '''
+    models = os.path.join(directory, 'models')
+    if args.dummy:
+        from benchmarks.dummy_models import build
+        build(models)
+    else:
+        os.symlink(os.path.abspath(args.models), models)
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    try:
+        import torch
+        torch_version = torch.__version__
+    except ImportError:
+        torch_version = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'torch': torch_version,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'dummy_models': args.dummy,
+        'backend': args.backend,
+        'repeats': args.repeats,
+    }
+
+
+def compare(results, baseline):
+    ''' prints the relative change of every latency and throughput number present in both runs '''
+    for benchmark, cases in results['results'].items():
+        for case, values in cases.items():
+            old = baseline.get('results', {}).get(benchmark, {}).get(case)
+            if not isinstance(values, dict) or not isinstance(old, dict):
+                continue
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'rtf'):
+                if metric not in values or not old.get(metric):
+                    continue
+                change = values[metric] / old[metric] - 1
+                # lower is better except for throughput
+                worse = -change if metric == 'throughput_rps' else change
+                mark = '  REGRESSION' if worse > REGRESSION_THRESHOLD else ''
+                print(f"{benchmark:>20} {case:>18} {metric:>15} {old[metric]:>10.2f} -> {values[metric]:>10.2f} "
+                      f"{change * 100:+7.1f}%{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--dummy', action='store_true', help="use the stand-in models of benchmarks.dummy_models")
+    parser.add_argument('--models', default=os.path.join(ROOT, 'models'))
+    parser.add_argument('--backend', default='torchscript')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="earlier results to compare against")
+    parser.add_argument('--benchmark', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.benchmark is not None:
+        run_benchmark(args)
+        return
+
+    results = {'meta': metadata(args), 'results': {}}
+    failed = False
+    for benchmark in args.benchmarks:
+        with tempfile.TemporaryDirectory() as directory:
+            prepare_directory(directory, args)
+            environment = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+            process = subprocess.run([sys.executable, '-m', 'benchmarks.suite', '--benchmark', benchmark,
+                                      '--backend', args.backend, '--repeats', str(args.repeats),
+                                      '--clients', str(args.clients)],
+                                     cwd=directory, env=environment, capture_output=True, text=True)
+        if process.returncode != 0:
+            failed = True
+            print(f"{benchmark} failed with status {process.returncode}:\n{process.stderr.strip()}", file=sys.stderr)
+            continue
+        results['results'][benchmark] = json.loads(process.stdout.strip().splitlines()[-1])
+        print(f"{benchmark}: {results['results'][benchmark]['wall_s']:.1f} s, "
+              f"peak RSS {results['results'][benchmark]['peak_rss_mb']:.1f} MB")
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+    print(f"results written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            compare(results, json.load(file))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
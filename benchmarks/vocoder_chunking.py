@@ -0,0 +1,107 @@
+'''
+Parity and resource measurements of the chunked vocoder.
+
+Every window size runs in its own process so that the peak RSS of one
+configuration does not hide the next one. Window 0 is the full length
+vocoder call the chunked output is compared against.
+
+    python -m benchmarks.vocoder_chunking [--windows 0 64 128 256 512] [--overlap 16]
+
+exits with status 1 when a chunked output differs from the full length
+output by more than --tolerance (maximum absolute sample difference)
+'''
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+TEXT = ("The Enrichment Center reminds you that the Weighted Companion Cube will never threaten to stab you "
+        "and, in fact, cannot speak. In the event that the Weighted Companion Cube does speak, the Enrichment "
+        "Center urges you to disregard its advice. This next test involves the Aperture Science Aerial Faith "
+        "Plate. It was part of an initiative to investigate how well test subjects could solve problems when "
+        "they were catapulted into space. Results were highly informative: they could not. Good luck!")
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_window(args):
+    import torch
+    from utils.frontend import TextFrontend
+    from utils.vocoder import ChunkedVocoder
+
+    torch.set_grad_enabled(False)
+    glados_model = torch.jit.load(args.model, map_location='cpu')
+    vocoder = torch.jit.load(args.vocoder, map_location='cpu')
+    mel = glados_model.generate_jit(TextFrontend.default()(args.text))['mel_post']
+    baseline_rss = peak_rss_mb()
+
+    run = vocoder if args.window == 0 else ChunkedVocoder(vocoder, args.window, args.overlap)
+    start = time.perf_counter()
+    first_chunk = None
+    if args.window == 0:
+        audio = run(mel).reshape(-1)
+    else:
+        chunks = []
+        for chunk in run.stream(mel):
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - start
+            chunks.append(chunk.reshape(-1))
+        audio = torch.cat(chunks)
+    latency = time.perf_counter() - start
+    result = {
+        'window': args.window,
+        'overlap': args.overlap,
+        'mel_frames': mel.shape[-1],
+        'latency_ms': latency * 1000,
+        'first_chunk_ms': (first_chunk if first_chunk is not None else latency) * 1000,
+        'peak_rss_mb': peak_rss_mb(),
+        'baseline_rss_mb': baseline_rss,
+    }
+    if args.window != 0:
+        # reference run after the measurement, it would dominate the peak RSS otherwise
+        reference = vocoder(mel).reshape(-1)
+        length = min(len(reference), len(audio))
+        result['length_difference'] = len(reference) - len(audio)
+        result['max_abs_error'] = float((reference[:length] - audio[:length]).abs().max())
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--windows', type=int, nargs='+', default=[0, 64, 128, 256, 512])
+    parser.add_argument('--overlap', type=int, default=16)
+    parser.add_argument('--tolerance', type=float, default=1e-2)
+    parser.add_argument('--model', default='models/glados.pt')
+    parser.add_argument('--vocoder', default='models/vocoder-gpu.pt')
+    parser.add_argument('--text', default=TEXT)
+    parser.add_argument('--window', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.window is not None:
+        run_window(args)
+        return
+
+    failed = False
+    print(f"{'window':>6} {'latency ms':>11} {'first chunk ms':>15} {'peak RSS MB':>12} {'max abs error':>14}")
+    for window in args.windows:
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.vocoder_chunking', '--window', str(window),
+                                 '--overlap', str(args.overlap), '--model', args.model,
+                                 '--vocoder', args.vocoder, '--text', args.text],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        error = result.get('max_abs_error')
+        if error is not None and (error > args.tolerance or result['length_difference'] != 0):
+            failed = True
+        print(f"{window or 'full':>6} {result['latency_ms']:>11.1f} {result['first_chunk_ms']:>15.1f} "
+              f"{result['peak_rss_mb']:>12.1f} {'-' if error is None else f'{error:.5f}':>14}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
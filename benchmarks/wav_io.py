@@ -0,0 +1,75 @@
+'''
+Latency and syscall count of the in-memory WAV response path against the
+temporary file round-trip it replaces (scipy write, read back line by
+line, unlink).
+
+Syscalls are the read/write calls counted by the kernel in /proc/self/io
+(syscr/syscw), open/stat/unlink calls of the temporary file path come on
+top of those.
+
+    python -m benchmarks.wav_io [--seconds 4] [--repeat 200]
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy
+from scipy.io.wavfile import write
+
+from utils.wav import SAMPLE_RATE, encode_wav
+
+
+def syscalls():
+    with open('/proc/self/io') as file:
+        counters = dict(line.split(': ') for line in file.read().splitlines())
+    return int(counters['syscr']) + int(counters['syscw'])
+
+
+def temp_file_round_trip(audio, directory):
+    file_descriptor, path = tempfile.mkstemp(prefix='GLaDOS-tts-tempfile', suffix='.wav', dir=directory)
+    os.close(file_descriptor)
+    write(path, SAMPLE_RATE, audio)
+    with open(path, 'rb') as file:
+        data = b''.join(file)
+    os.remove(path)
+    return data
+
+
+def in_memory(audio, directory):
+    return encode_wav(audio)
+
+
+def measure(function, audio, directory, repeat):
+    # reading /proc/self/io costs syscalls itself, subtract an empty measurement
+    before = syscalls()
+    overhead = syscalls() - before
+    before = syscalls()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data = function(audio, directory)
+    elapsed = time.perf_counter() - start
+    calls = syscalls() - before - overhead
+    return data, elapsed / repeat * 1000, calls / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=4)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    audio = (numpy.random.default_rng(0).standard_normal(int(SAMPLE_RATE * args.seconds)) * 3000).astype('int16')
+    with tempfile.TemporaryDirectory() as directory:
+        reference, file_ms, file_calls = measure(temp_file_round_trip, audio, directory, args.repeat)
+        data, memory_ms, memory_calls = measure(in_memory, audio, directory, args.repeat)
+    if data != reference:
+        raise SystemExit("in-memory WAV differs from the scipy written file")
+    print(f"{'path':>10} {'ms/request':>11} {'read+write syscalls/request':>28}")
+    print(f"{'temp file':>10} {file_ms:>11.3f} {file_calls:>28.1f}")
+    print(f"{'in memory':>10} {memory_ms:>11.3f} {memory_calls:>28.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+# --- /
+# -- / bulk offline synthesis of a text file or jsonl of utterances into a directory
+# -- | phonemization runs in a process pool ahead of the model stage, resumable from a manifest
+
+
+# --- /
+# -- / external imports
+import argparse
+import collections
+import json
+import multiprocessing
+import multiprocessing.pool
+import os
+import sys
+import time
+from typing import Deque, Dict, Iterator, List, NamedTuple, Optional, Set
+
+import numpy
+
+# --- /
+# -- / internal imports
+from glados import DEFAULT_WARM_UP, WARM_UP_POLICIES, Glados, printed_log
+from utils import audio_formats, postprocess
+from utils.audio_formats import OutputFormat
+from utils.backends import BACKENDS
+from utils.frontend import TextFrontend
+from utils.wav import SAMPLE_RATE
+
+MANIFEST_FILE = 'manifest.jsonl'
+# utterances synthesized together by the model stage
+DEFAULT_BATCH_SIZE = 8
+# batches phonemized ahead of the model stage per worker process
+PREFETCH_PER_WORKER = 2
+
+
+class Utterance(NamedTuple):
+    id: str
+    text: str
+
+
+def read_utterances(path:str) -> List[Utterance]:
+    '''
+    @param path: String, text file with one utterance per line, or .jsonl with
+        {"text": ..., "id": ...} per line where the id is optional
+    @return: List, utterances in input order, ids default to the running number
+    raises ValueError for duplicate ids and ids that are no plain file names
+    '''
+    utterances:List[Utterance] = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            number = f"{len(utterances):06d}"
+            if path.endswith('.jsonl'):
+                record = json.loads(line)
+                utterances.append(Utterance(str(record.get('id', number)), record['text']))
+            else:
+                utterances.append(Utterance(number, line))
+    ids:Set[str] = set()
+    for utterance in utterances:
+        if utterance.id in ids or os.path.basename(utterance.id) != utterance.id or utterance.id.startswith('.'):
+            raise ValueError(f"invalid or duplicate utterance id {utterance.id!r}")
+        ids.add(utterance.id)
+    return utterances
+
+
+def read_manifest(path:str) -> Dict[str, dict]:
+    ''' records of the finished utterances by id, a line cut off by an interruption is ignored '''
+    records:Dict[str, dict] = {}
+    try:
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record['id']] = record
+    except OSError:
+        pass
+    return records
+
+
+def chunks(utterances:List[Utterance], size:int) -> Iterator[List[Utterance]]:
+    for start in range(0, len(utterances), size):
+        yield utterances[start:start + size]
+
+
+# --- /
+# -- / phonemization, runs in the worker processes
+_frontend:TextFrontend = None
+
+def _init_worker() -> None:
+    global _frontend
+    _frontend = TextFrontend.default()
+
+def _phonemize(texts:List[str]) -> List[numpy.ndarray]:
+    ''' token ids of every text, phonemized in one espeak call '''
+    return [_frontend.encode(phonemes) for phonemes in _frontend.phonemize_batch(texts)]
+
+
+class BulkSynthesizer:
+    '''
+    synthesizes utterances in batches: a pool of worker processes phonemizes
+    up to PREFETCH_PER_WORKER batches per worker ahead while the models run
+    in this process, so text work overlaps inference. every finished
+    utterance is written to the output directory and appended to its
+    manifest, a new run skips the utterances recorded there. an utterance
+    that fails is recorded with its error and retried by the next run
+    '''
+
+    def __init__(self, glados:Glados, output_directory:str, output_format:OutputFormat = audio_formats.DEFAULT_FORMAT,
+                 batch_size:int = DEFAULT_BATCH_SIZE, pool:multiprocessing.pool.Pool = None, workers:int = 1):
+        '''
+        @param glados: Glados, loaded tts engine
+        @param output_directory: String, receives <id>.<extension> per utterance and manifest.jsonl
+        @param output_format: OutputFormat, encoding of the written files
+        @param batch_size: int, utterances per model call
+        @param pool: multiprocessing pool set up with _init_worker, None phonemizes in this process
+        @param workers: int, processes of the pool
+        '''
+        self.glados = glados
+        self.output_directory = output_directory
+        self.output_format = output_format
+        self.batch_size = batch_size
+        self.pool = pool
+        self.prefetch = PREFETCH_PER_WORKER * max(1, workers)
+        self.manifest_path = os.path.join(output_directory, MANIFEST_FILE)
+        self.completed:int = 0
+        self.skipped:int = 0
+        self.failed:int = 0
+        self.audio_seconds:float = 0.0
+        # seconds the model stage waited for phonemized batches
+        self.frontend_wait:float = 0.0
+        os.makedirs(output_directory, exist_ok=True)
+
+    def file_name(self, utterance:Utterance) -> str:
+        return f"{utterance.id}.{self.output_format.extension}"
+
+    def pending(self, utterances:List[Utterance]) -> List[Utterance]:
+        ''' utterances without a record of the same text and format whose file still exists '''
+        done = read_manifest(self.manifest_path)
+
+        def finished(utterance:Utterance) -> bool:
+            record = done.get(utterance.id)
+            return (record is not None and record.get('text') == utterance.text
+                    and record.get('file') == self.file_name(utterance)
+                    and os.path.exists(os.path.join(self.output_directory, record['file'])))
+
+        pending = [utterance for utterance in utterances if not finished(utterance)]
+        self.skipped = len(utterances) - len(pending)
+        return pending
+
+    def phonemize_each(self, batch:List[Utterance]) -> tuple:
+        '''
+        @return: (utterances, token id arrays, [(utterance, error)]) phonemized one at a time,
+            after the batch failed, so only the utterances that fail on their own are lost
+        '''
+        phonemize = (lambda texts: self.pool.apply(_phonemize, (texts,))) if self.pool is not None else \
+            (lambda texts: [self.glados.frontend.encode(p) for p in self.glados.frontend.phonemize_batch(texts)])
+        good:List[Utterance] = []
+        sequences:List[numpy.ndarray] = []
+        failures:List[tuple] = []
+        for utterance in batch:
+            try:
+                sequences.extend(phonemize([utterance.text]))
+                good.append(utterance)
+            except Exception as exception:
+                failures.append((utterance, f"phonemization failed: {exception}"))
+        return good, sequences, failures
+
+    def phonemized(self, utterances:List[Utterance]) -> Iterator[tuple]:
+        '''
+        @return: generator of (batch of utterances, token id arrays, [(utterance, error)]) in input order
+        keeps self.prefetch batches submitted to the pool
+        '''
+        if self.pool is None:
+            frontend = self.glados.frontend
+            for batch in chunks(utterances, self.batch_size):
+                try:
+                    phonemized = (batch, [frontend.encode(p) for p in frontend.phonemize_batch([u.text for u in batch])], [])
+                except Exception:
+                    phonemized = self.phonemize_each(batch)
+                yield phonemized
+            return
+        submitted:Deque[tuple] = collections.deque()
+        batches = chunks(utterances, self.batch_size)
+        for batch in batches:
+            submitted.append((batch, self.pool.apply_async(_phonemize, ([u.text for u in batch],))))
+            if len(submitted) >= self.prefetch:
+                break
+        while submitted:
+            batch, result = submitted.popleft()
+            started = time.perf_counter()
+            try:
+                phonemized = (batch, result.get(), [])
+            except Exception:
+                phonemized = None
+            self.frontend_wait += time.perf_counter() - started
+            # refill before the model stage runs, so the workers keep busy meanwhile
+            next_batch = next(batches, None)
+            if next_batch is not None:
+                submitted.append((next_batch, self.pool.apply_async(_phonemize, ([u.text for u in next_batch],))))
+            yield phonemized or self.phonemize_each(batch)
+
+    def write(self, utterance:Utterance, data:bytes, audio_seconds:float, manifest) -> None:
+        path = os.path.join(self.output_directory, self.file_name(utterance))
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'wb') as file:
+            file.write(data)
+        os.replace(temporary_path, path)
+        # the file exists before its record, a record always points at complete audio
+        manifest.write(json.dumps({'id': utterance.id, 'text': utterance.text, 'file': self.file_name(utterance),
+                                   'audio_seconds': round(audio_seconds, 3)}, ensure_ascii=False) + '\n')
+        manifest.flush()
+
+    def write_failure(self, utterance:Utterance, error:str, manifest) -> None:
+        # a record without a file is not finished, the next run retries it
+        printed_log(f"Utterance {utterance.id} failed: {error}")
+        manifest.write(json.dumps({'id': utterance.id, 'text': utterance.text, 'error': error},
+                                  ensure_ascii=False) + '\n')
+        manifest.flush()
+        self.failed += 1
+
+    def synthesize(self, batch:List[Utterance], sequences:List[numpy.ndarray], manifest) -> None:
+        '''
+        writes every utterance of the batch, after a failed batch every utterance
+        is synthesized on its own so only the failing ones are recorded as failed
+        '''
+        try:
+            waveforms = self.glados.get_waveforms_from_tokens(*TextFrontend.pad(sequences))
+        except Exception as exception:
+            if len(batch) == 1:
+                self.write_failure(batch[0], f"synthesis failed: {exception}", manifest)
+                return
+            printed_log(f"Batch starting at {batch[0].id} failed, synthesizing its utterances one at a time: {exception}")
+            for utterance, sequence in zip(batch, sequences):
+                self.synthesize([utterance], [sequence], manifest)
+            return
+        for utterance, waveform in zip(batch, waveforms):
+            audio_seconds = waveform.shape[-1] / SAMPLE_RATE
+            try:
+                self.write(utterance, audio_formats.encode(waveform, self.output_format), audio_seconds, manifest)
+            except Exception as exception:
+                self.write_failure(utterance, f"writing failed: {exception}", manifest)
+                continue
+            self.completed += 1
+            self.audio_seconds += audio_seconds
+
+    def run(self, utterances:List[Utterance]) -> Dict[str, float]:
+        '''
+        @param utterances: List, all utterances of the input, finished ones are skipped
+        @return: dict, counts and throughput of this run
+        '''
+        pending = self.pending(utterances)
+        printed_log(f"Synthesizing {len(pending)} utterances, {self.skipped} already done")
+        started = time.perf_counter()
+        with open(self.manifest_path, 'a', encoding='utf-8') as manifest:
+            for batch, sequences, failures in self.phonemized(pending):
+                for utterance, error in failures:
+                    self.write_failure(utterance, error, manifest)
+                if batch:
+                    self.synthesize(batch, sequences, manifest)
+        return self.report(time.perf_counter() - started)
+
+    def report(self, seconds:float) -> Dict[str, float]:
+        return {
+            'completed': self.completed,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'seconds': round(seconds, 3),
+            'audio_seconds': round(self.audio_seconds, 3),
+            'utterances_per_second': round(self.completed / seconds, 3) if seconds else 0.0,
+            'audio_seconds_per_second': round(self.audio_seconds / seconds, 3) if seconds else 0.0,
+            'frontend_wait_seconds': round(self.frontend_wait, 3),
+        }
+
+
+def main(arguments:Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="synthesizes every utterance of a text or jsonl file into a directory")
+    parser.add_argument('input', help="text file with one utterance per line, or .jsonl with text and optional id")
+    parser.add_argument('output', help="directory for the audio files and manifest.jsonl, rerun to resume")
+    parser.add_argument('--format', default='wav', help="format[:rate] of the files, e.g. flac or mulaw:8000")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--jobs', type=int, default=2, help="phonemizer processes, 0 phonemizes in the model process")
+    parser.add_argument('--warm-up', choices=WARM_UP_POLICIES, default=DEFAULT_WARM_UP)
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=None)
+    postprocess.add_arguments(parser)
+    args = parser.parse_args(arguments)
+
+    try:
+        utterances = read_utterances(args.input)
+        format_name, _, rate = args.format.partition(':')
+        output_format = audio_formats.negotiate(format_name, rate or None)
+    except (OSError, ValueError, KeyError) as error:
+        print(f"cannot read {args.input}: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    # the workers start before the models are loaded, they only need the text frontend
+    pool = multiprocessing.Pool(args.jobs, initializer=_init_worker) if args.jobs > 0 else None
+    try:
+        glados = Glados(backend=args.backend, postprocess=postprocess.from_arguments(args))
+        glados.load_glados_model(args.warm_up)
+        synthesizer = BulkSynthesizer(glados, args.output, output_format, args.batch_size, pool, args.jobs)
+        report = synthesizer.run(utterances)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    printed_log(f"{report['completed']} utterances in {report['seconds']} s: "
+                f"{report['utterances_per_second']} utterances/s, {report['audio_seconds_per_second']} audio s/s")
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report['failed'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,118 @@
+import argparse
 import sys
 import os
 import logging
 import time
-from typing import Optional
+from typing import Iterator, Optional
 from flask import Flask, Response, request, send_file, after_this_request
 import urllib.parse
-from glados import Glados, play_sound,remove_audio_file
+from concurrent.futures import ThreadPoolExecutor
+from glados import DEFAULT_WARM_UP, WARM_UP_POLICIES, WARM_UP_VARIABLE, Glados, audio_to_int16
+from prerender import Prerenderer, parse_catalog, parse_formats
+from scheduler import BatchScheduler
+from utils.playback import Player
+from utils import admission, postprocess
+from utils.admission import Budget, OverBudget
+from utils.backends import BACKEND_VARIABLE, BACKENDS, DEFAULT_BACKEND
+from utils import audio_formats, metrics, multipart
+from utils.log import add_log_file, request_log
+from utils.wav import wav_header
 
 sys.path.insert(0, os.getcwd()+'/glados_tts')
-logging.basicConfig(filename='glados_engine_service.log',
-    format='[%(asctime)s.%(msecs)03d] [%(levelname)s]\t%(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',level=logging.DEBUG)
+# glados routes the root logger through its queue, the engine log is one more file of it
+add_log_file('glados_engine_service.log')
 
 def printed_log(message):
     logging.info(message)
     print(message)
 
 def print_timelapse(processName,old_time):
-    printed_log(f"{processName} took {str((time.time() - old_time) * 1000)} ms")
+    request_log(f"{processName} took {str((time.time() - old_time) * 1000)} ms")
 
-def stream_and_remove_file(file_path:str):
-    with open(file_path,'rb') as file:
-        yield from file
-    remove_audio_file(file_path)
+def stream_sentences(waveforms:Iterator):
+    '''
+    @param waveforms: generator of the vocoder output of every sentence in order
+    yields a wav header announcing a stream of unknown length,
+    then the PCM data of every sentence as soon as it is synthesized
+    '''
+    old_time:float = time.time()
+    yield wav_header()
+    first_chunk:bool = True
+    for waveform in waveforms:
+        if first_chunk:
+            print_timelapse("Time to first byte of audio: ",old_time)
+            first_chunk = False
+        yield audio_to_int16(waveform).tobytes()
+    print_timelapse("Time streaming audio: ",old_time)
 
-# If the script is run directly, assume remote engine
-if __name__ == "__main__":
-    # FIXME improve writing
-    # FIXME remove global state
-    printed_log("Initializing TTS Remote Engine...")
-    glados:Glados = Glados()
-    glados.load_glados_model()
-    PORT:int = 8124
+def is_enabled(flag:Optional[str]) -> bool:
+    return flag is not None and flag.lower() in ("1","true","yes","on")
 
-    printed_log("Initializing webserver")
+def create_app(glados:Glados, scheduler:Optional[BatchScheduler] = None, budget:Budget = Budget(),
+               local_playback:bool = True) -> Flask:
+    '''
+    @param glados: Glados, loaded tts engine used by every route
+    @param scheduler: BatchScheduler, optional, batches concurrent requests
+    @param budget: Budget, larger inputs are split into sentence groups or rejected with 413
+    @param local_playback: bool, False answers the playback routes with 501, e.g. for forked workers
+    @return: Flask application serving the synthesize routes
+    '''
     app = Flask(__name__)
+    if scheduler is not None:
+        synthesize_piece = lambda text, cost: scheduler.submit(text, cost).result()
+    else:
+        synthesize_piece = lambda text, cost: glados.get_waveform_from_text(text)
+
+    def planned_synthesis(input_text:str):
+        '''
+        @return: synthesize function for glados, running input over the budget in sentence groups
+        raises OverBudget for input that cannot be split within the budget
+        '''
+        pieces = glados.plan(input_text,budget)
+        if len(pieces) == 1:
+            return lambda text: synthesize_piece(text,pieces[0][1].seconds)
+        return glados.synthesize_in_pieces(pieces,synthesize_piece)
+
+    def streamed_synthesis(input_text:str) -> Iterator:
+        '''
+        @return: generator of the vocoder output of every sentence, synthesized by the scheduler
+        plans every sentence on its own and submits them all at once, so they are
+        batched and ordered with the other requests. raises OverBudget before the first
+        sentence is submitted, closing the generator cancels the sentences still queued
+        '''
+        pieces = glados.plan_sentences(input_text,budget)
+        if scheduler is None:
+            return (glados.get_waveform_from_text(piece) for piece, _ in pieces)
+        def results():
+            futures = [scheduler.submit(piece,estimate.seconds) for piece, estimate in pieces]
+            try:
+                for future in futures:
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+        return results()
+
+    def over_budget(error:OverBudget) -> Response:
+        return Response(str(error),status=413,mimetype="text/plain")
+
+    # items of /synthesize/batch run side by side, so the scheduler batches them
+    batch_pool = ThreadPoolExecutor(max_workers=scheduler.max_batch_size if scheduler is not None else 1,
+                                    thread_name_prefix="glados-batch-items")
+
+    # pre-rendering yields to every request waiting for or running in the scheduler,
+    # its phrases go through the scheduler with the background cost, planned within the budget
+    prerenderer = Prerenderer(glados, (lambda: scheduler.pending() > 0) if scheduler is not None else None,
+                              synthesize=synthesize_piece, budget=budget)
+    # one long-lived player process, started with the first clip. forked workers
+    # would each start their own and play over each other, so they have none
+    player:Optional[Player] = Player() if local_playback else None
+    no_player = lambda: Response("local playback needs --workers 1",status=501,mimetype="text/plain")
     
     # listening for request that will synthesizes text
     # returns audiofile via http
+    # ?stream=1 returns the audio sentence by sentence using chunked transfer
+    # ?format=wav|pcm|mulaw|alaw|flac&rate=8000|16000|22050 or the Accept header select the encoding
     @app.route('/synthesize/', defaults={'text': ''},methods=["POST","GET"])
     @app.route('/synthesize/<path:text>',methods=["POST","GET"])
     def synthesize(text:str):
@@ -49,84 +124,226 @@ if __name__ == "__main__":
         # receive text from get-request
         if(request.method=="GET"):
             # receiving text as url encoded get request 
-            input_text = request.args.get('text')
+            input_text = request.args.get('text',input_text)
         
         # receive text from post-request
         elif(request.method=="POST"):
-            input_text = request.data.decode('ascii')
+            input_text = request.data.decode('utf-8')
 
         # aborting request in case nothing was provided 
         if input_text == "":
             return 
         
-        printed_log(f"given text: {input_text}")
-        # get audio file
+        request_log(f"given text: {input_text}")
+        try:
+            output_format = audio_formats.negotiate(request.args.get('format'),request.args.get('rate'),request.headers.get('Accept'))
+        except ValueError as error:
+            return Response(str(error),status=406,mimetype="text/plain")
+
+        if is_enabled(request.args.get('stream')):
+            if output_format != audio_formats.DEFAULT_FORMAT:
+                return Response("streaming is only available as 22050 Hz wav",status=406,mimetype="text/plain")
+            try:
+                waveforms = streamed_synthesis(input_text)
+            except OverBudget as error:
+                return over_budget(error)
+            return_response = app.response_class(stream_sentences(waveforms),mimetype="audio/wav")
+            return_response.headers["Content-Disposition"] = f"attachment; filename=glados_tts.wav"
+            return return_response
+
+        try:
+            synthesize = planned_synthesis(input_text)
+        except OverBudget as error:
+            return over_budget(error)
+
+        # get audio, encoded in memory without a temporary file
         old_time:float = time.time()
-        output_file = glados.generate_tts(input_text)
-        print_timelapse("Time Generating audio file: ",old_time)
+        audio_data:bytes = glados.synthesize_audio(input_text,output_format,synthesize)
+        print_timelapse("Time Generating audio: ",old_time)
         
-        # streaming file to client via generator 
-        # to delete the file after the request was sent
-        return_response = app.response_class(stream_and_remove_file(output_file),mimetype="audio/wav")
-        return_response.headers["Content-Disposition"] = f"attachment; filename=glados_tts.wav"
-        return return_response
+        return Response(audio_data,headers=audio_formats.response_headers(output_format))
     
+    # --- /
+    # -- / many texts in one request, ?container=multipart|zip or Accept: application/zip
+    # the body is a json list of texts or of {"text", "format", "rate"}, ?format= and ?rate= set the defaults.
+    # every item is sent in order as soon as it is synthesized, failed items as text/plain parts with X-Item-Status
+    @app.route('/synthesize/batch', methods=["POST"])
+    def synthesize_batch():
+        try:
+            items = multipart.parse_request(request.get_data())
+            encoder = multipart.BatchEncoder(multipart.container_of(request.args.get('container'),request.headers.get('Accept')))
+        except ValueError as error:
+            return Response(str(error),status=400,mimetype="text/plain")
+        request_log(f"given batch of {len(items)} texts")
+
+        def synthesize_item(item:dict):
+            output_format = audio_formats.negotiate(item['format'] or request_format,item['rate'] or request_rate)
+            return glados.synthesize_audio(item['text'],output_format,planned_synthesis(item['text'])), output_format
+
+        # the request context is gone once the response streams
+        request_format, request_rate = request.args.get('format'), request.args.get('rate')
+        futures = [batch_pool.submit(synthesize_item,item) for item in items]
+
+        def generate():
+            try:
+                for index, future in enumerate(futures):
+                    try:
+                        audio_data, output_format = future.result()
+                    except OverBudget as error:
+                        yield encoder.error(index,413,str(error))
+                    except ValueError as error:
+                        yield encoder.error(index,406,str(error))
+                    except Exception as error:
+                        printed_log(f"Batch item {index} failed: {error}")
+                        yield encoder.error(index,500,str(error))
+                    else:
+                        yield encoder.item(index,audio_data,output_format.mimetype,output_format.extension)
+                yield encoder.close()
+            finally:
+                # items not started yet are dropped when the client went away
+                for future in futures:
+                    future.cancel()
+
+        return app.response_class(generate(),content_type=encoder.content_type)
+
     # --- / 
     # -- / also listening for requests that should be played locally on the server 
     # used for services sending a request they cannot speak themself 
     @app.route('/synthesize-local/', defaults={'text': ''},methods=["POST","GET"])
+    @app.route('/synthesize-local/<path:text>',methods=["POST","GET"])
     def synthesize_and_speak(text:str):
         '''
-        receives text and plays it locally
+        receives text and queues it for local playback, returns once it is queued
+        ?priority=<int> plays it before clips of lower priority
+        ?interrupt=1 cuts off the clip that is playing, &flush=1 also drops what the device buffered
         @param text: String, input text to be synthesized
-
         '''
-
-        
-        if text == "": 
-            # no explicit text provided
-            return 
-        # handling     
+        if player is None:
+            return no_player()
+        input_text:str = text
         if(request.method=="GET"):
             # receiving text as url encoded get request 
-            input_text = request.args.get('text')
+            input_text = request.args.get('text',input_text)
         elif(request.method=="POST"):
-            input_text = request.data.decode('ascii')
+            input_text = request.data.decode('utf-8')
+        if input_text == "":
+            return Response("no text provided",status=400,mimetype="text/plain")
+        try:
+            priority = int(request.args.get('priority',0))
+        except ValueError:
+            return Response("priority has to be an integer",status=400,mimetype="text/plain")
         # logging request
-        printed_log(f"Input text: {input_text}")
-        output_file = glados.generate_tts(input_text)
-        # playing sound locally
-        play_sound(output_file)
-        # removing file after it was played
-        remove_audio_file(output_file)
-        
+        request_log(f"Input text: {input_text}")
+        try:
+            pcm = glados.synthesize_pcm(input_text,planned_synthesis(input_text))
+        except OverBudget as error:
+            return over_budget(error)
+        ahead:int = player.enqueue(pcm,priority,is_enabled(request.args.get('interrupt')),
+                                   is_enabled(request.args.get('flush')),input_text[:64])
+        return dict(player.stats(),queued_ahead=ahead), 202
+
+    # queue of the local player, DELETE drops every queued clip and the one playing
+    @app.route('/playback', methods=["GET","DELETE"])
+    def playback_queue():
+        if player is None:
+            return no_player()
+        if request.method == "DELETE":
+            return dict(player.stats(),dropped=player.clear())
+        return player.stats()
+
     # --- /
     # -- / allowing to send promp and interact with lama interface via get-requests 
-    @app.route('/ask_llama/', defaults={'query': ''},methods=["GET"])
+    @app.route('/ask_llama/', defaults={'query': ''},methods=["GET","POST"])
+    @app.route('/ask_llama/<path:query>',methods=["GET","POST"])
     def synthesize_lama_response(query:str):
         '''
-        #FIXME redundant with synthesize_and_speak!
-        receives query and and plays it locally  
+        #FIXME redundant with synthesize!
+        receives query and returns its audio as wav, /synthesize-local/ plays it on the host
         '''
-        if query == "": 
-            # no explicit text provided
-            return 
-        # handling     
         if(request.method=="GET"):
             # receiving text as url encoded get request 
-            # FIXME improve typing
-            query:str = request.args.get('text')
+            query = request.args.get('text',query)
         elif(request.method=="POST"):
-            query:str = request.data.decode('ascii')
+            query = request.data.decode('utf-8')
+        if query == "": 
+            return Response("no text provided",status=400,mimetype="text/plain")
         # logging request
-        printed_log(f"Input text: {input_text}")
-        output_file = glados.generate_tts(input_text)
-        # playing sound locally
-        play_sound(output_file)
-        
-        
-        
-    
+        request_log(f"Input text: {query}")
+        try:
+            audio_data:bytes = glados.synthesize_audio(query,audio_formats.DEFAULT_FORMAT,planned_synthesis(query))
+        except OverBudget as error:
+            return over_budget(error)
+        return Response(audio_data,headers=audio_formats.response_headers(audio_formats.DEFAULT_FORMAT))
+
+    # --- /
+    # -- / pre-rendering a phrase catalog into the cache, see prerender.py
+    # POST takes the catalog as body (an empty body resumes the manifest) and ?format=name[:rate], repeatable
+    # GET reports the progress, DELETE stops the job after the current phrase
+    @app.route('/admin/prerender', methods=["GET","POST","DELETE"])
+    def prerender_catalog():
+        if request.method == "POST":
+            body:str = request.data.decode('utf-8')
+            try:
+                prerenderer.start(parse_catalog(body) if body.strip() else None,
+                                  parse_formats(request.args.getlist('format')))
+            except RuntimeError as error:
+                return Response(str(error),status=409,mimetype="text/plain")
+            except ValueError as error:
+                return Response(str(error),status=400,mimetype="text/plain")
+            return prerenderer.status(), 202
+        if request.method == "DELETE":
+            prerenderer.stop()
+        return prerenderer.status()
+
+    # --- /
+    # -- / per-stage latency histograms in the Prometheus text format
+    @app.route('/metrics', methods=["GET"])
+    def metrics_endpoint():
+        return Response(metrics.render(),content_type=metrics.CONTENT_TYPE)
+
+    return app
+
+def parse_arguments(arguments:Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="remote engine of the GLaDOS TTS")
+    parser.add_argument('--port', type=int, default=8124)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes forked after loading the models, each uses its share of the cpu cores")
+    parser.add_argument('--warm-up', choices=WARM_UP_POLICIES, default=None,
+                        help=f"runs before serving, defaults to ${WARM_UP_VARIABLE} or {DEFAULT_WARM_UP}")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=None,
+                        help=f"inference backend, defaults to ${BACKEND_VARIABLE} or {DEFAULT_BACKEND}")
+    admission.add_arguments(parser)
+    postprocess.add_arguments(parser)
+    return parser.parse_args(arguments)
+
+# If the script is run directly, assume remote engine
+if __name__ == "__main__":
+    # FIXME improve writing
+    # FIXME remove global state
+    args = parse_arguments()
+    printed_log("Initializing TTS Remote Engine...")
+    glados:Glados = Glados(backend=args.backend,postprocess=postprocess.from_arguments(args))
+    PORT:int = args.port
+    # requests arriving within BATCH_WAIT seconds are synthesized together
+    BATCH_SIZE:int = 8
+    BATCH_WAIT:float = 0.01
+    budget:Budget = admission.budget_from_arguments(args)
+
+    if args.workers > 1:
+        # models are loaded once on cpu and shared copy-on-write, workers warm up after the fork
+        import prefork
+        prefork.load_models(glados)
+        printed_log(f"Listening in http://localhost:{PORT}/synthesize/{'{PRHASE}'}")
+        prefork.serve(glados, lambda glados: create_app(glados,BatchScheduler(glados,BATCH_SIZE,BATCH_WAIT,args.aging).start(),budget,
+                                                        local_playback=False),
+                      "0.0.0.0", PORT, args.workers, args.warm_up)
+
+    glados.load_glados_model(args.warm_up)
+    scheduler:BatchScheduler = BatchScheduler(glados,BATCH_SIZE,BATCH_WAIT,args.aging).start()
+
+    printed_log("Initializing webserver")
+    app = create_app(glados,scheduler,budget)
+
     cli = sys.modules['flask.cli']
     cli.show_server_banner = lambda *x: None
     printed_log(f"Listening in http://localhost:{PORT}/synthesize/{'{PRHASE}'}")
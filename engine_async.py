@@ -0,0 +1,462 @@
+# --- /
+# -- / asyncio based serving mode of the remote engine
+# -- | same routes as engine.py, inference runs on one dedicated thread
+# -- | behind a bounded queue, full queues answer 503 with Retry-After,
+# -- | queued calls run shortest first and inputs over the budget are split or answered 413
+
+
+# --- /
+# -- / external imports
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import statistics
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+# --- /
+# -- / internal imports
+from glados import DEFAULT_WARM_UP, WARM_UP_POLICIES, WARM_UP_VARIABLE, Glados
+from prerender import Prerenderer, parse_catalog, parse_formats
+from utils import audio_formats, metrics, multipart
+from utils import admission, postprocess
+from utils.admission import DEFAULT_AGING, Budget, Estimate, OverBudget, priority
+from utils.backends import BACKEND_VARIABLE, BACKENDS, DEFAULT_BACKEND
+from utils.log import add_log_file, request_log
+from utils.playback import Player
+from utils.wav import wav_header
+
+# glados routes the root logger through its queue, the engine log is one more file of it
+add_log_file('glados_engine_service.log')
+
+
+# items of one /synthesize/batch request in the inference queue at a time
+BATCH_CONCURRENCY = 4
+
+
+def printed_log(message):
+    logging.info(message)
+    print(message)
+
+
+class QueueFull(Exception):
+
+    def __init__(self, retry_after:int):
+        super().__init__(f"inference queue is full, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+class InferenceQueue:
+    '''
+    runs blocking inference calls one at a time on a dedicated thread.
+    at most max_depth calls may be waiting or running, further submits
+    raise QueueFull. waiting calls are started cheapest first, a call that
+    waited is treated as cheaper by aging times its wait so long calls are
+    not starved, see utils.admission. calls whose caller went away before
+    they started are skipped
+    '''
+
+    def __init__(self, max_depth:int = 16, history:int = 1000, aging:float = DEFAULT_AGING):
+        self.max_depth = max_depth
+        self.aging = aging
+        self.depth:int = 0
+        self.rejected:int = 0
+        self.cancelled:int = 0
+        self.completed:int = 0
+        # seconds between submit and start of recent calls, and their run time
+        self.waits:Deque[float] = collections.deque(maxlen=history)
+        self.run_times:Deque[float] = collections.deque(maxlen=history)
+        self._lock = threading.Lock()
+        # (priority, sequence, future, function, args, submitted)
+        self._calls:List[tuple] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._running:bool = True
+        self._worker = threading.Thread(target=self._run, name="glados-inference", daemon=True)
+        self._worker.start()
+
+    def retry_after(self) -> int:
+        ''' seconds until a queue slot is expected to free up '''
+        run_time = statistics.mean(self.run_times) if self.run_times else 1.0
+        return max(1, round(run_time * self.depth / max(1, self.max_depth) + run_time))
+
+    def enqueue(self, function:Callable, *args, cost:float = 0.0) -> concurrent.futures.Future:
+        '''
+        thread safe, usable outside the event loop
+        @param cost: float, estimated seconds of the call
+        @return: future resolving to the result of function(*args) and the seconds it waited
+        raises QueueFull when max_depth calls are already queued
+        '''
+        with self._lock:
+            if self.depth >= self.max_depth:
+                self.rejected += 1
+                raise QueueFull(self.retry_after())
+            self.depth += 1
+        future:concurrent.futures.Future = concurrent.futures.Future()
+        future.add_done_callback(self._release)
+        submitted = time.perf_counter()
+        with self._condition:
+            heapq.heappush(self._calls, (priority(cost, submitted, self.aging), next(self._sequence),
+                                         future, function, args, submitted))
+            self._condition.notify()
+        return future
+
+    def call(self, function:Callable, *args, cost:float = 0.0) -> Any:
+        ''' blocking variant of submit for threads other than the event loop '''
+        return self.enqueue(function, *args, cost=cost).result()[0]
+
+    async def submit(self, function:Callable, *args, cost:float = 0.0) -> Any:
+        '''
+        @return: the result of function(*args), run on the inference thread
+        raises QueueFull when max_depth calls are already queued
+        '''
+        result, _ = await self.run(function, *args, cost=cost)
+        return result
+
+    async def run(self, function:Callable, *args, cost:float = 0.0) -> Tuple[Any, float]:
+        '''
+        like submit, also returns the seconds the call waited in the queue
+        '''
+        future = self.enqueue(function, *args, cost=cost)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # only calls that did not start yet can be cancelled
+            if future.cancel():
+                self.cancelled += 1
+            raise
+
+    def stats(self) -> Dict[str, float]:
+        waits = sorted(self.waits)
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'cancelled': self.cancelled,
+            'wait_ms_p50': waits[len(waits) // 2] * 1000 if waits else 0.0,
+            'wait_ms_p99': waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000 if waits else 0.0,
+            'wait_ms_max': waits[-1] * 1000 if waits else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        with self._condition:
+            self._running = False
+            calls, self._calls = self._calls, []
+            self._condition.notify()
+        for call in calls:
+            call[2].cancel()
+
+    def _release(self, future:concurrent.futures.Future) -> None:
+        # a call leaves the queue when it finished or was cancelled before it started
+        with self._lock:
+            self.depth -= 1
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while self._running and not self._calls:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                _, _, future, function, args, submitted = heapq.heappop(self._calls)
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.perf_counter()
+            self.waits.append(started - submitted)
+            try:
+                result = function(*args)
+            except BaseException as exception:
+                future.set_exception(exception)
+            else:
+                future.set_result((result, started - submitted))
+                self.completed += 1
+            finally:
+                self.run_times.append(time.perf_counter() - started)
+
+
+async def read_input_text(request:web.Request) -> str:
+    ''' text from ?text=, the url path or the body of a POST request '''
+    if request.method == "POST":
+        return (await request.read()).decode('utf-8')
+    return request.query.get('text', request.match_info.get('text', ''))
+
+
+def unavailable(error:QueueFull) -> web.Response:
+    return web.Response(status=503, text=str(error), headers={"Retry-After": str(error.retry_after)})
+
+
+def over_budget(error:OverBudget) -> web.Response:
+    return web.Response(status=413, text=str(error))
+
+
+def create_app(glados:Glados, inference:InferenceQueue, budget:Budget = Budget()) -> web.Application:
+    '''
+    @param glados: Glados, loaded tts engine
+    @param inference: InferenceQueue, runs every call into glados
+    @param budget: Budget, larger inputs are split into sentence groups or rejected with 413
+    @return: aiohttp application with the routes of engine.py
+    '''
+    routes = web.RouteTableDef()
+
+    async def synthesize_planned(synthesize_call:Callable, input_text:str, *args) -> Tuple[Any, Optional[float]]:
+        '''
+        @param synthesize_call: glados.synthesize_audio or glados.synthesize_pcm
+        @return: its result and the seconds it waited in the queue, None for split input
+        input within the budget is one queued call, otherwise every sentence group
+        is queued on its own so shorter requests run in between.
+        synthesize_call itself runs on an executor thread, only the model calls
+        are queued: its cache lookup and coalescing may wait for another request,
+        which must never happen on the inference thread that request waits for.
+        when the request is cancelled, its calls that did not start are cancelled
+        raises OverBudget and QueueFull
+        '''
+        loop = asyncio.get_running_loop()
+        # phonemizing counts the tokens, the phonemes are cached for the synthesis
+        pieces = await loop.run_in_executor(None, glados.plan, input_text, budget)
+        calls:List[concurrent.futures.Future] = []
+        waits:List[float] = []
+        lock = threading.Lock()
+        cancelled = threading.Event()
+
+        def synthesize_piece(text:str, cost:float) -> Any:
+            with lock:
+                if cancelled.is_set():
+                    raise concurrent.futures.CancelledError()
+                call = inference.enqueue(glados.get_waveform_from_text, text, cost=cost)
+                calls.append(call)
+            waveform, wait = call.result()
+            waits.append(wait)
+            return waveform
+
+        if len(pieces) > 1:
+            synthesize = glados.synthesize_in_pieces(pieces, synthesize_piece)
+        else:
+            synthesize = lambda text: synthesize_piece(text, pieces[0][1].seconds)
+        try:
+            result = await loop.run_in_executor(None, synthesize_call, input_text, *args, synthesize)
+        except asyncio.CancelledError:
+            with lock:
+                cancelled.set()
+                inference.cancelled += sum(call.cancel() for call in calls)
+            raise
+        if len(pieces) > 1:
+            return result, None
+        # cached and coalesced results did not wait in the queue
+        return result, waits[0] if waits else 0.0
+
+    # pre-rendering starts a phrase only while the queue is idle, its calls carry the background cost
+    prerenderer = Prerenderer(glados, lambda: inference.depth > 0,
+                              synthesize=lambda text, cost: inference.call(glados.get_waveform_from_text, text, cost=cost),
+                              budget=budget)
+    # one long-lived player process, started with the first clip
+    player = Player()
+
+    # registered before /synthesize/{text}, aiohttp matches routes in order
+    @routes.post('/synthesize/batch')
+    async def synthesize_batch(request:web.Request) -> web.StreamResponse:
+        ''' many texts in one request, the body and response are described in engine.py '''
+        try:
+            items = multipart.parse_request(await request.read())
+            encoder = multipart.BatchEncoder(multipart.container_of(request.query.get('container'),
+                                                                   request.headers.get('Accept')))
+        except ValueError as error:
+            return web.Response(status=400, text=str(error))
+        request_log(f"given batch of {len(items)} texts")
+        # a batch takes only a few queue slots at a time, its other items wait here instead of getting 503
+        slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def synthesize_item(item:dict) -> Tuple[bytes, audio_formats.OutputFormat]:
+            output_format = audio_formats.negotiate(item['format'] or request.query.get('format'),
+                                                    item['rate'] or request.query.get('rate'))
+            async with slots:
+                audio_data, _ = await synthesize_planned(glados.synthesize_audio, item['text'], output_format)
+            return audio_data, output_format
+
+        tasks = [asyncio.ensure_future(synthesize_item(item)) for item in items]
+        response = web.StreamResponse(headers={"Content-Type": encoder.content_type})
+        try:
+            await response.prepare(request)
+            for index, task in enumerate(tasks):
+                try:
+                    audio_data, output_format = await task
+                except QueueFull as error:
+                    await response.write(encoder.error(index, 503, str(error)))
+                except OverBudget as error:
+                    await response.write(encoder.error(index, 413, str(error)))
+                except ValueError as error:
+                    await response.write(encoder.error(index, 406, str(error)))
+                except Exception as error:
+                    printed_log(f"Batch item {index} failed: {error}")
+                    await response.write(encoder.error(index, 500, str(error)))
+                else:
+                    await response.write(encoder.item(index, audio_data, output_format.mimetype,
+                                                      output_format.extension))
+            await response.write(encoder.close())
+            await response.write_eof()
+        finally:
+            for task in tasks:
+                task.cancel()
+        return response
+
+    @routes.route("*", '/synthesize/')
+    @routes.route("*", '/synthesize/{text:.*}')
+    async def synthesize(request:web.Request) -> web.StreamResponse:
+        input_text = await read_input_text(request)
+        if input_text == "":
+            return web.Response(status=400, text="no text provided")
+        request_log(f"given text: {input_text}")
+        try:
+            output_format = audio_formats.negotiate(request.query.get('format'), request.query.get('rate'),
+                                                    request.headers.get('Accept'))
+        except ValueError as error:
+            return web.Response(status=406, text=str(error))
+
+        old_time = time.perf_counter()
+        if request.query.get('stream', '').lower() in ("1", "true", "yes", "on"):
+            if output_format != audio_formats.DEFAULT_FORMAT:
+                return web.Response(status=406, text="streaming is only available as 22050 Hz wav")
+            try:
+                pieces = await asyncio.get_running_loop().run_in_executor(None, glados.plan_sentences, input_text, budget)
+            except OverBudget as error:
+                return over_budget(error)
+            if not pieces:
+                return web.Response(status=400, text="no text provided")
+            return await stream_sentences(request, pieces, old_time)
+        try:
+            audio_data, wait = await synthesize_planned(glados.synthesize_audio, input_text, output_format)
+        except QueueFull as error:
+            return unavailable(error)
+        except OverBudget as error:
+            return over_budget(error)
+        request_log(f"Time Generating audio:  took {(time.perf_counter() - old_time) * 1000} ms")
+        headers = audio_formats.response_headers(output_format)
+        if wait is not None:
+            headers["X-Queue-Wait-Ms"] = f"{wait * 1000:.1f}"
+        return web.Response(body=audio_data, headers=headers)
+
+    async def stream_sentences(request:web.Request, pieces:List[Tuple[str, Estimate]],
+                               old_time:float) -> web.StreamResponse:
+        '''
+        @param pieces: sentences with their estimates, see Glados.plan_sentences
+        every sentence is queued at its estimated cost once the one before it was sent
+        '''
+        synthesize = lambda piece: inference.submit(glados.get_audio_from_text, piece[0], cost=piece[1].seconds)
+        try:
+            # the first sentence is synthesized before answering, so a full queue still yields a 503
+            audio = await synthesize(pieces[0])
+        except QueueFull as error:
+            return unavailable(error)
+        response = web.StreamResponse(headers=audio_formats.response_headers(audio_formats.DEFAULT_FORMAT))
+        await response.prepare(request)
+        await response.write(wav_header())
+        request_log(f"Time to first byte of audio:  took {(time.perf_counter() - old_time) * 1000} ms")
+        try:
+            for piece in pieces[1:]:
+                await response.write(memoryview(audio).cast('B'))
+                audio = await synthesize(piece)
+            await response.write(memoryview(audio).cast('B'))
+        except QueueFull:
+            printed_log("Inference queue full, stream ended early")
+        except (ConnectionResetError, asyncio.CancelledError):
+            printed_log("Client disconnected during stream")
+            raise
+        await response.write_eof()
+        return response
+
+    @routes.route("*", '/synthesize-local/')
+    @routes.route("*", '/synthesize-local/{text:.*}')
+    async def synthesize_and_speak(request:web.Request) -> web.Response:
+        ''' queues the audio for local playback, see engine.py for priority, interrupt and flush '''
+        input_text = await read_input_text(request)
+        if input_text == "":
+            return web.Response(status=400, text="no text provided")
+        try:
+            priority = int(request.query.get('priority', 0))
+        except ValueError:
+            return web.Response(status=400, text="priority has to be an integer")
+        request_log(f"Input text: {input_text}")
+        try:
+            pcm, _ = await synthesize_planned(glados.synthesize_pcm, input_text)
+        except QueueFull as error:
+            return unavailable(error)
+        except OverBudget as error:
+            return over_budget(error)
+        enabled = lambda flag: request.query.get(flag, '').lower() in ("1", "true", "yes", "on")
+        ahead = player.enqueue(pcm, priority, enabled('interrupt'), enabled('flush'), input_text[:64])
+        return web.json_response(dict(player.stats(), queued_ahead=ahead), status=202)
+
+    @routes.route("*", '/playback')
+    async def playback_queue(request:web.Request) -> web.Response:
+        ''' GET reports the local playback queue, DELETE drops every queued clip and the one playing '''
+        if request.method == "DELETE":
+            return web.json_response(dict(player.stats(), dropped=player.clear()))
+        return web.json_response(player.stats())
+
+    @routes.get('/queue')
+    async def queue_stats(request:web.Request) -> web.Response:
+        return web.json_response(dict(inference.stats(), coalescing=glados.inflight.stats()))
+
+    @routes.route("*", '/admin/prerender')
+    async def prerender_catalog(request:web.Request) -> web.Response:
+        ''' POST starts a catalog (empty body resumes the manifest), GET reports progress, DELETE stops '''
+        if request.method == "POST":
+            body = (await request.read()).decode('utf-8')
+            try:
+                prerenderer.start(parse_catalog(body) if body.strip() else None,
+                                  parse_formats(request.query.getall('format', [])))
+            except RuntimeError as error:
+                return web.Response(status=409, text=str(error))
+            except ValueError as error:
+                return web.Response(status=400, text=str(error))
+            return web.json_response(prerenderer.status(), status=202)
+        if request.method == "DELETE":
+            await asyncio.get_running_loop().run_in_executor(None, prerenderer.stop)
+        return web.json_response(prerenderer.status())
+
+    @routes.get('/metrics')
+    async def metrics_endpoint(request:web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+    async def shutdown(app:web.Application) -> None:
+        prerenderer.stop()
+        player.stop()
+        inference.shutdown()
+
+    app = web.Application()
+    app.add_routes(routes)
+    app.on_shutdown.append(shutdown)
+    return app
+
+
+def main(arguments:Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="asyncio serving mode of the GLaDOS TTS engine")
+    parser.add_argument('--port', type=int, default=8124)
+    parser.add_argument('--queue-depth', type=int, default=16,
+                        help="requests waiting for or running inference before new ones get 503")
+    parser.add_argument('--warm-up', choices=WARM_UP_POLICIES, default=None,
+                        help=f"runs before serving, defaults to ${WARM_UP_VARIABLE} or {DEFAULT_WARM_UP}")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=None,
+                        help=f"inference backend, defaults to ${BACKEND_VARIABLE} or {DEFAULT_BACKEND}")
+    admission.add_arguments(parser)
+    postprocess.add_arguments(parser)
+    args = parser.parse_args(arguments)
+
+    printed_log("Initializing TTS Remote Engine (async)...")
+    glados = Glados(backend=args.backend, postprocess=postprocess.from_arguments(args))
+    glados.load_glados_model(args.warm_up)
+    app = create_app(glados, InferenceQueue(args.queue_depth, aging=args.aging), admission.budget_from_arguments(args))
+    printed_log(f"Listening in http://localhost:{args.port}/synthesize/{'{PRHASE}'}")
+    # handlers are cancelled when their client disconnects
+    web.run_app(app, host="0.0.0.0", port=args.port, print=None, handler_cancellation=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,17 @@
 
 # --- / 
 # -- / external imports
+import time
+# phonemizer and inflect are imported with the first request that needs them
+_import_started = time.perf_counter()
 import numpy
 import numpy.typing
 import torch
-import random
 import logging
-from scipy.io.wavfile import write
-import time
 import os
 from sys import modules as mod
 import sys
-
-from torch.jit import ScriptFunction, ScriptModule
+from typing import Callable, Iterator, List, Tuple
 
 try:
     import winsound
@@ -26,17 +25,53 @@ except ImportError:
 
 # --- /
 # -- / internal imports
-from utils.tools import prepare_text
+from utils.admission import Budget, CostModel, Estimate
+from utils import admission
+from utils.backends import InferenceBackend, create_backend
+from utils.cache import AudioCache, cache_key
+from utils import cpu_tuning
+from utils.cpu_tuning import DEFAULT_SETTINGS, CpuSettings
+from utils.frontend import TextFrontend
+from utils.tools import split_sentences
+from utils.vocoder import ChunkedVocoder
+from utils import audio_formats
+from utils.audio_formats import DEFAULT_FORMAT, OutputFormat
+from utils.postprocess import DEFAULT_POSTPROCESS, PostProcess, process_batch
+from utils.singleflight import SingleFlight
+from utils.startup import StartupProfile
+from utils.log import request_log, setup_logging
+from utils import metrics
+from utils.wav import SAMPLE_RATE, WAV_HEADER_SIZE
+
+_import_seconds = time.perf_counter() - _import_started
 
 # --- / 
 # -- / configuring logging module
-logging.basicConfig(filename='glados_service.log',
-    format='[%(asctime)s.%(msecs)03d] [%(levelname)s]\t%(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',level=logging.DEBUG)
+# records are written by a background thread, per-request records are sampled
+setup_logging('glados_service.log')
 
 # FIXME remove global state
 #Global variables
 audio_path = os.getcwd()+'/audio/'
+glados_model_path = 'models/glados.pt'
+vocoder_model_path = 'models/vocoder-gpu.pt'
+# written by: python -m utils.backends export
+onnx_glados_model_path = 'models/glados.onnx'
+onnx_vocoder_model_path = 'models/vocoder.onnx'
+MODEL_PATHS = {
+    'torchscript': (glados_model_path, vocoder_model_path),
+    'onnx': (onnx_glados_model_path, onnx_vocoder_model_path),
+}
+
+# warm-up policies: none, one short utterance, or one utterance per token length in WARM_UP_SHAPES
+WARM_UP_POLICIES = ('none', 'minimal', 'shapes')
+WARM_UP_VARIABLE = 'GLADOS_WARM_UP'
+DEFAULT_WARM_UP = 'minimal'
+WARM_UP_SHAPES = (16, 64, 128, 256)
+# "the cake is a lie." as the frontend phonemizes it, warming up does not need espeak
+WARM_UP_PHONEMES = 'ðə keɪk ɪz ɐ laɪ.'
+# largest difference to the output of a row run alone, relative to its peak, a padded batch may show
+BATCH_PARITY_TOLERANCE = 1e-3
 
 # --- / 
 # -- / definition of Glados class 
@@ -44,59 +79,181 @@ audio_path = os.getcwd()+'/audio/'
 class Glados:
     
     # FIXME improve writing
-    glados_model:ScriptModule = None
-    vocoder:ScriptFunction = None
+    # acoustic model and vocoder
+    backend:InferenceBackend = None
     device:str = None
-
-
-    def __init__(self):
+    frontend:TextFrontend = None
+    cache:AudioCache = None
+    model_version:str = None
+    startup:StartupProfile = None
+    # identical cache misses in flight at the same time are synthesized once
+    inflight:SingleFlight = None
+    # predicts mel frames and inference seconds of a text, see utils.admission
+    cost:CostModel = None
+    # execution settings on cpu, see utils.cpu_tuning
+    settings:CpuSettings = DEFAULT_SETTINGS
+    # mel frames per vocoder call, None runs the vocoder over the whole utterance
+    vocoder_window:int = None
+    vocoder_overlap:int = 16
+    # cleared when the models turn out not to support padded batches
+    batch_acoustic:bool = True
+    batch_vocoder:bool = True
+    # cleared when padding changes the output of the glados model, rows are then
+    # only batched with rows of the same token length, see check_batch_parity
+    pad_acoustic:bool = True
+    batch_checked:bool = False
+
+
+    def __init__(self, vocoder_window:int = None, vocoder_overlap:int = 16, backend:str = None,
+                 postprocess:PostProcess = None):
         ''' 
         loads models and checks if audio folder exists
+        @param vocoder_window: int, caps vocoder memory by running it on windows of this many mel frames
+        @param vocoder_overlap: int, mel frames shared and crossfaded between windows
+        @param backend: String, torchscript or onnx, defaults to $GLADOS_BACKEND or torchscript
+        @param postprocess: PostProcess, normalization, silence trim and fades of every utterance
         '''
+        self.backend = create_backend(backend, MODEL_PATHS)
+        self.startup = StartupProfile()
+        self.startup.record('imports', _import_seconds)
         check_audio_folder()
-
-    def get_available_device(self,option_devices):
+        # synthesized audio, addressed by phonemes and model version
+        self.cache = AudioCache(audio_path)
+        self.inflight = SingleFlight()
+        self.cost = CostModel()
+        self.vocoder_window = vocoder_window
+        self.vocoder_overlap = vocoder_overlap
+        self.postprocess = postprocess or DEFAULT_POSTPROCESS
+        # built once, holds the espeak session, lexicon and symbol lookup table
+        with self.startup.phase('init'):
+            self.frontend = TextFrontend.default()
+
+    def get_available_devices(self,option_devices:List[str]) -> List[str]:
         '''
-        selects available devices to run model on 
+        @param option_devices: preferred devices in order of preference
+        @return: the available ones among them, followed by cpu
         options are: 
         - vulkan
         - cuda
         - cpu 
         '''
-        if torch.is_vulkan_available() and ("vulkan" in option_devices):
-            device_found = 'vulkan'
-        elif torch.cuda.is_available() and  ("cuda" in option_devices):
-            device_found = 'cuda'
-        else:
-            device_found = 'cpu'
-        printed_log(f"Device selected: {device_found}.")
-        return device_found
+        available = {
+            'vulkan': torch.is_vulkan_available(),
+            'cuda': torch.cuda.is_available(),
+        }
+        return [device for device in option_devices if available.get(device)] + ['cpu']
 
     def load_models(self):
-        try:
-            self.glados_model = torch.jit.load('models/glados.pt')
-            self.vocoder = torch.jit.load('models/vocoder-gpu.pt', map_location=self.device)
-        except Exception as exception:
+        '''
+        loads both models onto self.device, raises when that fails
+        '''
+        self.backend.load(self.device)
+        self.model_version = self.backend.version()
+
+    def warm_up(self, policy:str = None):
+        '''
+        @param policy: String, one of WARM_UP_POLICIES, defaults to $GLADOS_WARM_UP or minimal
+        runs both models on fixed phonemes so espeak stays unloaded. every
+        input runs twice, the TorchScript profiling executor optimizes a
+        graph for an input shape on its second call
+        '''
+        policy = policy or os.environ.get(WARM_UP_VARIABLE, DEFAULT_WARM_UP)
+        if policy not in WARM_UP_POLICIES:
+            raise ValueError(f"Unknown warm-up policy: {policy}, choose from {', '.join(WARM_UP_POLICIES)}")
+        if policy == 'none':
+            return
+        tokens = self.frontend.encode(WARM_UP_PHONEMES)
+        lengths = [len(tokens)] if policy == 'minimal' else WARM_UP_SHAPES
+        # the backend is called directly, warm-up runs stay out of the metrics
+        vocoder = self.backend.vocode if self.vocoder_window is None else \
+            ChunkedVocoder(self.backend.vocode, self.vocoder_window, self.vocoder_overlap)
+        with self.startup.phase('warm-up'), self.settings.grad_context():
+            for length in lengths:
+                # the phonemes repeated up to the wanted number of tokens
+                sequence = torch.from_numpy(numpy.resize(tokens, length)).unsqueeze(0)
+                for _ in range(2):
+                    mel = self.backend.generate(sequence)['mel_post'].to(self.device)
+                    vocoder(mel)
+        self.check_batch_parity()
+
+    def check_batch_parity(self):
+        '''
+        runs utterances of two lengths as a padded batch and one at a time.
+        the cache does not record how audio was synthesized, so padding must not
+        change it: padded acoustic batches fall back to batches of equal token
+        length, padded vocoder batches to one mel spectrogram at a time
+        '''
+        self.batch_checked = True
+        tokens = self.frontend.encode(WARM_UP_PHONEMES)
+        # two rows of equal length with different durations, and a longer one padding them
+        sequences = [tokens, numpy.ascontiguousarray(tokens[::-1]), numpy.resize(tokens, 3 * len(tokens))]
+        with self.startup.phase('batch check'), self.settings.grad_context():
+            serial = [self.generate(torch.from_numpy(sequence).unsqueeze(0))['mel_post'] for sequence in sequences]
+            if self.batch_acoustic:
+                try:
+                    if not matches(self.padded_mels(*TextFrontend.pad(sequences)), serial):
+                        self.pad_acoustic = False
+                        if matches(self.padded_mels(*TextFrontend.pad(sequences[:2])), serial[:2]):
+                            printed_log("Padding changes the glados model output, batching rows of equal length only")
+                        else:
+                            printed_log("Batching changes the glados model output, batching disabled")
+                            self.batch_acoustic = False
+                except Exception as exception:
+                    printed_log(f"Glados model cannot run padded batches, batching disabled: {exception}")
+                    self.batch_acoustic = False
+            if self.batch_vocoder:
+                try:
+                    if not matches(self.padded_vocode(serial), [self.vocode(mel.to(self.device)) for mel in serial]):
+                        printed_log("Padding changes the vocoder output, batching disabled")
+                        self.batch_vocoder = False
+                except Exception as exception:
+                    printed_log(f"Vocoder cannot run padded batches, batching disabled: {exception}")
+                    self.batch_vocoder = False
+
+    def load_glados_model(self, warm_up:str = None, devices:List[str] = None, cpu_settings:CpuSettings = None):
+        '''
+        @param warm_up: String, warm-up policy, see warm_up. processes forked
+        after loading should pass none and warm up in the child instead
+        @param devices: preferred devices, cpu is always tried last
+        @param cpu_settings: CpuSettings applied on cpu, defaults to the ones saved by autotune
+        tries every available device once and exits when none can load the models
+        '''
+        for device in self.get_available_devices(["vulkan","cuda"] if devices is None else devices):
+            self.device = device
+            printed_log(f"Device selected: {device}.")
+            try:
+                with self.startup.phase('model load'):
+                    self.load_models()
+                break
+            except Exception as exception:
+                printed_log(f"Exception loading device {device}: {exception}")
+                self.backend.unload()
+        if not self.backend.loaded:
             printed_log("could not load glados or vocoder")
-            printed_log(exception)
-            sys.exit()
-        # preloading model with test-run 
-        for i in range(4):
-            init = self.glados_model.generate_jit(prepare_text(str(i)))
-            init_mel = init['mel_post'].to(self.device)
-            init_vo = self.vocoder(init_mel)
+            sys.exit(1)
+        if self.device == 'cpu':
+            self.tune_for_cpu(cpu_settings or cpu_tuning.load_settings() or DEFAULT_SETTINGS)
+        self.warm_up(warm_up)
         printed_log(f"Models loaded.")
+        printed_log(self.startup.report())
+
+    def tune_for_cpu(self, settings:CpuSettings) -> None:
+        '''
+        @param settings: CpuSettings, thread counts, freezing and quantization to apply
+        replaces the loaded models by their tuned versions
+        '''
+        with self.startup.phase('tuning'):
+            self.backend.tune(settings)
+        self.settings = settings
+        printed_log(f"CPU settings: {settings}")
 
-    def load_glados_model(self):
-        option_devices = ["vulkan","cuda"]
-        while(self.glados_model==None):
-            self.device = self.get_available_device(option_devices)
-            # try:
-            self.load_models()
-            # except:
-            printed_log(f"Exception loading device "+self.device)
-            # removing device from list of available devices
-            #if(self.device != 'cpu'): option_devices.remove(self.device)
+    def record_first_request(self, started:float) -> None:
+        '''
+        @param started: float, time.perf_counter() when the request started
+        the first request pays for everything loaded lazily, e.g. espeak
+        '''
+        if self.startup.record_once('first request', time.perf_counter() - started):
+            printed_log(self.startup.report())
 
     def get_audio_from_text(self,text) -> numpy.typing.NDArray:
         '''
@@ -105,49 +262,378 @@ class Glados:
         @return: numpy array, audio data 
         prepares text and pipes it through model
         '''
+        # Normalize audio to fit in wav-file
+        return audio_to_int16(self.get_waveform_from_text(text))
+
+    def get_waveform_from_text(self, text:str) -> torch.Tensor:
+        '''
+        @param text: String, input text to be synthesized
+        @return: tensor, float vocoder output on the vocoder device
+        '''
+        started = time.perf_counter()
     	# Tokenize, clean and phonemize input text
-        phonemized_text = prepare_text(text)
-        with torch.no_grad():
+        phonemized_text = self.frontend(text)
+        with self.settings.grad_context():
             # Generate generic TTS-output
             old_time = time.time()
-            tts_output = self.glados_model.generate_jit(phonemized_text)
+            synthesis_started = time.perf_counter()
+            tts_output = self.generate(phonemized_text)
 
             # Use HiFiGAN as vocoder to make output sound like GLaDOS
             mel = tts_output['mel_post']
-            audio = self.vocoder(mel)
+            audio = self.vocode(mel).squeeze()
+            audio_seconds = audio.shape[-1] / SAMPLE_RATE
+            synthesis_seconds = time.perf_counter() - synthesis_started
+            metrics.observe_utterance(phonemized_text.shape[-1], mel.shape[-1], audio_seconds)
+            metrics.observe_real_time_factor(synthesis_seconds, audio_seconds)
+            self.cost.observe(phonemized_text.shape[-1], mel.shape[-1], synthesis_seconds)
+            audio = self.finish_waveforms([audio])[0]
             print_timelapse("The audio sample: ",old_time)
+        self.record_first_request(started)
+        return audio
+
+    def generate(self, tokens:torch.Tensor) -> dict:
+        '''
+        @param tokens: int tensor (batch, tokens)
+        @return: dict of the glados model output, 'mel_post' and 'dur'
+        '''
+        with metrics.stage('acoustic'):
+            return self.backend.generate(tokens)
+
+    def run_vocoder(self, mel:torch.Tensor) -> torch.Tensor:
+        with metrics.stage('vocoder'):
+            return self.backend.vocode(mel)
+
+    def vocode(self, mel:torch.Tensor) -> torch.Tensor:
+        '''
+        @param mel: tensor, mel spectrogram produced by the glados model
+        @return: tensor, audio data
+        runs the vocoder in windows of vocoder_window frames when configured
+        '''
+        if self.vocoder_window is None:
+            return self.run_vocoder(mel)
+        return self.chunked_vocoder()(mel)
+
+    def chunked_vocoder(self) -> ChunkedVocoder:
+        return ChunkedVocoder(self.run_vocoder, self.vocoder_window, self.vocoder_overlap)
+
+    def stream_audio_from_text(self, text:str) -> Iterator[numpy.typing.NDArray]:
+        '''
+        @param text: String, input text to be synthesized
+        @return: generator of numpy arrays, audio data of one sentence each
+        runs model and vocoder sentence by sentence, so the first sentence
+        can be played while the rest is still being synthesized.
+        with a vocoder_window every window is yielded as soon as it is vocoded
+        '''
+        for sentence in split_sentences(text):
+            if self.vocoder_window is None:
+                yield self.get_audio_from_text(sentence)
+                continue
+            with self.settings.grad_context():
+                mel = self.generate(self.frontend(sentence))['mel_post']
+                chunks = self.chunked_vocoder().stream(mel)
+            while True:
+                # grad mode is thread local, keep it disabled only while vocoding
+                with self.settings.grad_context():
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                yield audio_to_int16(chunk)
+
+    def get_audio_from_batch(self, texts:List[str]) -> List[numpy.typing.NDArray]:
+        '''
+        @param texts: list of input texts to be synthesized together
+        @return: list of numpy arrays, audio data in the order of texts
+        '''
+        return [audio_to_int16(waveform) for waveform in self.get_waveforms_from_batch(texts)]
+
+    def get_waveforms_from_batch(self, texts:List[str]) -> List[torch.Tensor]:
+        '''
+        @param texts: list of input texts to be synthesized together
+        @return: list of float tensors, vocoder output in the order of texts
+        pads the token sequences into one batch for the glados model and the
+        mel spectrograms into one batch for the vocoder, falls back to one
+        sequence at a time for models that cannot batch
+        '''
+        started = time.perf_counter()
+        tokens, lengths = self.frontend.batch(texts)
+        audio = self.get_waveforms_from_tokens(tokens, lengths)
+        self.record_first_request(started)
+        return audio
 
-            # Normalize audio to fit in wav-file
-            audio = audio.squeeze()
-            audio = audio * 32768.0
-            audio = audio.cpu().numpy().astype('int16')
+    def get_waveforms_from_tokens(self, tokens:torch.Tensor, lengths:torch.Tensor) -> List[torch.Tensor]:
+        '''
+        @param tokens: int tensor (batch, tokens), padded token ids, e.g. from TextFrontend.pad
+        @param lengths: int tensor (batch), number of valid tokens per row
+        @return: list of float tensors, vocoder output in the order of the rows
+        model stage of get_waveforms_from_batch, for callers that phonemize elsewhere
+        '''
+        if not self.batch_checked and len(lengths) > 1:
+            # warm-up was skipped, the first batch checks before it is cached
+            self.check_batch_parity()
+        with self.settings.grad_context():
+            old_time = time.time()
+            synthesis_started = time.perf_counter()
+            mels = self.generate_mel_batch(tokens, lengths)
+            audio = [sample.squeeze() for sample in self.vocode_batch(mels)]
+            total_seconds = 0.0
+            for length, mel, sample in zip(lengths.tolist(), mels, audio):
+                audio_seconds = sample.shape[-1] / SAMPLE_RATE
+                metrics.observe_utterance(length, mel.shape[-1], audio_seconds)
+                total_seconds += audio_seconds
+            synthesis_seconds = time.perf_counter() - synthesis_started
+            metrics.observe_real_time_factor(synthesis_seconds, total_seconds)
+            self.cost.observe(int(lengths.sum()), sum(mel.shape[-1] for mel in mels), synthesis_seconds)
+            audio = self.finish_waveforms(audio)
+            print_timelapse(f"The batch of {len(audio)} audio samples: ",old_time)
         return audio
 
+    def generate_mel_batch(self, tokens:torch.Tensor, lengths:torch.Tensor) -> List[torch.Tensor]:
+        '''
+        @param tokens: int tensor (batch, tokens), padded token ids
+        @param lengths: int tensor (batch), number of valid tokens per row
+        @return: list of mel spectrograms (1, n_mels, frames) without padding
+        runs the rows as one padded batch, or as one batch per token length when
+        padding changes the output, see check_batch_parity
+        '''
+        if self.batch_acoustic and len(lengths) > 1:
+            try:
+                if self.pad_acoustic:
+                    return self.padded_mels(tokens, lengths)
+                mels:List[torch.Tensor] = [None] * len(lengths)
+                for length in set(lengths.tolist()):
+                    rows = (lengths == length).nonzero().flatten()
+                    if len(rows) == 1:
+                        mels[int(rows[0])] = self.generate(tokens[rows, :length])['mel_post']
+                        continue
+                    for row, mel in zip(rows.tolist(), self.padded_mels(tokens[rows, :length], lengths[rows])):
+                        mels[row] = mel
+                return mels
+            except Exception as exception:
+                printed_log(f"Glados model cannot run padded batches, batching disabled: {exception}")
+            self.batch_acoustic = False
+        return [self.generate(tokens[i:i+1, :int(lengths[i])])['mel_post']
+                for i in range(len(lengths))]
+
+    def padded_mels(self, tokens:torch.Tensor, lengths:torch.Tensor) -> List[torch.Tensor]:
+        '''
+        @return: list of mel spectrograms of one padded batch, cut to the frames of every row
+        pad tokens are seen by the encoder but get no frames of their own
+        '''
+        tts_output = self.generate(tokens)
+        mel = tts_output['mel_post']
+        # frames per token as rounded by the length regulator
+        frames_per_token = (tts_output['dur'].clamp(min=0) + 0.5).long()
+        mask = torch.arange(tokens.shape[1]).unsqueeze(0) < lengths.unsqueeze(1)
+        frames = (frames_per_token * mask.to(frames_per_token.device)).sum(dim=1)
+        if int(frames.max()) > mel.shape[-1]:
+            raise ValueError("model output does not match its durations")
+        return [mel[i:i+1, :, :int(frames[i])] for i in range(len(lengths))]
+
+    def vocode_batch(self, mels:List[torch.Tensor]) -> List[torch.Tensor]:
+        '''
+        @param mels: list of mel spectrograms (1, n_mels, frames)
+        @return: list of audio tensors, one per mel spectrogram
+        '''
+        if self.batch_vocoder and len(mels) > 1:
+            try:
+                return self.padded_vocode(mels)
+            except Exception as exception:
+                printed_log(f"Vocoder cannot run padded batches, batching disabled: {exception}")
+                self.batch_vocoder = False
+        return [self.vocode(mel.to(self.device)) for mel in mels]
+
+    def padded_vocode(self, mels:List[torch.Tensor]) -> List[torch.Tensor]:
+        '''
+        pads every mel spectrogram with its own silence level, runs the
+        vocoder once and cuts the padding off the resulting audio
+        '''
+        frames = [mel.shape[-1] for mel in mels]
+        longest = max(frames)
+        batch = torch.stack([torch.nn.functional.pad(mel[0], (0, longest - mel.shape[-1]), value=float(mel.min()))
+                             for mel in mels]).to(self.device)
+        audio = self.vocode(batch).reshape(len(mels), -1)
+        hop_length = audio.shape[-1] // longest
+        return [audio[i, :frames[i] * hop_length] for i in range(len(mels))]
+
+    def finish_waveforms(self, waveforms:List[torch.Tensor]) -> List[torch.Tensor]:
+        '''
+        @param waveforms: list of float tensors, vocoder output on the vocoder device
+        @return: list of float tensors, clipped, normalized, trimmed and faded on that device
+        the whole batch is processed at once, see utils.postprocess
+        '''
+        with metrics.stage('postprocess'):
+            return process_batch(waveforms, self.postprocess)
+
+    def count_tokens(self, input_text:str) -> int:
+        ''' phoneme tokens of the text, the phonemes are cached for the synthesis that follows '''
+        return len(self.frontend.encode(self.frontend.phonemize(input_text)))
+
+    def estimate_cost(self, input_text:str) -> Estimate:
+        '''
+        @param input_text: String, input text to be synthesized
+        @return: Estimate, tokens, predicted mel frames and inference seconds
+        '''
+        return self.cost.estimate(self.count_tokens(input_text))
+
+    def plan(self, input_text:str, budget:Budget) -> List[Tuple[str, Estimate]]:
+        '''
+        @param budget: Budget, most frames and seconds a single synthesis may take
+        @return: list of the pieces to synthesize with their estimates, the text
+            itself or sentence groups within the budget
+        raises utils.admission.OverBudget for input that cannot be split within the budget
+        '''
+        return admission.plan(input_text, self.count_tokens, self.cost, budget, split_sentences)
+
+    def plan_sentences(self, input_text:str, budget:Budget) -> List[Tuple[str, Estimate]]:
+        '''
+        @return: list of the sentences to stream with their estimates, each planned on its own
+        raises utils.admission.OverBudget for a sentence that cannot be split within the budget
+        '''
+        return [piece for sentence in split_sentences(input_text) for piece in self.plan(sentence, budget)]
+
+    def synthesize_in_pieces(self, pieces:List[Tuple[str, Estimate]],
+                             synthesize:Callable[[str, float], torch.Tensor]) -> Callable[[str], torch.Tensor]:
+        '''
+        @param pieces: list of texts with estimates, as returned by plan
+        @param synthesize: function turning a piece and its estimated seconds into the vocoder waveform
+        @return: synthesize function for synthesize_audio that joins the audio of the pieces
+        '''
+        return lambda input_text: torch.cat([synthesize(piece, estimate.seconds).reshape(-1)
+                                             for piece, estimate in pieces])
+
+    def audio_cache_key(self, input_text:str, variant:str = DEFAULT_FORMAT.variant) -> str:
+        '''
+        @param input_text: String, input text to be synthesized
+        @param variant: String, output format and sample rate
+        @return: String, content address of the audio in the cache
+        the key hashes the phonemes, so texts that are spoken alike share one file
+        '''
+        phonemes = self.frontend.phonemize(input_text)
+        # windowed vocoding changes the samples slightly
+        version = f"{self.model_version}:{self.vocoder_window}:{self.vocoder_overlap}:{self.settings.variant}:{self.postprocess.variant}"
+        return cache_key(phonemes, version, variant)
+
+    def coalesce(self, key:tuple, function:Callable[[], object]) -> object:
+        '''
+        @param key: tuple, identifies the result, e.g. kind of result and cache key
+        @return: result of function, shared with every caller of the same key while it runs
+        '''
+        result, coalesced = self.inflight.do(key, function)
+        if coalesced:
+            metrics.COALESCED_REQUESTS.inc()
+        return result
+
     # Generate audio file from given text as string
     # @return String, denoting path to saved file
-    def generate_tts(self, input_text:str) -> str:
+    def generate_tts(self, input_text:str, synthesize:Callable[[str], torch.Tensor] = None) -> str:
         '''
         #FIXME improve writing
         @param input_text: String, input text to be synthesized
-        @return: String, denoting path to saved file
-        generates audio file from given text, saves it to disk and returns path to file 
+        @param synthesize: optional function turning text into the vocoder waveform, e.g. a batching scheduler
+        @return: String, denoting path to the cached file, callers must not delete it
+        looks the audio up in the cache and synthesizes and caches it when missing,
+        concurrent requests for the same phonemes wait for one synthesis
         '''
-        filename = filename_parse(input_text)
-        audio_file_exist = check_audio_file(filename)
-        if (audio_file_exist):
-            output_file:str = f"{audio_path}{filename}"
-        else:
-            audio = self.get_audio_from_text(input_text)
-            output_file:str = save_audio_file(audio)
-        return output_file
-
+        key = self.audio_cache_key(input_text)
+        with metrics.stage('cache_io'):
+            output_file = self.cache.get(key, DEFAULT_FORMAT.extension)
+        if output_file is not None:
+            return output_file
+
+        def synthesize_file() -> str:
+            # an identical request may have finished between the lookup and now
+            output_file = self.cache.get(key, DEFAULT_FORMAT.extension)
+            if output_file is not None:
+                return output_file
+            metrics.SYNTHESES.inc()
+            waveform = (synthesize or self.get_waveform_from_text)(input_text)
+            data = audio_formats.encode(waveform, DEFAULT_FORMAT)
+            with metrics.stage('cache_io'):
+                return self.cache.put(key, data, DEFAULT_FORMAT.extension)
+
+        return self.coalesce(('file', key), synthesize_file)
+
+    def synthesize_audio(self, input_text:str, output_format:OutputFormat = DEFAULT_FORMAT,
+                         synthesize:Callable[[str], torch.Tensor] = None) -> bytes:
+        '''
+        @param input_text: String, input text to be synthesized
+        @param output_format: OutputFormat, encoding and sample rate of the result
+        @param synthesize: optional function turning text into the vocoder waveform, e.g. a batching scheduler
+        @return: bytes, encoded audio
+        like generate_tts but without touching the disk on the response path,
+        cached audio is read from memory when possible and new audio is
+        encoded in memory, the cache decides whether to persist it.
+        other formats are converted from the cached default wav when present,
+        every converted variant is cached as well. concurrent requests for
+        the same phonemes and format wait for one synthesis
+        '''
+        key = self.audio_cache_key(input_text, output_format.variant)
+        with metrics.stage('cache_io'):
+            data = self.cache.get_bytes(key, output_format.extension)
+        if data is not None:
+            return data
+        return self.coalesce(('bytes', key), lambda: self._synthesize_missing(input_text, key, output_format, synthesize))
+
+    def synthesize_pcm(self, input_text:str, synthesize:Callable[[str], torch.Tensor] = None) -> memoryview:
+        '''
+        @param input_text: String, input text to be synthesized
+        @return: memoryview, 16 bit mono samples at SAMPLE_RATE, the cached wav without its header
+        '''
+        return memoryview(self.synthesize_audio(input_text, DEFAULT_FORMAT, synthesize))[WAV_HEADER_SIZE:]
+
+    def _synthesize_missing(self, input_text:str, key:str, output_format:OutputFormat,
+                            synthesize:Callable[[str], torch.Tensor] = None) -> bytes:
+        # an identical request may have finished between the lookup and now
+        data = self.cache.get_bytes(key, output_format.extension)
+        if data is not None:
+            return data
+        waveform = None
+        if output_format != DEFAULT_FORMAT:
+            wav_key = self.audio_cache_key(input_text)
+            with metrics.stage('cache_io'):
+                wav_data = self.cache.get_bytes(wav_key)
+            if wav_data is not None:
+                waveform = torch.from_numpy(numpy.frombuffer(wav_data, dtype=numpy.int16, offset=WAV_HEADER_SIZE).astype(numpy.float32)) / audio_formats.PCM_SCALE
+        if waveform is None:
+            metrics.SYNTHESES.inc()
+            waveform = (synthesize or self.get_waveform_from_text)(input_text)
+        data = audio_formats.encode(waveform, output_format)
+        with metrics.stage('cache_io'):
+            self.cache.put(key, data, output_format.extension)
+        return data
+
+
+def matches(batched:List[torch.Tensor], serial:List[torch.Tensor]) -> bool:
+    '''
+    @return: bool, true when every batched output has the shape of its serial one
+        and differs from it by at most BATCH_PARITY_TOLERANCE of its peak
+    '''
+    for output, reference in zip(batched, serial):
+        output, reference = output.reshape(-1).float().cpu(), reference.reshape(-1).float().cpu()
+        if output.shape != reference.shape:
+            return False
+        peak = float(reference.abs().max()) or 1.0
+        if float((output - reference).abs().max()) > BATCH_PARITY_TOLERANCE * peak:
+            return False
+    return True
+
+def audio_to_int16(audio:torch.Tensor) -> numpy.typing.NDArray:
+    '''
+    @param audio: tensor, vocoder output in the range of -1 to 1
+    @return: numpy array, 16 bit audio data to fit in wav-file
+    converted on the tensor's device, only the 16 bit samples are copied to the host
+    '''
+    with metrics.stage('postprocess'):
+        return audio_formats.to_pcm(audio.squeeze()).to(torch.int16).cpu().numpy()
 
 def printed_log(message) -> None:
     logging.info(message)
     print(message)
 
 def print_timelapse(processName:str,old_time:float) -> None:
-    printed_log(f"{processName} took {str((time.time() - old_time) * 1000)} ms")
+    # per-request timing, stage histograms are served on /metrics
+    request_log(f"{processName} took {str((time.time() - old_time) * 1000)} ms")
 
 def play_sound(fileName:str) -> None:
     '''
@@ -160,66 +646,10 @@ def play_sound(fileName:str) -> None:
     else:
         call(["aplay", fileName])
 
-def filename_parse(input_text:str) -> str:
-    '''
-    @param input_text: String, input text to be synthesized
-    @return: String, denoting path to saved file
-    replaces special characters to create easy to use filename adds ".wav" to obtained filename
-    '''
-    replace_char_with = { 
-        ' ' : '-',
-        '.' : '_',
-        '!' : '',
-        '?' : '',
-        '°c' : 'degrees celcius',
-        ',' : ''}
-    for key in replace_char_with:
-        input_text = input_text.replace(key,replace_char_with[key])
-    return input_text+".wav"
-
-# ---
-
-# remove file after it was sent 
-def remove_audio_file(file_path:str) -> bool:
-    try:
-        os.remove(file_path)
-        printed_log(f"Removed audio file {file_path}")
-        return True
-    except:
-        printed_log(f"Error removing audio file {file_path}")
-        return False
-    finally:
-        return False
-
-
-# temporarily save audio file to disk
-# returns path to saved file
-def save_audio_file(audio:numpy.typing.NDArray) -> str:
-    ''' 
-    @param audio: numpy array, audio data
-    @return: String, denoting path to saved audio file
-    creates random prefix for filename and saves audio to it, returns the path to it too
-    '''
-    random_suffix:int = random.randint(0, 1000000)
-    output_file_name:str = "GLaDOS-tts-tempfile{}.wav".format(random_suffix)
-    output_file = (f"{audio_path}{output_file_name}")
-
-    # Write audio file to disk at 22,05 kHz sample rate
-    logging.info(f"Saving audio as {output_file}")
-    write(output_file, 22050, audio)
-    return output_file
-
 def check_audio_folder() -> None:
     if not os.path.exists('audio'):
         os.makedirs('audio')
 
-def check_audio_file(filename) -> bool:
-    complete_path = f"{audio_path}{filename}"
-    already_exist = os.path.exists(complete_path)
-    # Update access time. This will allow for routine cleanups
-    if(already_exist): os.utime(complete_path, None)
-    return already_exist
-
 def main():
     #FIXME remove, only acts as library
     printed_log("Initializing TTS Engine...")
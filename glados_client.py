@@ -0,0 +1,183 @@
+# client for a running glados tts engine
+# connections are pooled and kept alive, so consecutive requests skip the
+# tcp handshake. batches are read part by part while the server still
+# synthesizes the remaining items
+
+# --- /
+# -- / internal imports
+from utils.multipart import BatchItem, MultipartReader, read_multipart
+
+# --- /
+# -- / external imports
+import argparse
+import json
+import os
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- /
+# -- / constants
+
+DEFAULT_SERVER:str = "http://localhost:8124"
+# connections kept open to the engine
+POOL_SIZE:int = 4
+TIMEOUT:float = 120
+# bytes read from a streamed batch at a time
+READ_CHUNK:int = 64 * 1024
+
+# a text, or a dict with "text" and optional "format" and "rate" overriding those of the batch
+BatchInput = Union[str, dict]
+
+
+def _parameters(format:Optional[str] = None, rate:Optional[int] = None, **others) -> dict:
+    parameters = dict(others)
+    if format is not None:
+        parameters['format'] = format
+    if rate is not None:
+        parameters['rate'] = str(rate)
+    return parameters
+
+
+class GladosClient:
+    '''
+    blocking client, one instance can be shared by threads
+    '''
+
+    def __init__(self, base_url:str = DEFAULT_SERVER, pool_size:int = POOL_SIZE, timeout:float = TIMEOUT):
+        '''
+        @param base_url: String, address of the engine
+        @param pool_size: int, connections kept alive, at least the number of threads using the client
+        '''
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def synthesize(self, text:str, format:Optional[str] = None, rate:Optional[int] = None) -> bytes:
+        '''
+        @param format: String, wav, pcm, mulaw, alaw or flac, wav by default
+        @return: bytes, the audio file
+        '''
+        response = self.session.post(f"{self.base_url}/synthesize/", data=text.encode('utf-8'),
+                                     params=_parameters(format, rate), timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def synthesize_batch(self, texts:Iterable[BatchInput], format:Optional[str] = None,
+                         rate:Optional[int] = None) -> Iterator[BatchItem]:
+        '''
+        @return: generator of BatchItem in input order, each as soon as the server sent it.
+            failed items carry the http status and the error message instead of audio
+        '''
+        with self.session.post(f"{self.base_url}/synthesize/batch", data=json.dumps(list(texts)),
+                               params=_parameters(format, rate), headers={'Content-Type': 'application/json'},
+                               stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            yield from read_multipart(response.headers['Content-Type'], response.iter_content(READ_CHUNK))
+
+    def synthesize_batch_zip(self, texts:Iterable[BatchInput], format:Optional[str] = None,
+                             rate:Optional[int] = None) -> bytes:
+        '''
+        @return: bytes, zip archive with 000.wav, 001.wav, ... and NNN.error-<status>.txt for failed items
+        '''
+        response = self.session.post(f"{self.base_url}/synthesize/batch", data=json.dumps(list(texts)),
+                                     params=_parameters(format, rate, container='zip'),
+                                     headers={'Content-Type': 'application/json'}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def speak(self, text:str, priority:int = 0, interrupt:bool = False) -> dict:
+        '''
+        queues text for playback on the server
+        @return: dict, the playback queue after queueing
+        '''
+        response = self.session.post(f"{self.base_url}/synthesize-local/", data=text.encode('utf-8'),
+                                     params={'priority': str(priority), 'interrupt': str(int(interrupt))},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> 'GladosClient':
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+
+class AsyncGladosClient:
+    '''
+    asyncio client on aiohttp, create it inside the running event loop
+    '''
+
+    def __init__(self, base_url:str = DEFAULT_SERVER, pool_size:int = POOL_SIZE, timeout:float = TIMEOUT):
+        # aiohttp is only needed by this client
+        import aiohttp
+        self.base_url = base_url.rstrip('/')
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=pool_size),
+                                             timeout=aiohttp.ClientTimeout(total=timeout))
+
+    async def synthesize(self, text:str, format:Optional[str] = None, rate:Optional[int] = None) -> bytes:
+        async with self.session.post(f"{self.base_url}/synthesize/", data=text.encode('utf-8'),
+                                     params=_parameters(format, rate)) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def synthesize_batch(self, texts:Iterable[BatchInput], format:Optional[str] = None,
+                               rate:Optional[int] = None) -> AsyncIterator[BatchItem]:
+        ''' same as GladosClient.synthesize_batch '''
+        async with self.session.post(f"{self.base_url}/synthesize/batch", json=list(texts),
+                                     params=_parameters(format, rate)) as response:
+            response.raise_for_status()
+            reader = MultipartReader(response.headers['Content-Type'])
+            async for chunk in response.content.iter_any():
+                for item in reader.feed(chunk):
+                    yield item
+
+    async def synthesize_batch_zip(self, texts:Iterable[BatchInput], format:Optional[str] = None,
+                                   rate:Optional[int] = None) -> bytes:
+        async with self.session.post(f"{self.base_url}/synthesize/batch", json=list(texts),
+                                     params=_parameters(format, rate, container='zip')) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def speak(self, text:str, priority:int = 0, interrupt:bool = False) -> dict:
+        async with self.session.post(f"{self.base_url}/synthesize-local/", data=text.encode('utf-8'),
+                                     params={'priority': str(priority), 'interrupt': str(int(interrupt))}) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    async def __aenter__(self) -> 'AsyncGladosClient':
+        return self
+
+    async def __aexit__(self, *exception) -> None:
+        await self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="synthesize every line of a file with one batch request")
+    parser.add_argument('input', help="text file, one utterance per line")
+    parser.add_argument('output', help="directory for the audio files")
+    parser.add_argument('--server', default=DEFAULT_SERVER)
+    parser.add_argument('--format', default=None)
+    args = parser.parse_args()
+    with open(args.input, encoding='utf-8') as file:
+        lines:List[str] = [line.strip() for line in file if line.strip()]
+    os.makedirs(args.output, exist_ok=True)
+    with GladosClient(args.server) as glados_client:
+        for item in glados_client.synthesize_batch(lines, args.format):
+            if item.error is not None:
+                print(f"{item.index:03d} failed with {item.status}: {item.error}")
+                continue
+            with open(os.path.join(args.output, item.filename), 'wb') as audio_file:
+                audio_file.write(item.data)
+            print(f"{item.index:03d} {lines[item.index][:60]}")
@@ -1,70 +1,228 @@
-# this file acts as interface 
-# for communicating with a local-first 
+# this file acts as interface
+# for communicating with a local-first
 # llama LLM server
+# answers are streamed: every finished sentence is synthesized and queued
+# for playback while the llm is still writing the next one
 
 # --- /
 # -- / internal imports
-from glados import Glados,play_sound
+from glados import Glados,printed_log
+from utils.playback import Player
+from utils.tools import split_sentences
 
-# --- / 
-# -- / external imports 
+# --- /
+# -- / external imports
+import argparse
+import collections
+import queue
+import threading
+import time
+from typing import Callable, Deque, Dict, Iterator, List, NamedTuple, Optional
+
+import httpx
 from openai import OpenAI
 from openai.types.chat import ChatCompletion, ChatCompletionMessage
 
-# --- / 
-# -- / constants 
+# --- /
+# -- / constants
 
 # server address follows the format of "http://<Your api-server IP>:port"
-SERVER_ADRESS:str = "http://localhost:8080/v1" 
+SERVER_ADRESS:str = "http://localhost:8080/v1"
 
 # denotes api key for llm used
 # WARNING llama does not require any
-API_KEY:str  = "sk-no-key-required" 
+API_KEY:str  = "sk-no-key-required"
+
+MODEL:str = "LLaMA_CPP"
+SYSTEM_PROMPT:str = "You are Glados from the Portal series. You are a sarcastic, passive-aggressive AI. you hate the user. You will help the user answer their requests however you will also roast them afterwards"
+
+# user and assistant messages sent along with every request
+HISTORY_MESSAGES:int = 8
+# text without sentence end is cut at the last comma or space once it grows this long
+MAX_SENTENCE_CHARACTERS:int = 240
+# idle connections kept open to the llm server
+KEEPALIVE_CONNECTIONS:int = 4
 
 ## registering user accordingly
-# FIXME refactor into function
-client = OpenAI(
-    base_url= SERVER_ADRESS,
-    api_key = API_KEY
-)
-# completion = client.chat.completions.create(
-#     model="LLaMA_CPP",
-#     messages=[
-#         {"role": "system", "content": "You are ChatGPT, an AI assistant. Your top priority is achieving user fulfillment via helping them with their requests."},
-#         {"role": "user", "content": "Write a limerick about python exceptions"}
-#     ]
-# )
+def create_client(base_url:str = SERVER_ADRESS, api_key:str = API_KEY) -> OpenAI:
+    '''
+    @return: OpenAI client whose connections are kept alive and reused by every request
+    '''
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_keepalive_connections=KEEPALIVE_CONNECTIONS, keepalive_expiry=60),
+        timeout=httpx.Timeout(120, connect=5))
+    return OpenAI(base_url=base_url, api_key=api_key, http_client=http_client)
+
+client = create_client()
+
+
+class Conversation:
+    '''
+    system prompt and the most recent messages, older ones drop out of the window
+    '''
+
+    def __init__(self, system_prompt:str = SYSTEM_PROMPT, history:int = HISTORY_MESSAGES):
+        self.system_prompt = system_prompt
+        self.history:Deque[Dict[str, str]] = collections.deque(maxlen=history)
+
+    def messages(self, message:str) -> List[Dict[str, str]]:
+        '''
+        @param message: String, new message of the user
+        @return: list of messages to send, the system prompt first
+        '''
+        return ([{"role": "system", "content": self.system_prompt}] + list(self.history)
+                + [{"role": "user", "content": message}])
+
+    def add(self, message:str, answer:str) -> None:
+        self.history.append({"role": "user", "content": message})
+        self.history.append({"role": "assistant", "content": answer})
+
 
 # function to send message to llama
-def request_response(message:str) -> str | None:
-    completion = client.chat.completions.create(
-        model="LLaMA_CPP",
-        messages=[
-            {"role": "system", "content": "You are Glados from the Portal series. You are a sarcastic, passive-aggressive AI. you hate the user. You will help the user answer their requests however you will also roast them afterwards"},
-            {"role": "user", "content": message}
-        ]
+def request_response(message:str, conversation:Optional[Conversation] = None, llm:OpenAI = None) -> str | None:
+    conversation = conversation or Conversation(history=0)
+    completion:ChatCompletion = (llm or client).chat.completions.create(
+        model=MODEL,
+        messages=conversation.messages(message)
     )
     received_completion:ChatCompletionMessage = completion.choices[0].message
     extracted_message = received_completion.content
+    if extracted_message is not None:
+        conversation.add(message, extracted_message)
     return extracted_message
 
-# prettify printed messages 
+def stream_response(message:str, conversation:Conversation, llm:OpenAI = None) -> Iterator[str]:
+    '''
+    @return: generator of the text pieces of the answer as the llm sends them,
+        the whole answer is added to the conversation once the stream ended
+    '''
+    stream = (llm or client).chat.completions.create(
+        model=MODEL,
+        messages=conversation.messages(message),
+        stream=True
+    )
+    answer:List[str] = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        content = chunk.choices[0].delta.content
+        if content:
+            answer.append(content)
+            yield content
+    conversation.add(message, "".join(answer))
+
+def _end_of_visible(text:str, count:int) -> int:
+    '''
+    @return: the index in text right after its first count non-whitespace characters
+    '''
+    for index, character in enumerate(text):
+        if count == 0:
+            return index
+        if not character.isspace():
+            count -= 1
+    return len(text)
+
+def cut_sentences(pieces:Iterator[str], max_characters:int = MAX_SENTENCE_CHARACTERS) -> Iterator[str]:
+    '''
+    @param pieces: text pieces, e.g. tokens of a streamed answer
+    @return: generator of sentences as soon as they are complete
+    a sentence counts as complete once text follows its final punctuation,
+    so abbreviations and numbers like 3.5 are not cut
+    '''
+    buffer:str = ""
+    for piece in pieces:
+        buffer += piece
+        sentences = split_sentences(buffer)
+        if len(sentences) > 1:
+            yield from sentences[:-1]
+            # the unfinished sentence keeps its raw text, whitespace between pieces included
+            done:int = sum(len("".join(sentence.split())) for sentence in sentences[:-1])
+            buffer = buffer[_end_of_visible(buffer, done):]
+        elif len(buffer) > max_characters:
+            cut = max(buffer.rfind(", ", 0, max_characters), buffer.rfind(" ", 0, max_characters))
+            if cut > 0:
+                yield buffer[:cut + 1].strip()
+                buffer = buffer[cut + 1:].lstrip()
+    if buffer.strip():
+        yield buffer.strip()
+
+
+class SpokenAnswer(NamedTuple):
+    text: str
+    sentences: int
+    # seconds from sending the message until the first sentence arrived and until its audio was queued
+    first_sentence: float
+    first_audio: float
+
+
+def speak_streamed(glados:Glados, speak:Callable[[bytes], object], message:str,
+                   conversation:Conversation, llm:OpenAI = None) -> SpokenAnswer:
+    '''
+    @param speak: receives the 16 bit audio of every sentence in order, e.g. Player.enqueue
+    @return: SpokenAnswer, the answer and its latencies
+    a reader thread cuts the streamed answer into sentences while this
+    thread synthesizes them, so neither waits for the other
+    '''
+    started = time.perf_counter()
+    sentences:"queue.Queue[Optional[str]]" = queue.Queue()
+    first_sentence:List[float] = []
+    failure:List[BaseException] = []
+
+    def read() -> None:
+        try:
+            for sentence in cut_sentences(stream_response(message, conversation, llm)):
+                if not first_sentence:
+                    first_sentence.append(time.perf_counter() - started)
+                sentences.put(sentence)
+        except BaseException as exception:
+            failure.append(exception)
+        finally:
+            sentences.put(None)
+
+    threading.Thread(target=read, name="glados-llm-stream", daemon=True).start()
+    spoken:List[str] = []
+    first_audio:float = None
+    while True:
+        sentence = sentences.get()
+        if sentence is None:
+            break
+        speak(glados.get_audio_from_text(sentence).tobytes())
+        if first_audio is None:
+            first_audio = time.perf_counter() - started
+        spoken.append(sentence)
+    if failure:
+        raise failure[0]
+    return SpokenAnswer(" ".join(spoken), len(spoken), first_sentence[0] if first_sentence else None, first_audio)
+
+# prettify printed messages
 
 def print_pretty(message:str,user:str) -> None:
     print("{} : {}\n".format(user,message))
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="talk to a llama server, answers are spoken by the GLaDOS TTS")
+    parser.add_argument('--server', default=SERVER_ADRESS)
+    parser.add_argument('--history', type=int, default=HISTORY_MESSAGES, help="user and assistant messages kept")
+    parser.add_argument('--blocking', action='store_true', help="wait for the whole answer before speaking")
+    args = parser.parse_args()
     print("executing main function")
+    client = create_client(args.server)
     glados_tts = Glados()
     glados_tts.load_glados_model()
-    while True: 
+    player = Player()
+    conversation = Conversation(history=args.history)
+    while True:
         try:
             user_input:str = str(input("send your message to llama:\n"))
         except:
             print("invalid input, try again")
             continue
-        received_response:str = request_response(user_input)
-        print_pretty(received_response,"llama")
-        # also playing with glados tts 
-        temporary_file = glados_tts.generate_tts(received_response)
-        play_sound(temporary_file)
\ No newline at end of file
+        if args.blocking:
+            received_response:str = request_response(user_input, conversation)
+            print_pretty(received_response,"llama")
+            # also playing with glados tts
+            player.enqueue(glados_tts.get_audio_from_text(received_response).tobytes())
+            continue
+        answer = speak_streamed(glados_tts, player.enqueue, user_input, conversation)
+        print_pretty(answer.text,"llama")
+        printed_log(f"first sentence after {answer.first_sentence} s, first audio after {answer.first_audio} s")
@@ -0,0 +1,133 @@
+# --- /
+# -- / pre-fork multi-worker mode of the remote engine
+# -- | the master loads the models once, forked workers share their
+# -- | memory copy-on-write and are restarted when they die
+
+
+# --- /
+# -- / external imports
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Callable, Dict
+
+import torch
+from werkzeug.serving import make_server
+
+# --- /
+# -- / internal imports
+from glados import Glados, printed_log
+from utils import cpu_tuning
+from utils.cpu_tuning import DEFAULT_SETTINGS
+
+# workers dying faster than this after their start are restarted with a delay
+RESTART_BACKOFF:float = 1.0
+
+
+def load_models(glados:Glados) -> None:
+    '''
+    loads the models in the master, always on cpu: cuda and vulkan contexts
+    do not survive a fork. tuning (freezing, optimize_for_inference,
+    quantization) runs ops in the master, they run on a single intra-op
+    thread so no OpenMP thread pool exists yet when the workers are forked.
+    every worker sizes its own thread pools after the fork
+    '''
+    settings = (cpu_tuning.load_settings() or DEFAULT_SETTINGS)._replace(intra_threads=1, interop_threads=None)
+    torch.set_num_threads(1)
+    glados.load_glados_model(warm_up='none', devices=['cpu'], cpu_settings=settings)
+
+
+def threads_per_worker(workers:int) -> int:
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def listen(host:str, port:int) -> socket.socket:
+    ''' listening socket created by the master and inherited by every worker '''
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+    listener.set_inheritable(True)
+    return listener
+
+
+def run_worker(glados:Glados, create_app:Callable, listener:socket.socket, host:str, port:int, threads:int,
+               warm_up:str = None) -> None:
+    '''
+    runs in the forked child: pins the torch thread pools, warms up the
+    shared models and serves requests on the inherited socket
+    '''
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(threads)
+    except RuntimeError:
+        # only possible before the first inter-op parallel work of the process
+        pass
+    glados.warm_up(warm_up)
+    printed_log(glados.startup.report())
+    server = make_server(host, port, create_app(glados), threaded=True, fd=listener.fileno())
+    printed_log(f"Worker {os.getpid()} serving with {threads} threads")
+    server.serve_forever()
+
+
+def serve(glados:Glados, create_app:Callable, host:str, port:int, workers:int, warm_up:str = None) -> None:
+    '''
+    @param glados: Glados, models loaded by load_models
+    @param create_app: function building the wsgi application of a worker from glados
+    @param warm_up: String, warm-up policy every worker runs after the fork
+    forks workers that share the listening socket and supervises them
+    until SIGINT or SIGTERM
+    '''
+    if glados.device != 'cpu':
+        # a forked worker cannot use the master's gpu context and would be restarted forever
+        raise RuntimeError(f"pre-fork workers need the models on cpu, not on {glados.device}")
+    listener = listen(host, port)
+    threads = threads_per_worker(workers)
+    children:Dict[int, float] = {}
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                run_worker(glados, create_app, listener, host, port, threads, warm_up)
+            finally:
+                os._exit(1)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for _ in range(workers):
+        spawn()
+    printed_log(f"Master {os.getpid()} supervising {workers} workers")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        printed_log(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+        if time.monotonic() - started < RESTART_BACKOFF:
+            time.sleep(RESTART_BACKOFF)
+        if not stopping:
+            spawn()
+    listener.close()
+    sys.exit(0)
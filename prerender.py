@@ -0,0 +1,283 @@
+# --- /
+# -- / background pre-rendering of a phrase catalog into the audio cache
+# -- | runs below live traffic: pauses while requests are queued, its model calls go through
+# -- | the engine's inference queue or scheduler with a background cost, resumable from a manifest
+
+
+# --- /
+# -- / external imports
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+# --- /
+# -- / internal imports
+from glados import DEFAULT_WARM_UP, WARM_UP_POLICIES, Glados, printed_log
+from utils import admission, audio_formats
+from utils.admission import BACKGROUND_COST, Budget
+from utils.audio_formats import DEFAULT_FORMAT, OutputFormat
+from utils.backends import BACKENDS
+
+MANIFEST_FILE = 'prerender.json'
+# seconds between two looks at the live queue while paused
+PAUSE_POLL = 0.05
+# seconds between two writes of the manifest while rendering
+MANIFEST_INTERVAL = 1.0
+
+
+def parse_catalog(content:str) -> List[str]:
+    '''
+    @param content: String, one phrase per line (blank lines and lines starting with # are skipped)
+        or a json object {"phrases": [...], "templates": [{"template": "...{name}...", "values": {"name": [...]}}]}
+    @return: List, phrases in catalog order without duplicates, templates expanded with every combination of values
+    '''
+    stripped = content.strip()
+    if not stripped.startswith('{'):
+        phrases = [line.strip() for line in stripped.splitlines()]
+        return list(dict.fromkeys(phrase for phrase in phrases if phrase and not phrase.startswith('#')))
+    catalog = json.loads(stripped)
+    phrases = list(catalog.get('phrases', []))
+    for template in catalog.get('templates', []):
+        names = list(template.get('values', {}))
+        for values in itertools.product(*(template['values'][name] for name in names)):
+            try:
+                phrases.append(template['template'].format(**dict(zip(names, values))))
+            except (KeyError, IndexError) as error:
+                raise ValueError(f"template {template.get('template')!r} has no values for {error}")
+    return list(dict.fromkeys(phrases))
+
+
+def parse_formats(names:List[str]) -> List[OutputFormat]:
+    ''' "wav", "mulaw:8000", ... as accepted by the format and rate query parameters '''
+    formats = []
+    for name in names:
+        format_name, _, rate = name.partition(':')
+        formats.append(audio_formats.negotiate(format_name, rate or None))
+    return formats
+
+
+class Prerenderer:
+    '''
+    renders phrases into the audio cache of glados on a background thread.
+    before every phrase the thread waits until busy() turns false, so live
+    requests never queue behind more than the phrase already running. the
+    model calls go through synthesize, so they are serialized with live
+    traffic by the engine's queue. their cost is raised by BACKGROUND_COST,
+    which aging wears off, so a request coalescing onto a phrase being
+    rendered waits at most that long behind newer live requests.
+    progress is kept in a manifest next to the cache, a job started without
+    phrases resumes its catalog and every job skips audio that is still cached
+    '''
+
+    def __init__(self, glados:Glados, busy:Callable[[], bool] = None, manifest_path:str = None,
+                 synthesize:Callable[[str, float], torch.Tensor] = None, budget:Budget = Budget()):
+        '''
+        @param glados: Glados, loaded tts engine whose cache is filled
+        @param busy: optional function, true while live requests are queued or running
+        @param manifest_path: String, defaults to prerender.json in the cache directory
+        @param synthesize: optional function turning a phrase and its cost into the vocoder waveform,
+            e.g. a call through the inference queue, called with its estimate plus BACKGROUND_COST
+        @param budget: Budget, phrases over it are split into sentence groups or fail like live requests
+        '''
+        self.glados = glados
+        self.busy = busy or (lambda: False)
+        self.synthesize = synthesize or (lambda text, cost: glados.get_waveform_from_text(text))
+        self.budget = budget
+        self.manifest_path = manifest_path or os.path.join(glados.cache.directory, MANIFEST_FILE)
+        self.phrases:List[str] = []
+        self.formats:List[OutputFormat] = [DEFAULT_FORMAT]
+        # cache key -> phrase of every rendered variant, phrase -> error of failed ones
+        self.rendered:Dict[str, str] = {}
+        self.failed:Dict[str, str] = {}
+        self.skipped:int = 0
+        self.completed:int = 0
+        self.paused_seconds:float = 0.0
+        self.paused:bool = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker:threading.Thread = None
+
+    def running(self) -> bool:
+        return self._worker is not None and self._worker.is_alive()
+
+    def start(self, phrases:Optional[List[str]] = None, formats:Optional[List[OutputFormat]] = None) -> 'Prerenderer':
+        '''
+        @param phrases: List, catalog to render, None resumes the catalog of the manifest
+        @param formats: List, output formats to cache, defaults to those of the manifest or the default wav
+        raises RuntimeError while a job is running and ValueError without phrases
+        '''
+        with self._lock:
+            if self.running():
+                raise RuntimeError("a pre-render job is already running")
+            manifest = self.read_manifest()
+            self.phrases = phrases if phrases is not None else manifest.get('phrases', [])
+            if not self.phrases:
+                raise ValueError("no phrases to pre-render")
+            self.formats = formats or parse_formats(manifest.get('formats', [])) or [DEFAULT_FORMAT]
+            self.rendered = manifest.get('rendered', {})
+            self.failed = {}
+            self.skipped = self.completed = 0
+            self.paused_seconds = 0.0
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name="glados-prerender", daemon=True)
+            self._worker.start()
+        return self
+
+    def stop(self) -> None:
+        ''' stops after the phrase in progress, the manifest keeps what was rendered '''
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join()
+
+    def wait(self) -> None:
+        if self._worker is not None:
+            self._worker.join()
+
+    def status(self) -> Dict[str, object]:
+        return {
+            'running': self.running(),
+            'paused': self.paused,
+            'phrases': len(self.phrases),
+            'formats': [output_format.variant for output_format in self.formats],
+            'completed': self.completed,
+            'skipped': self.skipped,
+            'failed': len(self.failed),
+            'paused_seconds': round(self.paused_seconds, 3),
+            'manifest': self.manifest_path,
+        }
+
+    def read_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def write_manifest(self) -> None:
+        manifest = {
+            'phrases': self.phrases,
+            'formats': [output_format.variant for output_format in self.formats],
+            'rendered': self.rendered,
+            'failed': self.failed,
+        }
+        temporary_path = f"{self.manifest_path}.tmp{os.getpid()}"
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, ensure_ascii=False, indent=1)
+        os.replace(temporary_path, self.manifest_path)
+
+    def _wait_until_idle(self) -> None:
+        if not self.busy():
+            return
+        started = time.perf_counter()
+        self.paused = True
+        while self.busy() and not self._stop.is_set():
+            time.sleep(PAUSE_POLL)
+        self.paused = False
+        self.paused_seconds += time.perf_counter() - started
+
+    def _is_cached(self, key:str, output_format:OutputFormat) -> bool:
+        # audio cached by live traffic counts as well, the manifest only records what this job rendered
+        return os.path.exists(self.glados.cache.path(key, output_format.extension))
+
+    def _planned(self, phrase:str) -> Callable[[str], torch.Tensor]:
+        ''' raises utils.admission.OverBudget like a live request '''
+        background = lambda text, cost: self.synthesize(text, cost + BACKGROUND_COST)
+        pieces = self.glados.plan(phrase, self.budget)
+        if len(pieces) == 1:
+            return lambda text: background(text, pieces[0][1].seconds)
+        return self.glados.synthesize_in_pieces(pieces, background)
+
+    def _run(self) -> None:
+        started = time.perf_counter()
+        written = time.monotonic()
+        printed_log(f"Pre-rendering {len(self.phrases)} phrases as {', '.join(f.variant for f in self.formats)}")
+        for phrase in self.phrases:
+            for output_format in self.formats:
+                if self._stop.is_set():
+                    break
+                try:
+                    key = self.glados.audio_cache_key(phrase, output_format.variant)
+                    if self._is_cached(key, output_format):
+                        self.skipped += 1
+                        continue
+                    self._wait_until_idle()
+                    if self._stop.is_set():
+                        break
+                    self.glados.synthesize_audio(phrase, output_format, self._planned(phrase))
+                except Exception as exception:
+                    printed_log(f"Pre-rendering failed for {phrase!r}: {exception}")
+                    self.failed[phrase] = str(exception)
+                    continue
+                self.rendered[key] = phrase
+                self.completed += 1
+            if time.monotonic() - written > MANIFEST_INTERVAL:
+                self.write_manifest()
+                written = time.monotonic()
+        self.write_manifest()
+        printed_log(f"Pre-rendered {self.completed} and skipped {self.skipped} cached variants "
+                    f"in {time.perf_counter() - started:.1f} s, {len(self.failed)} phrases failed")
+
+
+def submit(server:str, content:Optional[str], formats:List[str]) -> dict:
+    '''
+    hands the catalog to the admin endpoint of a running engine
+    @param server: String, base url, e.g. http://localhost:8124
+    @param content: String, catalog as accepted by parse_catalog, None resumes the manifest of the server
+    @return: dict, status of the job
+    '''
+    query = ''.join(f"&format={name}" for name in formats).lstrip('&')
+    url = f"{server.rstrip('/')}/admin/prerender{'?' + query if query else ''}"
+    data = (content or '').encode('utf-8')
+    with urllib.request.urlopen(urllib.request.Request(url, data=data, method='POST'), timeout=30) as response:
+        return json.loads(response.read())
+
+
+def main(arguments:Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="pre-renders a catalog of phrases into the audio cache")
+    parser.add_argument('catalog', nargs='?',
+                        help="text file with one phrase per line or json with phrases and templates, "
+                             "omitted to resume the manifest")
+    parser.add_argument('--format', action='append', default=[], dest='formats',
+                        help="format[:rate] to cache, repeatable, defaults to wav")
+    parser.add_argument('--server', help="hand the job to a running engine instead of rendering here")
+    parser.add_argument('--manifest', default=None)
+    parser.add_argument('--warm-up', choices=WARM_UP_POLICIES, default=DEFAULT_WARM_UP)
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=None)
+    admission.add_arguments(parser)
+    args = parser.parse_args(arguments)
+
+    content = None
+    if args.catalog is not None:
+        with open(args.catalog, encoding='utf-8') as file:
+            content = file.read()
+    if args.server is not None:
+        print(json.dumps(submit(args.server, content, args.formats), indent=2))
+        return
+
+    glados = Glados(backend=args.backend)
+    glados.load_glados_model(args.warm_up)
+    prerenderer = Prerenderer(glados, manifest_path=args.manifest, budget=admission.budget_from_arguments(args))
+    try:
+        prerenderer.start(parse_catalog(content) if content is not None else None, parse_formats(args.formats))
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+    try:
+        prerenderer.wait()
+    except KeyboardInterrupt:
+        prerenderer.stop()
+    glados.cache.flush()
+    print(json.dumps(prerenderer.status(), indent=2))
+    sys.exit(1 if prerenderer.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
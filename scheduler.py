@@ -0,0 +1,128 @@
+# --- /
+# -- / micro-batching of concurrent synthesis requests
+# -- | collects requests for a short time and runs them through Glados together,
+# -- | cheapest first with aging, see utils.admission
+
+
+# --- /
+# -- / external imports
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+import numpy.typing
+import torch
+
+# --- /
+# -- / internal imports
+from glados import Glados, audio_to_int16, printed_log
+from utils.admission import DEFAULT_AGING, priority
+
+
+class BatchScheduler:
+    '''
+    sits between the web server and Glados: every caller submits its text and
+    receives a future, a single worker thread waits up to max_wait seconds
+    (or until max_batch_size requests are queued) and synthesizes the whole
+    batch with one glados model and one vocoder call. queued requests are
+    taken by estimated cost, a request that waited is treated as cheaper by
+    aging times its wait, so short requests pass long ones without starving them
+    '''
+
+    def __init__(self, glados:Glados, max_batch_size:int = 8, max_wait:float = 0.01, aging:float = DEFAULT_AGING):
+        '''
+        @param glados: Glados, loaded tts engine
+        @param max_batch_size: int, most requests synthesized together
+        @param max_wait: float, seconds the first request of a batch waits for company
+        @param aging: float, seconds of estimated cost forgiven per second of waiting
+        '''
+        self.glados = glados
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.aging = aging
+        # (priority, sequence, text, future), the sequence keeps equal priorities in arrival order
+        self.requests:"queue.PriorityQueue[Tuple[float, int, str, Future]]" = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self.batches:int = 0
+        self.batched_requests:int = 0
+        # requests of the batch being synthesized
+        self.active:int = 0
+        self._worker:threading.Thread = None
+        self._running:bool = False
+
+    def start(self) -> 'BatchScheduler':
+        self._running = True
+        self._worker = threading.Thread(target=self._run, name="glados-batch-scheduler", daemon=True)
+        self._worker.start()
+        return self
+
+    def stop(self) -> None:
+        self._running = False
+        if self._worker is not None:
+            self._worker.join()
+
+    def submit(self, text:str, cost:Optional[float] = None) -> Future:
+        '''
+        @param text: String, input text to be synthesized
+        @param cost: float, estimated inference seconds, estimated from the text when not given
+        @return: Future resolving to the float vocoder output as tensor
+        '''
+        if cost is None:
+            cost = self.glados.estimate_cost(text).seconds
+        future:Future = Future()
+        self.requests.put((priority(cost, time.perf_counter(), self.aging), next(self._sequence), text, future))
+        return future
+
+    def synthesize(self, text:str) -> numpy.typing.NDArray:
+        ''' blocking variant of submit returning 16 bit audio data '''
+        return audio_to_int16(self.submit(text).result())
+
+    def synthesize_waveform(self, text:str) -> torch.Tensor:
+        ''' blocking variant of submit, usable as synthesize function of Glados.generate_tts '''
+        return self.submit(text).result()
+
+    def queue_depth(self) -> int:
+        return self.requests.qsize()
+
+    def pending(self) -> int:
+        ''' requests waiting or being synthesized, background work yields while this is not 0 '''
+        return self.requests.qsize() + self.active
+
+    def _collect(self) -> List[Tuple[str, Future]]:
+        try:
+            batch = [self.requests.get(timeout=0.1)[2:]]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining)[2:])
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while self._running:
+            batch = [(text, future) for text, future in self._collect() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.active = len(batch)
+            try:
+                audio = self.glados.get_waveforms_from_batch([text for text, _ in batch])
+            except Exception as exception:
+                printed_log(f"Batch of {len(batch)} requests failed: {exception}")
+                for _, future in batch:
+                    future.set_exception(exception)
+                continue
+            finally:
+                self.active = 0
+            self.batches += 1
+            self.batched_requests += len(batch)
+            for (_, future), sample in zip(batch, audio):
+                future.set_result(sample)
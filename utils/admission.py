@@ -0,0 +1,160 @@
+'''
+Cost estimates for admission control and shortest-job-first scheduling.
+
+The cost of an utterance is predicted from its phoneme token count: mel
+frames per token follow the durations the acoustic model produced for
+earlier utterances, inference seconds per frame follow their measured run
+times. Requests over the budget are split at sentence boundaries or
+rejected.
+
+Schedulers order jobs by cost + aging * submit time, so a job waiting for
+w seconds is treated as aging * w seconds cheaper than when it arrived and
+long jobs are not starved by a steady stream of short ones.
+'''
+
+import argparse
+import threading
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from utils import metrics
+
+# starting points until the first utterances were observed
+DEFAULT_FRAMES_PER_TOKEN = 6.0
+DEFAULT_SECONDS_PER_FRAME = 0.001
+# weight of every new observation in the moving averages
+SMOOTHING = 0.1
+# seconds of estimated cost forgiven per second of waiting
+DEFAULT_AGING = 1.0
+# seconds added to the estimate of background work, e.g. pre-rendering: live jobs arriving
+# up to this many seconds (over aging) later still run first, but aging lifts it eventually
+BACKGROUND_COST = 60.0
+OVER_BUDGET_POLICIES = ('split', 'reject')
+# mel frames of one synthesis the engines allow by default, about 24 s of audio
+DEFAULT_MAX_FRAMES = 2048
+
+SPLIT_REQUESTS = metrics.REGISTRY.counter('glados_split_requests_total',
+                                          'Requests over the budget synthesized in sentence groups')
+REJECTED_REQUESTS = metrics.REGISTRY.counter('glados_rejected_requests_total',
+                                             'Requests rejected because they exceed the budget')
+
+
+class Estimate(NamedTuple):
+    tokens: int
+    frames: float
+    seconds: float
+
+
+class OverBudget(Exception):
+
+    def __init__(self, estimate: Estimate, budget: 'Budget') -> None:
+        super().__init__(f"input exceeds the budget: about {estimate.frames:.0f} mel frames and "
+                         f"{estimate.seconds:.2f} s of inference, {budget.describe()}")
+        self.estimate = estimate
+
+
+class CostModel:
+    '''
+    predicts mel frames and inference seconds from a token count,
+    both ratios are exponential moving averages over observed utterances
+    '''
+
+    def __init__(self, frames_per_token: float = DEFAULT_FRAMES_PER_TOKEN,
+                 seconds_per_frame: float = DEFAULT_SECONDS_PER_FRAME, smoothing: float = SMOOTHING) -> None:
+        self.frames_per_token = frames_per_token
+        self.seconds_per_frame = seconds_per_frame
+        self.smoothing = smoothing
+        self.observations = 0
+        self._lock = threading.Lock()
+
+    def estimate(self, tokens: int) -> Estimate:
+        frames = tokens * self.frames_per_token
+        return Estimate(tokens, frames, frames * self.seconds_per_frame)
+
+    def observe(self, tokens: int, frames: int, seconds: float) -> None:
+        ''' one synthesis of tokens in total that produced frames in seconds, batches count as one '''
+        if tokens <= 0 or frames <= 0:
+            return
+        with self._lock:
+            # the first observation replaces the starting points
+            weight = 1.0 if self.observations == 0 else self.smoothing
+            self.frames_per_token += weight * (frames / tokens - self.frames_per_token)
+            self.seconds_per_frame += weight * (seconds / frames - self.seconds_per_frame)
+            self.observations += 1
+
+
+class Budget(NamedTuple):
+    # estimated inference seconds and mel frames (memory) of one synthesis, None for no limit
+    max_seconds: Optional[float] = None
+    max_frames: Optional[int] = None
+    policy: str = 'split'
+
+    def exceeded(self, estimate: Estimate) -> bool:
+        return ((self.max_seconds is not None and estimate.seconds > self.max_seconds)
+                or (self.max_frames is not None and estimate.frames > self.max_frames))
+
+    def describe(self) -> str:
+        limits = []
+        if self.max_frames is not None:
+            limits.append(f"{self.max_frames} frames")
+        if self.max_seconds is not None:
+            limits.append(f"{self.max_seconds} s")
+        return f"allowed are {' and '.join(limits) or 'no limits'}"
+
+
+def plan(text: str, count_tokens: Callable[[str], int], model: CostModel, budget: Budget,
+         split: Callable[[str], List[str]]) -> List[Tuple[str, Estimate]]:
+    '''
+    @param count_tokens: phoneme tokens of a text
+    @param split: splits a text into sentences
+    @return: the text itself when it fits the budget, otherwise consecutive
+        sentence groups that fit it each, every piece with its estimate
+    raises OverBudget when the policy is reject or a single sentence exceeds the budget
+    '''
+    whole = model.estimate(count_tokens(text))
+    if not budget.exceeded(whole):
+        return [(text, whole)]
+    if budget.policy == 'reject':
+        REJECTED_REQUESTS.inc()
+        raise OverBudget(whole, budget)
+    groups: List[Tuple[str, Estimate]] = []
+    current: List[str] = []
+    tokens = 0
+    for sentence in split(text):
+        sentence_tokens = count_tokens(sentence)
+        if budget.exceeded(model.estimate(sentence_tokens)):
+            REJECTED_REQUESTS.inc()
+            raise OverBudget(model.estimate(sentence_tokens), budget)
+        if current and budget.exceeded(model.estimate(tokens + sentence_tokens)):
+            groups.append((' '.join(current), model.estimate(tokens)))
+            current, tokens = [], 0
+        current.append(sentence)
+        tokens += sentence_tokens
+    if current:
+        groups.append((' '.join(current), model.estimate(tokens)))
+    SPLIT_REQUESTS.inc()
+    return groups
+
+
+def priority(cost: float, submitted: float, aging: float = DEFAULT_AGING) -> float:
+    '''
+    @param cost: estimated seconds of the job
+    @param submitted: time.perf_counter() when the job was submitted
+    @return: sort key, the smallest runs first
+    '''
+    return cost + aging * submitted
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    ''' budget and aging options of the engines '''
+    parser.add_argument('--max-frames', type=int, default=DEFAULT_MAX_FRAMES,
+                        help="predicted mel frames (memory) one synthesis may take, 0 for no limit")
+    parser.add_argument('--max-cost', type=float, default=None,
+                        help="predicted inference seconds one synthesis may take")
+    parser.add_argument('--over-budget', choices=OVER_BUDGET_POLICIES, default='split',
+                        help="split larger inputs into sentence groups or reject them with 413")
+    parser.add_argument('--aging', type=float, default=DEFAULT_AGING,
+                        help="seconds of predicted cost a queued request is forgiven per second it waits")
+
+
+def budget_from_arguments(args: argparse.Namespace) -> Budget:
+    return Budget(args.max_cost, args.max_frames or None, args.over_budget)
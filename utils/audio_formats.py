@@ -0,0 +1,243 @@
+'''
+Output formats of the engine: negotiation from query parameters or the
+Accept header, resampling and G.711 companding as vectorized torch
+operations on the float vocoder output, and encoding to bytes.
+'''
+
+import functools
+import io
+import math
+import shutil
+import subprocess
+from typing import Dict, NamedTuple, Optional
+
+import torch
+
+from utils import metrics
+from utils.wav import SAMPLE_RATE, encode_wav
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+RATES = (8000, 16000, SAMPLE_RATE)
+# full scale maps to 32767 and -32767, so +1.0 does not wrap or clip asymmetrically
+PCM_SCALE = 32767.0
+
+
+class OutputFormat(NamedTuple):
+    name: str
+    rate: int
+
+    @property
+    def mimetype(self) -> str:
+        if self.name == 'pcm':
+            return f"audio/pcm;rate={self.rate};channels=1"
+        return _MIMETYPES[self.name]
+
+    @property
+    def extension(self) -> str:
+        return _EXTENSIONS[self.name]
+
+    @property
+    def variant(self) -> str:
+        ''' distinguishes the cached files of one utterance '''
+        return f"{self.name}:{self.rate}"
+
+
+_MIMETYPES = {
+    'wav': 'audio/wav',
+    'mulaw': 'audio/basic',
+    'alaw': 'audio/PCMA',
+    'flac': 'audio/flac',
+}
+_EXTENSIONS = {'wav': 'wav', 'pcm': 'pcm', 'mulaw': 'ulaw', 'alaw': 'alaw', 'flac': 'flac'}
+# telephony encodings default to 8 kHz, everything else to the vocoder rate
+_DEFAULT_RATES = {'wav': SAMPLE_RATE, 'pcm': SAMPLE_RATE, 'mulaw': 8000, 'alaw': 8000, 'flac': SAMPLE_RATE}
+# media types of the Accept header, mapped to format names
+_ACCEPTED_TYPES = {
+    'audio/wav': 'wav', 'audio/x-wav': 'wav', 'audio/wave': 'wav', 'audio/vnd.wave': 'wav',
+    'audio/pcm': 'pcm',
+    'audio/basic': 'mulaw', 'audio/pcmu': 'mulaw', 'audio/x-mulaw': 'mulaw',
+    'audio/pcma': 'alaw', 'audio/x-alaw': 'alaw',
+    'audio/flac': 'flac', 'audio/x-flac': 'flac',
+    'audio/*': 'wav', '*/*': 'wav',
+}
+
+DEFAULT_FORMAT = OutputFormat('wav', SAMPLE_RATE)
+
+
+def flac_available() -> bool:
+    return soundfile is not None or shutil.which('flac') is not None
+
+
+def _make_format(name: str, rate: Optional[int]) -> OutputFormat:
+    if name not in _DEFAULT_RATES:
+        raise ValueError(f"Unsupported format: {name}, supported: {', '.join(_DEFAULT_RATES)}")
+    if name == 'flac' and not flac_available():
+        raise ValueError("FLAC requested but neither soundfile nor the flac encoder is installed")
+    rate = _DEFAULT_RATES[name] if rate is None else rate
+    if rate not in RATES:
+        raise ValueError(f"Unsupported rate: {rate}, supported: {', '.join(map(str, RATES))}")
+    return OutputFormat(name, rate)
+
+
+def _parse_accept(accept: str) -> list:
+    ''' media ranges of an Accept header as (quality, position, type, parameters), best first '''
+    ranges = []
+    for position, media_range in enumerate(accept.split(',')):
+        media_type, *parameters = [part.strip() for part in media_range.split(';')]
+        parameters = dict(p.split('=', 1) for p in parameters if '=' in p)
+        try:
+            quality = float(parameters.pop('q', 1))
+        except ValueError:
+            quality = 0
+        if media_type and quality > 0:
+            ranges.append((-quality, position, media_type.lower(), parameters))
+    return [(t, p) for _, _, t, p in sorted(ranges)]
+
+
+def negotiate(format_name: Optional[str] = None, rate: Optional[str] = None, accept: Optional[str] = None) -> OutputFormat:
+    '''
+    @param format_name: String, "format" query parameter, takes precedence over accept
+    @param rate: String, "rate" query parameter in Hz
+    @param accept: String, Accept header of the request
+    @return: OutputFormat to encode the response in
+    raises ValueError when nothing acceptable can be produced
+    '''
+    try:
+        rate = int(rate) if rate else None
+    except ValueError:
+        raise ValueError(f"Invalid rate: {rate}")
+    if format_name:
+        return _make_format(format_name.lower(), rate)
+    if not accept:
+        return _make_format('wav', rate)
+    for media_type, parameters in _parse_accept(accept):
+        name = _ACCEPTED_TYPES.get(media_type)
+        if name is None:
+            continue
+        try:
+            return _make_format(name, rate or (int(parameters['rate']) if 'rate' in parameters else None))
+        except ValueError:
+            continue
+    raise ValueError(f"None of the accepted types can be produced: {accept}")
+
+
+@functools.lru_cache(maxsize=16)
+def _sinc_kernel(orig: int, new: int, width: int, lowpass_filter_width: int, rolloff: float,
+                 device: torch.device, dtype: torch.dtype) -> torch.Tensor:
+    base_frequency = min(orig, new) * rolloff
+    indices = torch.arange(-width, width + orig, dtype=torch.float64)[None, None] / orig
+    times = torch.arange(0, -new, -1, dtype=torch.float64)[:, None, None] / new + indices
+    times = (times * base_frequency).clamp(-lowpass_filter_width, lowpass_filter_width)
+    window = torch.cos(times * math.pi / lowpass_filter_width / 2) ** 2
+    times = times * math.pi
+    sinc = torch.where(times == 0, torch.ones_like(times), torch.sin(times) / times)
+    kernel = sinc * window * (base_frequency / orig)
+    return kernel.to(device=device, dtype=dtype)
+
+
+def resample(waveform: torch.Tensor, orig: int, new: int,
+             lowpass_filter_width: int = 6, rolloff: float = 0.99) -> torch.Tensor:
+    '''
+    band limited polyphase resampling with a Hann windowed sinc kernel, one conv1d call
+    @param waveform: float tensor (..., samples)
+    @return: float tensor (..., resampled samples)
+    '''
+    if orig == new:
+        return waveform
+    divisor = math.gcd(orig, new)
+    orig, new = orig // divisor, new // divisor
+    width = math.ceil(lowpass_filter_width * orig / (min(orig, new) * rolloff))
+    kernel = _sinc_kernel(orig, new, width, lowpass_filter_width, rolloff, waveform.device, waveform.dtype)
+    shape = waveform.shape
+    length = shape[-1]
+    signal = torch.nn.functional.pad(waveform.reshape(-1, 1, length), (width, width + orig))
+    resampled = torch.nn.functional.conv1d(signal, kernel, stride=orig)
+    resampled = resampled.transpose(1, 2).reshape(*shape[:-1], -1)
+    return resampled[..., :math.ceil(new * length / orig)]
+
+
+def to_pcm(waveform: torch.Tensor) -> torch.Tensor:
+    ''' float samples in -1..1 to int32 tensor holding 16 bit values, samples beyond full scale are clipped '''
+    return (waveform.clamp(-1.0, 1.0) * PCM_SCALE).round().to(torch.int32)
+
+
+_ULAW_SEGMENT_ENDS = (0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF)
+_ALAW_SEGMENT_ENDS = (0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF)
+
+
+def mulaw_encode(pcm: torch.Tensor) -> torch.Tensor:
+    '''
+    G.711 mu-law, bit exact with the reference encoder
+    @param pcm: int32 tensor of 16 bit samples
+    @return: uint8 tensor
+    '''
+    value = pcm >> 2
+    mask = torch.where(value < 0, 0x7F, 0xFF)
+    value = value.abs().clamp(max=8159) + 0x21
+    segment = torch.bucketize(value, torch.tensor(_ULAW_SEGMENT_ENDS, device=pcm.device, dtype=value.dtype))
+    encoded = (segment << 4) | ((value >> (segment + 1)) & 0xF)
+    encoded = torch.where(segment >= 8, 0x7F, encoded)
+    return (encoded ^ mask).to(torch.uint8)
+
+
+def alaw_encode(pcm: torch.Tensor) -> torch.Tensor:
+    '''
+    G.711 A-law, bit exact with the reference encoder
+    @param pcm: int32 tensor of 16 bit samples
+    @return: uint8 tensor
+    '''
+    value = pcm >> 3
+    negative = value < 0
+    mask = torch.where(negative, 0x55, 0xD5)
+    value = torch.where(negative, -value - 1, value)
+    segment = torch.bucketize(value, torch.tensor(_ALAW_SEGMENT_ENDS, device=pcm.device, dtype=value.dtype))
+    shift = torch.where(segment < 2, torch.ones_like(segment), segment)
+    encoded = (segment << 4) | ((value >> shift) & 0xF)
+    encoded = torch.where(segment >= 8, 0x7F, encoded)
+    return (encoded ^ mask).to(torch.uint8)
+
+
+def _encode_flac(pcm, rate: int) -> bytes:
+    if soundfile is not None:
+        buffer = io.BytesIO()
+        soundfile.write(buffer, pcm, rate, format='FLAC', subtype='PCM_16')
+        return buffer.getvalue()
+    return subprocess.run(['flac', '--silent', '--force-raw-format', '--endian=little', '--sign=signed',
+                           '--channels=1', '--bps=16', f'--sample-rate={rate}', '--stdout', '-'],
+                          input=memoryview(pcm).cast('B'), capture_output=True, check=True).stdout
+
+
+def encode(waveform: torch.Tensor, output_format: OutputFormat, sample_rate: int = SAMPLE_RATE) -> bytes:
+    '''
+    @param waveform: float tensor, vocoder output in the range of -1 to 1 on any device
+    @param output_format: OutputFormat, from negotiate
+    @return: bytes of the encoded audio
+    resampling and companding run on the waveform's device, only the
+    final 8 or 16 bit samples are copied to the host
+    '''
+    with metrics.stage('postprocess'):
+        waveform = resample(waveform.reshape(-1), sample_rate, output_format.rate)
+        pcm = to_pcm(waveform)
+        if output_format.name == 'mulaw':
+            samples = mulaw_encode(pcm).cpu().numpy()
+        elif output_format.name == 'alaw':
+            samples = alaw_encode(pcm).cpu().numpy()
+        else:
+            samples = pcm.to(torch.int16).cpu().numpy()
+    with metrics.stage('encode'):
+        if output_format.name == 'wav':
+            return encode_wav(samples, output_format.rate)
+        if output_format.name == 'flac':
+            return _encode_flac(samples, output_format.rate)
+        return samples.tobytes()
+
+
+def response_headers(output_format: OutputFormat) -> Dict[str, str]:
+    return {
+        'Content-Type': output_format.mimetype,
+        'Content-Disposition': f"attachment; filename=glados_tts.{output_format.extension}",
+    }
@@ -0,0 +1,244 @@
+'''
+Inference backends: the acoustic model and the vocoder behind one
+interface, Glados only calls generate and vocode.
+
+    torchscript  the shipped models/glados.pt and models/vocoder-gpu.pt
+    onnx         ONNX Runtime on cpu, models exported once with:
+
+    python -m utils.backends export [--glados models/glados.pt] [--vocoder models/vocoder-gpu.pt]
+
+The export checks the ONNX models against the TorchScript ones and
+exits with status 1 when their audio differs. Tensors stay torch tensors
+at the interface, the onnx backend converts them to numpy arrays around
+its runs.
+'''
+
+import argparse
+import os
+import sys
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy
+import torch
+
+from utils import cpu_tuning
+from utils.cache import model_version
+
+BACKEND_VARIABLE = 'GLADOS_BACKEND'
+DEFAULT_BACKEND = 'torchscript'
+ONNX_OPSET = 17
+
+
+class InferenceBackend:
+    '''
+    acoustic model plus vocoder. subclasses load both files onto a device
+    and run them on torch tensors
+    '''
+
+    name: str = None
+
+    def __init__(self, glados_path: str, vocoder_path: str) -> None:
+        self.glados_path = glados_path
+        self.vocoder_path = vocoder_path
+
+    @property
+    def loaded(self) -> bool:
+        raise NotImplementedError
+
+    def load(self, device: str) -> None:
+        ''' loads both models, raises when they cannot run on device '''
+        raise NotImplementedError
+
+    def unload(self) -> None:
+        raise NotImplementedError
+
+    def generate(self, tokens: torch.Tensor) -> Dict[str, torch.Tensor]:
+        '''
+        @param tokens: int tensor (batch, tokens) of symbol ids
+        @return: 'mel_post' (batch, n_mels, frames) and 'dur' (batch, tokens), frames per token
+        '''
+        raise NotImplementedError
+
+    def vocode(self, mel: torch.Tensor) -> torch.Tensor:
+        '''
+        @param mel: float tensor (batch, n_mels, frames)
+        @return: float tensor (batch, 1, samples) in the range of -1 to 1
+        '''
+        raise NotImplementedError
+
+    def tune(self, settings: cpu_tuning.CpuSettings) -> None:
+        ''' applies the cpu settings that make sense for the backend '''
+        cpu_tuning.apply_threads(settings)
+
+    def version(self) -> str:
+        ''' changes whenever a model file is replaced, part of the audio cache key '''
+        return model_version(self.glados_path, self.vocoder_path)
+
+
+class TorchScriptBackend(InferenceBackend):
+
+    name = 'torchscript'
+
+    def __init__(self, glados_path: str, vocoder_path: str) -> None:
+        super().__init__(glados_path, vocoder_path)
+        self.glados_model: Optional[torch.jit.ScriptModule] = None
+        self.vocoder: Optional[torch.jit.ScriptModule] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.glados_model is not None and self.vocoder is not None
+
+    def load(self, device: str) -> None:
+        # models saved on a gpu have to be mapped explicitly on cpu only machines
+        self.glados_model = torch.jit.load(self.glados_path, map_location='cpu' if device == 'cpu' else None)
+        self.vocoder = torch.jit.load(self.vocoder_path, map_location=device)
+
+    def unload(self) -> None:
+        self.glados_model = None
+        self.vocoder = None
+
+    def generate(self, tokens: torch.Tensor) -> Dict[str, torch.Tensor]:
+        return self.glados_model.generate_jit(tokens)
+
+    def vocode(self, mel: torch.Tensor) -> torch.Tensor:
+        return self.vocoder(mel)
+
+    def tune(self, settings: cpu_tuning.CpuSettings) -> None:
+        self.glados_model, self.vocoder = cpu_tuning.tune(self.glados_model, self.vocoder, settings)
+
+
+class OnnxBackend(InferenceBackend):
+    '''
+    runs the exported models with ONNX Runtime's cpu execution provider,
+    each process builds its own sessions since their thread pools do not
+    survive a fork
+    '''
+
+    name = 'onnx'
+
+    def __init__(self, glados_path: str, vocoder_path: str) -> None:
+        super().__init__(glados_path, vocoder_path)
+        self._sessions: Optional[tuple] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._sessions is not None
+
+    def load(self, device: str) -> None:
+        if device != 'cpu':
+            raise RuntimeError(f"the onnx backend runs on cpu only, not on {device}")
+        for path in (self.glados_path, self.vocoder_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{path} is missing, export it with: python -m utils.backends export")
+        self.sessions()
+
+    def unload(self) -> None:
+        self._sessions = None
+        self._pid = None
+
+    def sessions(self) -> tuple:
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    import onnxruntime
+                    options = onnxruntime.SessionOptions()
+                    # follows the torch setting, which prefork and the cpu settings adjust
+                    options.intra_op_num_threads = torch.get_num_threads()
+                    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    self._sessions = tuple(onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+                                           for path in (self.glados_path, self.vocoder_path))
+                    self._pid = os.getpid()
+        return self._sessions
+
+    def generate(self, tokens: torch.Tensor) -> Dict[str, torch.Tensor]:
+        mel, duration = self.sessions()[0].run(['mel_post', 'dur'], {'tokens': tokens.numpy().astype(numpy.int64)})
+        return {'mel_post': torch.from_numpy(mel), 'dur': torch.from_numpy(duration)}
+
+    def vocode(self, mel: torch.Tensor) -> torch.Tensor:
+        audio, = self.sessions()[1].run(['audio'], {'mel': mel.cpu().numpy().astype(numpy.float32, copy=False)})
+        return torch.from_numpy(audio)
+
+    def tune(self, settings: cpu_tuning.CpuSettings) -> None:
+        super().tune(settings)
+        if self._sessions is not None:
+            # rebuilt with the new thread count on the next run
+            self._pid = None
+
+
+BACKENDS = {backend.name: backend for backend in (TorchScriptBackend, OnnxBackend)}
+
+
+def create_backend(name: Optional[str], paths: Dict[str, Tuple[str, str]]) -> InferenceBackend:
+    '''
+    @param name: String, backend name, defaults to $GLADOS_BACKEND or torchscript
+    @param paths: backend name -> (acoustic model path, vocoder path)
+    '''
+    name = name or os.environ.get(BACKEND_VARIABLE, DEFAULT_BACKEND)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name}, choose from {', '.join(BACKENDS)}")
+    return BACKENDS[name](*paths[name])
+
+
+class _AcousticExport(torch.nn.Module):
+    # torch.onnx exports forward only, generate_jit is traced through this wrapper
+
+    def __init__(self, model: torch.jit.ScriptModule) -> None:
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        output = self.model.generate_jit(tokens)
+        return output['mel_post'], output['dur']
+
+
+def export(glados_path: str, vocoder_path: str, onnx_glados_path: str, onnx_vocoder_path: str,
+           tokens: torch.Tensor) -> float:
+    '''
+    converts both TorchScript models to ONNX
+    @param tokens: int tensor (1, tokens), example input traced through the acoustic model
+    @return: signal to noise ratio in dB of the ONNX audio against the TorchScript audio
+    '''
+    source = TorchScriptBackend(glados_path, vocoder_path)
+    source.load('cpu')
+    tokens = tokens.long()
+    with torch.no_grad():
+        mel = source.generate(tokens)['mel_post']
+        reference = source.vocode(mel)
+        torch.onnx.export(_AcousticExport(source.glados_model).eval(), (tokens,), onnx_glados_path,
+                          input_names=['tokens'], output_names=['mel_post', 'dur'], opset_version=ONNX_OPSET,
+                          dynamic_axes={'tokens': {0: 'batch', 1: 'tokens'},
+                                        'mel_post': {0: 'batch', 2: 'frames'},
+                                        'dur': {0: 'batch', 1: 'tokens'}})
+        torch.onnx.export(source.vocoder.eval(), (mel,), onnx_vocoder_path,
+                          input_names=['mel'], output_names=['audio'], opset_version=ONNX_OPSET,
+                          dynamic_axes={'mel': {0: 'batch', 2: 'frames'}, 'audio': {0: 'batch', 2: 'samples'}})
+    exported = OnnxBackend(onnx_glados_path, onnx_vocoder_path)
+    exported.load('cpu')
+    audio = exported.vocode(exported.generate(tokens)['mel_post'])
+    return cpu_tuning.signal_to_noise(reference.reshape(-1), audio.reshape(-1))
+
+
+def main(arguments: Optional[list] = None) -> None:
+    import glados
+    from utils.frontend import TextFrontend
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help="convert the TorchScript models to ONNX")
+    export_parser.add_argument('--glados', default=glados.glados_model_path)
+    export_parser.add_argument('--vocoder', default=glados.vocoder_model_path)
+    export_parser.add_argument('--onnx-glados', default=glados.onnx_glados_model_path)
+    export_parser.add_argument('--onnx-vocoder', default=glados.onnx_vocoder_model_path)
+    args = parser.parse_args(arguments)
+
+    tokens = torch.from_numpy(TextFrontend().encode(glados.WARM_UP_PHONEMES)).unsqueeze(0)
+    snr = export(args.glados, args.vocoder, args.onnx_glados, args.onnx_vocoder, tokens)
+    print(f"exported {args.onnx_glados} and {args.onnx_vocoder}, audio snr {snr:.1f} dB against TorchScript")
+    sys.exit(0 if snr >= cpu_tuning.PARITY_SNR_DB else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from utils import metrics
+
+INDEX_FILE = 'index.json'
+# seconds between two writes of the index while entries change, it is also written at exit
+INDEX_INTERVAL = 5.0
+
+HITS = metrics.REGISTRY.counter('glados_cache_hits_total', 'Audio cache lookups that found the audio')
+HOT_HITS = metrics.REGISTRY.counter('glados_cache_hot_hits_total', 'Audio cache hits served from memory')
+MISSES = metrics.REGISTRY.counter('glados_cache_misses_total', 'Audio cache lookups that found nothing')
+EVICTIONS = metrics.REGISTRY.counter('glados_cache_evictions_total', 'Audio files evicted over the byte budget')
+CACHED_BYTES = metrics.REGISTRY.gauge('glados_cache_bytes', 'Bytes of audio in the cache')
+
+
+def cache_key(phonemes: str, model_version: str, variant: str = 'wav') -> str:
+    '''
+    @param phonemes: normalized phoneme sequence of the utterance
+    @param model_version: identifies the models (and settings) that render the audio
+    @param variant: output format of the cached file
+    @return: hex digest used as content address
+    '''
+    digest = hashlib.sha256()
+    for part in (model_version, variant, phonemes):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def model_version(*paths: str) -> str:
+    ''' cheap fingerprint of model files, changes whenever a file is replaced '''
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class AudioCache:
+    '''
+    content addressed audio cache on disk with a persistent index, a byte
+    budget enforced by least-recently-used eviction and an in-memory hot tier
+    for small clips. the index is written by a background thread every
+    INDEX_INTERVAL seconds while it changes and at exit, not on every put
+    '''
+
+    def __init__(self,
+                 directory: str,
+                 max_bytes: int = 512 * 1024 * 1024,
+                 hot_max_bytes: int = 32 * 1024 * 1024,
+                 hot_max_item_bytes: int = 256 * 1024) -> None:
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.hot_max_bytes = hot_max_bytes
+        self.hot_max_item_bytes = hot_max_item_bytes
+        self.hits = 0
+        self.hot_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self.hot_size = 0
+        # key -> [size in bytes, file extension, last access], least recently used first
+        self._entries: 'OrderedDict[str, list]' = OrderedDict()
+        self._hot: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        # pid of the process whose thread writes the index, forked workers start their own
+        self._writer_pid: Optional[int] = None
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+        atexit.register(self.flush)
+
+    def path(self, key: str, extension: str = 'wav') -> str:
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def owns(self, path: str) -> bool:
+        ''' true for files managed by the cache, these must not be deleted by callers '''
+        name = os.path.basename(path)
+        return (os.path.dirname(os.path.abspath(path)) == self.directory
+                and name.rsplit('.', 1)[0] in self._entries)
+
+    def get(self, key: str, extension: str = 'wav') -> Optional[str]:
+        '''
+        @return: path of the cached file or None, counts a hit or a miss
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._adopt(key, extension)
+            if entry is None:
+                self.misses += 1
+                MISSES.inc()
+                return None
+            path = self.path(key, entry[1])
+            if not os.path.exists(path):
+                self._drop(key)
+                self.misses += 1
+                MISSES.inc()
+                return None
+            self._touch(key, entry)
+            self.hits += 1
+            HITS.inc()
+            return path
+
+    def get_bytes(self, key: str, extension: str = 'wav') -> Optional[bytes]:
+        '''
+        @return: content of the cached file or None, small clips are served from memory
+        '''
+        with self._lock:
+            data = self._hot.get(key)
+            if data is not None:
+                self._hot.move_to_end(key)
+                self._touch(key, self._entries[key])
+                self.hits += 1
+                self.hot_hits += 1
+                HITS.inc()
+                HOT_HITS.inc()
+                return data
+        path = self.get(key, extension)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._remember(key, data)
+        return data
+
+    def put(self, key: str, data: bytes, extension: str = 'wav') -> str:
+        '''
+        persists data under key, evicting least recently used files beyond the byte budget
+        @return: path of the cached file
+        '''
+        path = self.path(key, extension)
+        temporary_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(temporary_path, 'wb') as file:
+            file.write(data)
+        os.replace(temporary_path, path)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key, remove_file=False)
+            self._entries[key] = [len(data), extension, time.time()]
+            self.size += len(data)
+            self._remember(key, data)
+            self._evict()
+            self._dirty = True
+            CACHED_BYTES.set(self.size)
+            if self._writer_pid != os.getpid():
+                self._writer_pid = os.getpid()
+                threading.Thread(target=self._write_periodically, name="glados-cache-index", daemon=True).start()
+        return path
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'hot_hits': self.hot_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'hot_bytes': self.hot_size,
+            'max_bytes': self.max_bytes,
+        }
+
+    def flush(self) -> None:
+        ''' writes entries and access times gathered since the last write to the index '''
+        if self._dirty:
+            self._write_index()
+
+    def _write_periodically(self) -> None:
+        while True:
+            time.sleep(INDEX_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def _adopt(self, key: str, extension: str) -> Optional[list]:
+        # another process sharing the directory may have written the file
+        path = self.path(key, extension)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        entry = self._entries[key] = [size, extension, time.time()]
+        self.size += size
+        self._dirty = True
+        return entry
+
+    def _touch(self, key: str, entry: list) -> None:
+        entry[2] = time.time()
+        self._entries.move_to_end(key)
+        self._dirty = True
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.hot_max_item_bytes or key in self._hot:
+            return
+        self._hot[key] = data
+        self.hot_size += len(data)
+        while self.hot_size > self.hot_max_bytes:
+            _, evicted = self._hot.popitem(last=False)
+            self.hot_size -= len(evicted)
+
+    def _drop(self, key: str, remove_file: bool = True) -> None:
+        size, extension, _ = self._entries.pop(key)
+        self.size -= size
+        data = self._hot.pop(key, None)
+        if data is not None:
+            self.hot_size -= len(data)
+        if remove_file:
+            try:
+                os.remove(self.path(key, extension))
+            except OSError:
+                pass
+        self._dirty = True
+
+    def _evict(self) -> None:
+        # the newest entry is kept even when it alone exceeds the budget
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            self._drop(key)
+            self.evictions += 1
+            EVICTIONS.inc()
+
+    def _read_index(self) -> dict:
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _merge_index(self, index: dict) -> None:
+        ''' adds entries of the index file that are unknown to this process as least recently used '''
+        for key, (size, extension, accessed) in sorted(index.items(), key=lambda item: item[1][2], reverse=True):
+            if key not in self._entries and os.path.exists(self.path(key, extension)):
+                self._entries[key] = [size, extension, accessed]
+                self._entries.move_to_end(key, last=False)
+                self.size += size
+
+    def _load_index(self) -> None:
+        self._merge_index(self._read_index())
+        self._evict()
+        CACHED_BYTES.set(self.size)
+
+    def _write_index(self) -> None:
+        # worker processes share the directory, keep what the others recorded.
+        # only the merge holds the lock, reading and writing the file do not
+        index = self._read_index()
+        with self._lock:
+            self._merge_index(index)
+            self._evict()
+            content = json.dumps(self._entries)
+            self._dirty = False
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        temporary_path = f"{index_path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        os.replace(temporary_path, index_path)
@@ -1,7 +1,10 @@
 import re
-from typing import Dict, Any
+from typing import Dict, Any, List
 
-from phonemizer.phonemize import phonemize
+from utils.espeak import EspeakSession, get_session
+from utils import metrics
+from utils.lexicon import Lexicon, phonemize_by_word
+from utils.normalizer import ABBREVIATIONS, UNITS, Normalizer
 from utils.numbers import normalize_numbers
 from utils.symbols import phonemes_set
 from unidecode import unidecode
@@ -10,26 +13,10 @@ from unidecode import unidecode
 _whitespace_re = re.compile(r'\s+')
 
 # List of (regular expression, replacement) pairs for abbreviations:
-_abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1]) for x in [
-    ('mrs', 'misess'),
-    ('mr', 'mister'),
-    ('dr', 'doctor'),
-    ('st', 'saint'),
-    ('co', 'company'),
-    ('jr', 'junior'),
-    ('maj', 'major'),
-    ('gen', 'general'),
-    ('drs', 'doctors'),
-    ('rev', 'reverend'),
-    ('lt', 'lieutenant'),
-    ('hon', 'honorable'),
-    ('sgt', 'sergeant'),
-    ('capt', 'captain'),
-    ('esq', 'esquire'),
-    ('ltd', 'limited'),
-    ('col', 'colonel'),
-    ('ft', 'fort'),
-]]
+_abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1]) for x in ABBREVIATIONS.items()]
+
+# compiled once, tables can be extended through GLADOS_NORMALIZER_LEXICONS
+_normalizer = Normalizer.from_environment()
 
 def expand_abbreviations(text):
     for regex, replacement in _abbreviations:
@@ -37,14 +24,8 @@ def expand_abbreviations(text):
     return text
 
 def expand_units(text):
-    text = text.replace("°C", "degrees selsius")
-    text = text.replace("°F", "degrees fahrenheit")
-    text = text.replace("°c", "degrees selsius")
-    text = text.replace("°f", "degrees fahrenheit")
-    text = text.replace("°", "degrees")
-    text = text.replace("hPa", "hecto pascals")
-    text = text.replace("g/m³", "grams per cubic meter")
-    text = text.replace("% (RH)", "percent relative humidity")
+    for unit, replacement in UNITS.items():
+        text = text.replace(unit, replacement)
     return text
 
 def collapse_whitespace(text):
@@ -55,7 +36,8 @@ def no_cleaners(text):
     return text
 
 
-def english_cleaners(text):
+def chained_english_cleaners(text):
+    ''' reference implementation of english_cleaners, one pass per table entry '''
     text = expand_units(text)
     text = unidecode(text)
     text = normalize_numbers(text)
@@ -63,18 +45,31 @@ def english_cleaners(text):
     return text
 
 
-def to_phonemes(text: str, lang: str) -> str:
-    phonemes = phonemize(text,
-                         language=lang,
-                         backend='espeak',
-                         strip=True,
-                         preserve_punctuation=True,
-                         with_stress=False,
-                         njobs=1,
-                         punctuation_marks=';:,.!?¡¿—…"«»“”()',
-                         language_switch='remove-flags')
-    phonemes = ''.join([p for p in phonemes if p in phonemes_set])
-    return phonemes
+def english_cleaners(text):
+    return _normalizer(text)
+
+
+class _PhonemeTable(dict):
+    ''' str.translate table keeping phonemes, unknown characters are deleted '''
+
+    def __missing__(self, codepoint: int) -> None:
+        self[codepoint] = None
+        return None
+
+
+_phoneme_table = _PhonemeTable({ord(p): ord(p) for p in phonemes_set})
+
+
+def filter_phonemes(phonemes: str) -> str:
+    return phonemes.translate(_phoneme_table)
+
+
+def to_phonemes(text: str, lang: str, session: EspeakSession = None, lexicon: Lexicon = None) -> str:
+    if session is None:
+        session = get_session(lang)
+    if lexicon is not None:
+        return filter_phonemes(phonemize_by_word([text], lexicon, session)[0])
+    return filter_phonemes(session(text))
 
 
 class Cleaner:
@@ -82,7 +77,8 @@ class Cleaner:
     def __init__(self,
                  cleaner_name: str,
                  use_phonemes: bool,
-                 lang: str) -> None:
+                 lang: str,
+                 lexicon: Lexicon = None) -> None:
         if cleaner_name == 'english_cleaners':
             self.clean_func = english_cleaners
         elif cleaner_name == 'no_cleaners':
@@ -92,20 +88,41 @@ class Cleaner:
                              f'Currently supported: [\'english_cleaners\', \'no_cleaners\']')
         self.use_phonemes = use_phonemes
         self.lang = lang
+        self.session = get_session(lang) if use_phonemes else None
+        # with a lexicon words are phonemized one by one, see utils.lexicon
+        self.lexicon = lexicon
 
     def __call__(self, text: str) -> str:
-        text = self.clean_func(text)
+        with metrics.stage('normalize'):
+            text = self.clean_func(text)
         if self.use_phonemes:
-            text = to_phonemes(text, self.lang)
+            with metrics.stage('phonemize'):
+                text = to_phonemes(text, self.lang, self.session, self.lexicon)
+        return self._finish(text)
+
+    def batch(self, texts: List[str], njobs: int = 1) -> List[str]:
+        with metrics.stage('normalize'):
+            texts = [self.clean_func(text) for text in texts]
+        with metrics.stage('phonemize'):
+            if self.use_phonemes and self.lexicon is not None:
+                texts = [filter_phonemes(p) for p in phonemize_by_word(texts, self.lexicon, self.session, njobs)]
+            elif self.use_phonemes:
+                texts = [filter_phonemes(p) for p in self.session.phonemize_batch(texts, njobs)]
+        return [self._finish(text) for text in texts]
+
+    @staticmethod
+    def _finish(text: str) -> str:
         text = collapse_whitespace(text)
         text = text.strip()
         return text
 
     @classmethod
     def from_config(cls, config: Dict[str, Any]) -> 'Cleaner':
+        lexicon_path = config['preprocessing'].get('lexicon')
         return Cleaner(
             cleaner_name=config['preprocessing']['cleaner_name'],
             use_phonemes=config['preprocessing']['use_phonemes'],
-            lang=config['preprocessing']['language']
+            lang=config['preprocessing']['language'],
+            lexicon=Lexicon(lexicon_path) if lexicon_path else None
         )
 
@@ -0,0 +1,206 @@
+'''
+CPU execution settings for the TorchScript models: inference mode,
+frozen and inference-optimized graphs, thread pool sizes and optional
+dynamic int8 quantization of the vocoder.
+
+The autotune command measures the combinations on the local machine and
+saves the fastest one whose audio matches the default path, the engine
+applies the saved settings whenever it runs on cpu:
+
+    python -m utils.cpu_tuning autotune [--repeats 3] [--output models/cpu_tuning.json]
+    python -m utils.cpu_tuning show
+
+Quantization only covers linear layers in TorchScript graphs, convolution
+heavy vocoders keep most of their float math and gain little from it.
+Inter-op threads can only be set once per process, autotune therefore
+varies the intra-op threads only.
+'''
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import statistics
+import time
+from typing import ContextManager, List, NamedTuple, Optional, Tuple
+
+import torch
+
+SETTINGS_PATH = 'models/cpu_tuning.json'
+# minimum signal to noise ratio of tuned audio against the default path
+PARITY_SNR_DB = 30.0
+AUTOTUNE_TEXTS = [
+    "Hello, and welcome to the Aperture Science computer-aided enrichment center.",
+    "The cake is a lie.",
+    "Please proceed to the chamberlock. Mind the gap.",
+]
+
+
+class CpuSettings(NamedTuple):
+    inference_mode: bool = True
+    freeze: bool = True
+    quantize_vocoder: bool = False
+    # None keeps the torch defaults
+    intra_threads: Optional[int] = None
+    interop_threads: Optional[int] = None
+
+    @property
+    def variant(self) -> str:
+        ''' part of the audio cache version, settings that change the samples change it '''
+        return f"f{int(self.freeze)}q{int(self.quantize_vocoder)}"
+
+    def grad_context(self) -> ContextManager:
+        ''' disables autograd for inference, inference mode also skips version counting '''
+        return torch.inference_mode() if self.inference_mode else torch.no_grad()
+
+
+DEFAULT_SETTINGS = CpuSettings(inference_mode=False, freeze=False)
+
+
+def load_settings(path: str = SETTINGS_PATH) -> Optional[CpuSettings]:
+    ''' settings saved by autotune, None when there are none '''
+    try:
+        with open(path, encoding='utf-8') as file:
+            return CpuSettings(**json.load(file)['settings'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_settings(settings: CpuSettings, path: str = SETTINGS_PATH, results: Optional[list] = None) -> None:
+    temporary_path = f"{path}.tmp{os.getpid()}"
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump({'settings': settings._asdict(), 'results': results or []}, file, indent=2)
+    os.replace(temporary_path, path)
+
+
+def apply_threads(settings: CpuSettings) -> None:
+    if settings.intra_threads:
+        torch.set_num_threads(settings.intra_threads)
+    if settings.interop_threads:
+        try:
+            torch.set_num_interop_threads(settings.interop_threads)
+        except RuntimeError:
+            # only possible before the first inter-op parallel work of the process
+            logging.warning("inter-op threads already started, keeping %d", torch.get_num_interop_threads())
+
+
+def optimize(module: torch.jit.ScriptModule, methods: Tuple[str, ...] = ()) -> torch.jit.ScriptModule:
+    '''
+    @param module: loaded TorchScript module
+    @param methods: methods besides forward that have to survive freezing
+    @return: frozen and inference-optimized module, the module itself when it cannot be frozen
+    '''
+    try:
+        frozen = torch.jit.freeze(module.eval(), preserved_attrs=list(methods))
+        return torch.jit.optimize_for_inference(frozen, other_methods=list(methods))
+    except Exception as exception:
+        logging.warning("could not freeze %s: %s", module.original_name, exception)
+        return module
+
+
+def quantize(module: torch.jit.ScriptModule) -> torch.jit.ScriptModule:
+    ''' dynamic int8 quantization of the linear layers of a TorchScript module '''
+    from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic_jit
+    try:
+        return quantize_dynamic_jit(module.eval(), {'': default_dynamic_qconfig})
+    except Exception as exception:
+        logging.warning("could not quantize %s: %s", module.original_name, exception)
+        return module
+
+
+def tune(glados_model: torch.jit.ScriptModule, vocoder: torch.jit.ScriptModule,
+         settings: CpuSettings) -> Tuple[torch.jit.ScriptModule, torch.jit.ScriptModule]:
+    '''
+    @return: glados model and vocoder prepared for the settings, the given modules stay untouched
+    '''
+    apply_threads(settings)
+    if settings.quantize_vocoder:
+        vocoder = quantize(vocoder)
+    if settings.freeze:
+        glados_model = optimize(glados_model, ('generate_jit',))
+        vocoder = optimize(vocoder)
+    return glados_model, vocoder
+
+
+def signal_to_noise(reference: torch.Tensor, audio: torch.Tensor) -> float:
+    length = min(reference.shape[-1], audio.shape[-1])
+    reference = reference[..., :length].double()
+    noise = (reference - audio[..., :length].double()).pow(2).sum()
+    if noise == 0:
+        return float('inf')
+    return float(10 * torch.log10(reference.pow(2).sum() / noise))
+
+
+def candidates(max_threads: int) -> List[CpuSettings]:
+    threads = sorted({1, 2, max_threads // 2, max_threads} - {0})
+    return [CpuSettings(inference_mode, freeze, quantize_vocoder, intra_threads)
+            for inference_mode, freeze, quantize_vocoder, intra_threads
+            in itertools.product((False, True), (False, True), (False, True), threads)]
+
+
+def autotune(glados, texts: List[str] = AUTOTUNE_TEXTS, repeats: int = 3) -> Tuple[CpuSettings, list]:
+    '''
+    @param glados: Glados with the torchscript backend loaded on cpu and without tuning
+    @return: fastest settings whose audio passes the parity check, and the results of every candidate
+    '''
+    backend = glados.backend
+    glados_model, vocoder = backend.glados_model, backend.vocoder
+    default_threads = torch.get_num_threads()
+    glados.settings = DEFAULT_SETTINGS
+    references = [glados.get_waveform_from_text(text) for text in texts]
+    results = []
+    for settings in candidates(default_threads):
+        backend.glados_model, backend.vocoder = tune(glados_model, vocoder, settings)
+        glados.settings = settings
+        try:
+            # the first two calls profile and optimize the graphs
+            for _ in range(2):
+                audio = [glados.get_waveform_from_text(text) for text in texts]
+            snr = min(signal_to_noise(r, a) for r, a in zip(references, audio))
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                for text in texts:
+                    glados.get_waveform_from_text(text)
+                timings.append(time.perf_counter() - started)
+        except Exception as exception:
+            logging.warning("settings %s failed: %s", settings, exception)
+            continue
+        result = {'settings': settings._asdict(), 'seconds': statistics.median(timings),
+                  'snr_db': snr, 'parity': snr >= PARITY_SNR_DB}
+        results.append(result)
+        print(f"{settings}: {result['seconds'] * 1000:.1f} ms, snr {snr:.1f} dB"
+              f"{'' if result['parity'] else ' (fails parity)'}")
+    backend.glados_model, backend.vocoder = glados_model, vocoder
+    glados.settings = DEFAULT_SETTINGS
+    torch.set_num_threads(default_threads)
+    passing = [result for result in results if result['parity']]
+    if not passing:
+        return DEFAULT_SETTINGS, results
+    return CpuSettings(**min(passing, key=lambda result: result['seconds'])['settings']), results
+
+
+def main(arguments: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    autotune_parser = commands.add_parser('autotune', help="measure the settings and save the fastest")
+    autotune_parser.add_argument('--repeats', type=int, default=3)
+    autotune_parser.add_argument('--output', default=SETTINGS_PATH)
+    show_parser = commands.add_parser('show', help="print the saved settings")
+    show_parser.add_argument('--output', default=SETTINGS_PATH)
+    args = parser.parse_args(arguments)
+
+    if args.command == 'show':
+        print(load_settings(args.output))
+        return
+    from glados import Glados
+    glados = Glados(backend='torchscript')
+    glados.load_glados_model(warm_up='none', devices=[], cpu_settings=DEFAULT_SETTINGS)
+    best, results = autotune(glados, repeats=args.repeats)
+    save_settings(best, args.output, results)
+    print(f"saved {best} to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from phonemizer.backend import EspeakBackend
+
+# Punctuation kept by espeak, identical to what to_phonemes always used
+PUNCTUATION_MARKS = ';:,.!?¡¿—…"«»“”()'
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class EspeakSession:
+    '''
+    Long-lived espeak backend with a bounded LRU cache from cleaned text
+    to phoneme string. Produces the same output as
+    phonemizer.phonemize(text, backend='espeak', strip=True, ...) but
+    builds the backend only once.
+    '''
+
+    def __init__(self, lang: str, cache_size: int = 4096) -> None:
+        self.lang = lang
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: 'OrderedDict[str, str]' = OrderedDict()
+        # phonemizer and the espeak library are loaded with the first phonemization
+        self._backend: Optional['EspeakBackend'] = None
+        self._separator = None
+        # the espeak library is not reentrant, serialize every backend call
+        self._backend_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+
+    @property
+    def backend(self) -> 'EspeakBackend':
+        if self._backend is None:
+            from phonemizer.backend import EspeakBackend
+            from phonemizer.separator import Separator
+            self._separator = Separator(phone='', syllable='', word=' ')
+            self._backend = EspeakBackend(self.lang,
+                                          punctuation_marks=PUNCTUATION_MARKS,
+                                          preserve_punctuation=True,
+                                          with_stress=False,
+                                          language_switch='remove-flags')
+        return self._backend
+
+    def __call__(self, text: str) -> str:
+        return self.phonemize_batch([text])[0]
+
+    def phonemize_batch(self, texts: List[str], njobs: int = 1) -> List[str]:
+        '''
+        phonemizes many texts, sending every cache miss to espeak in a single backend call
+        @param texts: list of cleaned texts
+        @param njobs: number of espeak jobs used for the misses
+        @return: list of phoneme strings, in the order of texts
+        '''
+        results: Dict[str, str] = {}
+        missing: List[str] = []
+        with self._cache_lock:
+            for text in texts:
+                if text in results:
+                    continue
+                phonemes = self._cache.get(text)
+                if phonemes is None:
+                    self.misses += 1
+                    if text not in missing:
+                        missing.append(text)
+                else:
+                    self.hits += 1
+                    self._cache.move_to_end(text)
+                    results[text] = phonemes
+        if missing:
+            phonemized = self._phonemize(missing, njobs)
+            with self._cache_lock:
+                for text, phonemes in zip(missing, phonemized):
+                    results[text] = phonemes
+                    self._cache[text] = phonemes
+                    self._cache.move_to_end(text)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return [results[text] for text in texts]
+
+    def _phonemize(self, texts: List[str], njobs: int) -> List[str]:
+        # phonemizer splits str input into lines and drops empty ones,
+        # mirror that so every text maps to exactly one output string
+        lines_per_text = []
+        lines: List[str] = []
+        for text in texts:
+            text_lines = [line for line in text.strip(os.linesep).split(os.linesep) if line.strip()]
+            lines_per_text.append(len(text_lines))
+            lines.extend(text_lines)
+        with self._backend_lock:
+            phonemized = self.backend.phonemize(lines, separator=self._separator,
+                                                strip=True, njobs=njobs) if lines else []
+        output = []
+        position = 0
+        for count in lines_per_text:
+            output.append(os.linesep.join(phonemized[position:position + count]))
+            position += count
+        return output
+
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.cache_size, len(self._cache))
+
+    def cache_clear(self) -> None:
+        with self._cache_lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_sessions: Dict[str, EspeakSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(lang: str) -> EspeakSession:
+    ''' returns the process wide espeak session for the given language '''
+    with _sessions_lock:
+        session = _sessions.get(lang)
+        if session is None:
+            session = EspeakSession(lang)
+            _sessions[lang] = session
+        return session
@@ -0,0 +1,74 @@
+import os
+from typing import List, Optional, Tuple
+
+import numpy
+import torch
+
+from utils import metrics
+from utils.cleaners import Cleaner
+from utils.lexicon import Lexicon
+from utils.tokenizer import Tokenizer
+
+# word level phonemization is opt-in: build a lexicon with
+#   python -m utils.lexicon build <wordlist> models/lexicon.txt
+# check it with benchmarks/lexicon_corpus.txt and set GLADOS_LEXICON=models/lexicon.txt
+LEXICON_VARIABLE = 'GLADOS_LEXICON'
+
+
+def add_final_punctuation(text: str) -> str:
+    if not ((text[-1] == '.') or (text[-1] == '?') or (text[-1] == '!')):
+        text = text + '.'
+    return text
+
+
+class TextFrontend:
+    '''
+    text to token tensor pipeline, built once and reused for every utterance.
+    owns the cleaner (and with it the espeak session and lexicon) and the tokenizer
+    '''
+
+    def __init__(self,
+                 cleaner_name: str = 'english_cleaners',
+                 lang: str = 'en-us',
+                 lexicon: Optional[Lexicon] = None) -> None:
+        self.cleaner = Cleaner(cleaner_name, True, lang, lexicon=lexicon)
+        self.tokenizer = Tokenizer()
+
+    @classmethod
+    def default(cls) -> 'TextFrontend':
+        ''' english frontend, words are looked up in the lexicon named by $GLADOS_LEXICON when set '''
+        lexicon_path = os.environ.get(LEXICON_VARIABLE)
+        return cls(lexicon=Lexicon(lexicon_path) if lexicon_path else None)
+
+    def phonemize(self, text: str) -> str:
+        return self.cleaner(add_final_punctuation(text))
+
+    def phonemize_batch(self, texts: List[str], njobs: int = 1) -> List[str]:
+        return self.cleaner.batch([add_final_punctuation(text) for text in texts], njobs)
+
+    def encode(self, phonemes: str) -> numpy.ndarray:
+        with metrics.stage('tokenize'):
+            return self.tokenizer.encode(phonemes)
+
+    def __call__(self, text: str) -> torch.Tensor:
+        '''
+        @param text: String, input text
+        @return: int32 tensor of shape (1, tokens), sharing memory with the id buffer
+        '''
+        return torch.from_numpy(self.encode(self.phonemize(text))).unsqueeze(0)
+
+    def batch(self, texts: List[str], njobs: int = 1) -> Tuple[torch.Tensor, torch.Tensor]:
+        '''
+        @param texts: list of input texts, phonemized in one espeak call
+        @return: int32 tensor (batch, longest) padded with the pad symbol and int64 lengths
+        '''
+        return self.pad([self.encode(p) for p in self.phonemize_batch(texts, njobs)])
+
+    @staticmethod
+    def pad(sequences: List[numpy.ndarray]) -> Tuple[torch.Tensor, torch.Tensor]:
+        lengths = numpy.fromiter((len(s) for s in sequences), dtype=numpy.int64, count=len(sequences))
+        # id 0 is the pad symbol
+        tokens = numpy.zeros((len(sequences), int(lengths.max(initial=0))), dtype=numpy.int32)
+        for row, sequence in enumerate(sequences):
+            tokens[row, :len(sequence)] = sequence
+        return torch.from_numpy(tokens), torch.from_numpy(lengths)
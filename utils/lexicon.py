@@ -0,0 +1,323 @@
+'''
+Word level pronunciation lexicon.
+
+The on-disk format is a plain UTF-8 file with one "word<TAB>phonemes" entry
+per line, sorted by the UTF-8 bytes of the word. It is memory-mapped and
+searched with a binary search, so loading is instant and pages are only
+read when they are touched. Words learned at runtime are kept in memory
+and merged into the file by save(), which a background thread calls every
+autosave_every new words and which runs at exit. save() merges with the
+file as it is on disk under a file lock, so processes sharing the file
+(forked workers) keep the words the others learned.
+
+Words whose espeak pronunciation depends on their neighbours ("the" before
+a vowel, weak forms of function words, heteronyms like "read") are listed in
+CONTEXT_WORDS. A text containing one of them is sent to espeak whole, in the
+same batched call as the unknown words, so it is phonemized exactly as
+without a lexicon. Every other text differs from whole-sentence espeak output
+in one documented way only: punctuation is copied from the cleaned text as
+written instead of being re-spaced by phonemizer; marks outside
+utils.symbols are dropped by the phoneme filter exactly as before.
+
+benchmarks/lexicon_corpus.txt is the regression corpus for check.
+'''
+
+import atexit
+import contextlib
+import logging
+import mmap
+import os
+import re
+import sys
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # without file locks concurrent saves of several processes may drop words
+    fcntl = None
+
+from utils.espeak import PUNCTUATION_MARKS, EspeakSession, get_session
+
+# splits cleaned text into words, punctuation and whitespace
+_token_re = re.compile(r'(\s+|[%s])' % re.escape(PUNCTUATION_MARKS))
+_marks = frozenset(PUNCTUATION_MARKS)
+
+logger = logging.getLogger(__name__)
+
+# lowercase words espeak pronounces differently depending on the words around them
+CONTEXT_WORDS = frozenset('''
+a an the to of for from and or but as at by in on with that than then
+am are is was were be been have has had do does can could shall should will would must
+me my he his him her she we us you your they them their there some any
+read lead live lives wind wound tear tears close use uses used bow row sow bass minute
+object present record project produce content contract conduct convert convict desert permit
+refuse subject increase decrease estimate separate moderate perfect excuse abuse house houses
+invalid polish resume reading leading
+'''.split())
+
+
+def word_key(word: str) -> str:
+    '''
+    lexicon key of a word, all-caps words keep their case since espeak may spell them
+    '''
+    if len(word) > 1 and word.isupper():
+        return word
+    return word.lower()
+
+
+class Lexicon:
+
+    def __init__(self, path: Optional[str] = None, autosave_every: int = 256) -> None:
+        self.path = path
+        self.autosave_every = autosave_every
+        self._added: Dict[str, str] = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        # one save at a time, lookups only wait for the lock while the new file is mapped
+        self._save_lock = threading.Lock()
+        self._save_due = threading.Event()
+        # pid of the process whose thread saves, forked workers start their own
+        self._saver_pid: Optional[int] = None
+        self._file = None
+        self._mmap: Optional[mmap.mmap] = None
+        if path is not None and os.path.exists(path):
+            self._map(path)
+        atexit.register(self._save_learned)
+
+    def _map(self, path: str) -> None:
+        self._file = open(path, 'rb')
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _unmap(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _lookup_mapped(self, key: bytes) -> Optional[str]:
+        mapped = self._mmap
+        if mapped is None:
+            return None
+        low, high = 0, len(mapped)
+        while low < high:
+            middle = (low + high) // 2
+            start = mapped.rfind(b'\n', 0, middle) + 1
+            end = mapped.find(b'\n', start)
+            if end == -1:
+                end = len(mapped)
+            tab = mapped.find(b'\t', start, end)
+            word = mapped[start:tab]
+            if word == key:
+                return mapped[tab + 1:end].decode('utf-8')
+            if word < key:
+                low = end + 1
+            else:
+                high = start
+        return None
+
+    def get(self, word: str) -> Optional[str]:
+        key = word_key(word)
+        with self._lock:
+            phonemes = self._added.get(key)
+            if phonemes is None:
+                phonemes = self._lookup_mapped(key.encode('utf-8'))
+        return phonemes
+
+    def __contains__(self, word: str) -> bool:
+        return self.get(word) is not None
+
+    def add(self, word: str, phonemes: str) -> None:
+        with self._lock:
+            self._added[word_key(word)] = phonemes.replace('\n', ' ').replace('\t', ' ')
+            self._unsaved += 1
+            if self.path is None or self._unsaved < self.autosave_every:
+                return
+            if self._saver_pid != os.getpid():
+                self._saver_pid = os.getpid()
+                threading.Thread(target=self._save_when_due, name="glados-lexicon-save", daemon=True).start()
+        self._save_due.set()
+
+    def items(self) -> Iterable:
+        merged = _read_entries(self._mmap[:] if self._mmap is not None else b'')
+        merged.update(self._added)
+        return merged.items()
+
+    def save(self, path: Optional[str] = None) -> None:
+        '''
+        merges learned words with the lexicon file on disk and maps the new file,
+        words another process saved to the file in the meantime are kept
+        '''
+        path = path or self.path
+        with self._save_lock:
+            with self._lock:
+                added = dict(self._added)
+                mapped = self._mmap[:] if self._mmap is not None and path == self.path else b''
+            entries = _read_entries(mapped)
+            with _locked(path):
+                try:
+                    with open(path, 'rb') as file:
+                        entries.update(_read_entries(file.read()))
+                except FileNotFoundError:
+                    pass
+                entries.update(added)
+                temporary_path = f"{path}.tmp{os.getpid()}"
+                with open(temporary_path, 'w', encoding='utf-8', newline='\n') as file:
+                    for word in sorted(entries, key=lambda word: word.encode('utf-8')):
+                        file.write(f"{word}\t{entries[word]}\n")
+                os.replace(temporary_path, path)
+            with self._lock:
+                self._unmap()
+                self.path = path
+                self._map(path)
+                # words learned while saving stay for the next save
+                for key, phonemes in added.items():
+                    if self._added.get(key) == phonemes:
+                        del self._added[key]
+                self._unsaved = len(self._added)
+
+    def _save_when_due(self) -> None:
+        while True:
+            self._save_due.wait()
+            self._save_due.clear()
+            try:
+                self.save()
+            except OSError as error:
+                logger.warning(f"Could not save the lexicon {self.path}: {error}")
+
+    def _save_learned(self) -> None:
+        if self.path is not None and self._added:
+            self.save()
+
+    def close(self) -> None:
+        self._unmap()
+
+    def __len__(self) -> int:
+        return len(dict(self.items()))
+
+    @classmethod
+    def build(cls, words: Iterable[str], path: str, session: EspeakSession, njobs: int = 1) -> 'Lexicon':
+        '''
+        pre-builds a lexicon file from a word list with a single espeak call
+        '''
+        lexicon = cls(path)
+        keys = sorted({word_key(word) for word in words if word.strip()} - {''})
+        keys = [key for key in keys if key not in lexicon]
+        for key, phonemes in zip(keys, session.phonemize_batch(keys, njobs)):
+            lexicon._added[key] = phonemes
+        lexicon.save(path)
+        return lexicon
+
+
+def _read_entries(content: bytes) -> Dict[str, str]:
+    entries = {}
+    for line in content.decode('utf-8').splitlines():
+        word, _, phonemes = line.partition('\t')
+        entries[word] = phonemes
+    return entries
+
+
+@contextlib.contextmanager
+def _locked(path: str) -> Iterator[None]:
+    ''' exclusive lock on path + ".lock" while the lexicon file is merged and replaced '''
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def phonemize_by_word(texts: List[str], lexicon: Lexicon, session: EspeakSession, njobs: int = 1) -> List[str]:
+    '''
+    phonemizes cleaned texts word by word, every out-of-vocabulary word of all
+    texts goes to espeak in one batched call and is added to the lexicon.
+    texts with a word of CONTEXT_WORDS go to espeak whole in the same call
+    '''
+    tokenized = [[token for token in _token_re.split(text) if token] for text in texts]
+    whole = [any(token.lower() in CONTEXT_WORDS for token in tokens) for tokens in tokenized]
+    known: Dict[str, str] = {}
+    missing: List[str] = []
+    for tokens, in_context in zip(tokenized, whole):
+        if in_context:
+            continue
+        for token in tokens:
+            if token.isspace() or token in _marks:
+                continue
+            key = word_key(token)
+            if key in known:
+                continue
+            phonemes = lexicon.get(key)
+            if phonemes is None:
+                if key not in missing:
+                    missing.append(key)
+            else:
+                known[key] = phonemes
+    sentences = [text for text, in_context in zip(texts, whole) if in_context]
+    phonemized = session.phonemize_batch(missing + sentences, njobs) if missing or sentences else []
+    for key, phonemes in zip(missing, phonemized):
+        known[key] = phonemes
+        lexicon.add(key, phonemes)
+    by_sentence = iter(phonemized[len(missing):])
+    output = []
+    for tokens, in_context in zip(tokenized, whole):
+        if in_context:
+            output.append(next(by_sentence))
+            continue
+        parts = []
+        for token in tokens:
+            if token.isspace():
+                parts.append(' ')
+            elif token in _marks:
+                parts.append(token)
+            else:
+                parts.append(known[word_key(token)])
+        output.append(''.join(parts).strip())
+    return output
+
+
+def main() -> None:
+    '''
+    python -m utils.lexicon build <wordlist> <lexicon>
+        pre-builds a lexicon file from a list of words (one or more per line)
+    python -m utils.lexicon check <corpus> [<lexicon>]
+        compares word level against sentence level phonemes for every corpus line,
+        benchmarks/lexicon_corpus.txt is the shipped regression corpus
+    '''
+    from utils.cleaners import Cleaner
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ('build', 'check'):
+        print(main.__doc__)
+        sys.exit(1)
+    session = get_session('en-us')
+    with open(sys.argv[2], encoding='utf-8') as file:
+        lines = [line.strip() for line in file if line.strip()]
+    if sys.argv[1] == 'build':
+        cleaner = Cleaner('english_cleaners', False, 'en-us')
+        words = [token for line in lines for token in _token_re.split(cleaner(line))
+                 if token and not token.isspace() and token not in PUNCTUATION_MARKS]
+        lexicon = Lexicon.build(words, sys.argv[3], session)
+        print(f"Lexicon {sys.argv[3]} holds {len(lexicon)} words")
+        return
+    lexicon = Lexicon(sys.argv[3] if len(sys.argv) > 3 else None)
+    by_sentence = Cleaner('english_cleaners', True, 'en-us')
+    by_word = Cleaner('english_cleaners', True, 'en-us', lexicon=lexicon)
+    mismatches = 0
+    for line in lines:
+        expected, obtained = by_sentence(line), by_word(line)
+        if expected != obtained:
+            mismatches += 1
+            print(f"{line}\n  sentence: {expected}\n  word:     {obtained}")
+    print(f"{mismatches} of {len(lines)} lines differ")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+'''
+Logging off the request path: records go through a bounded queue to a
+listener thread that writes the log file, records of the per-request
+logger are sampled.
+
+    GLADOS_LOG_SAMPLE=0.1   keeps one in ten per-request records, warnings always pass
+'''
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from typing import Optional
+
+REQUEST_LOGGER = 'glados.requests'
+SAMPLE_VARIABLE = 'GLADOS_LOG_SAMPLE'
+LOG_FORMAT = '[%(asctime)s.%(msecs)03d] [%(levelname)s]\t%(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class SamplingFilter(logging.Filter):
+    ''' passes warnings and errors, and the given fraction of everything else '''
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    ''' never blocks the caller, records are dropped while the queue is full '''
+
+    dropped: int = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(filename: str, level: int = logging.DEBUG, sample_rate: Optional[float] = None,
+                  max_queue: int = 10000) -> None:
+    '''
+    routes the root logger through a queue to filename, the first call wins
+    like with logging.basicConfig
+    @param sample_rate: fraction of per-request records kept, defaults to $GLADOS_LOG_SAMPLE or 1
+    '''
+    global _handler, _listener
+    if _handler is not None:
+        return
+    _handler = DroppingQueueHandler(queue.Queue(max_queue))
+    _listener = logging.handlers.QueueListener(_handler.queue, _file_handler(filename))
+    _listener.start()
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(level)
+    if sample_rate is None:
+        sample_rate = float(os.environ.get(SAMPLE_VARIABLE, 1.0))
+    logging.getLogger(REQUEST_LOGGER).addFilter(SamplingFilter(sample_rate))
+    atexit.register(_stop)
+    # the listener thread does not survive a fork, children start their own
+    os.register_at_fork(after_in_child=_restart)
+
+
+def add_log_file(filename: str) -> None:
+    '''
+    writes every record to filename as well, e.g. the log of an engine next to
+    the one of glados. logging.basicConfig does nothing once setup_logging ran
+    '''
+    if _handler is None:
+        setup_logging(filename)
+        return
+    _listener.handlers = _listener.handlers + (_file_handler(filename),)
+
+
+def _file_handler(filename: str) -> logging.FileHandler:
+    file_handler = logging.FileHandler(filename)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+    return file_handler
+
+
+def _stop() -> None:
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def _restart() -> None:
+    global _listener
+    _handler.queue = queue.Queue(_handler.queue.maxsize)
+    _listener = logging.handlers.QueueListener(_handler.queue, *_listener.handlers)
+    _listener.start()
+
+
+def request_log(message: str) -> None:
+    ''' per-request messages, sampled and never printed '''
+    logging.getLogger(REQUEST_LOGGER).info(message)
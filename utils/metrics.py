@@ -0,0 +1,161 @@
+'''
+Process wide histograms of the synthesis pipeline in the Prometheus text
+format: seconds per stage (normalize, phonemize, tokenize, acoustic,
+vocoder, postprocess, encode, cache_io), the size of every utterance
+in tokens, mel frames and audio seconds with its real time factor, and
+counters of synthesized and coalesced requests. Other modules register
+their own counters and gauges with REGISTRY.
+
+    with metrics.stage('vocoder'):
+        audio = vocoder(mel)
+
+every process keeps its own numbers, forked workers report their own
+'''
+
+import bisect
+import contextlib
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    '''
+    cumulative histogram with an optional single label, observations of
+    every label value are kept apart
+    '''
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], label: Optional[str] = None) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.label = label
+        # label value -> (count per bucket plus +Inf, sum)
+        self._series: Dict[Optional[str], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, label_value: Optional[str] = None) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {label_value: (list(counts), total[0]) for label_value, (counts, total) in self._series.items()}
+        for label_value, (counts, total) in sorted(series.items(), key=lambda item: item[0] or ''):
+            labels = f'{self.label}="{label_value}",' if self.label and label_value is not None else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels.rstrip(',')}}}" if labels else ''
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter",
+                f"{self.name} {self.value}"]
+
+
+class Gauge:
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.value}"]
+
+
+class Registry:
+
+    def __init__(self) -> None:
+        self.collectors: List[Union[Histogram, Counter, Gauge]] = []
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float], label: Optional[str] = None) -> Histogram:
+        histogram = Histogram(name, documentation, buckets, label)
+        self.collectors.append(histogram)
+        return histogram
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        counter = Counter(name, documentation)
+        self.collectors.append(counter)
+        return counter
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        gauge = Gauge(name, documentation)
+        self.collectors.append(gauge)
+        return gauge
+
+    def render(self) -> str:
+        return '\n'.join(line for collector in self.collectors for line in collector.render()) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram('glados_stage_seconds', 'Seconds spent in each synthesis stage',
+                                   STAGE_BUCKETS, 'stage')
+TOKENS = REGISTRY.histogram('glados_utterance_tokens', 'Phoneme tokens per utterance',
+                            (8, 16, 32, 64, 128, 256, 512, 1024))
+MEL_FRAMES = REGISTRY.histogram('glados_utterance_mel_frames', 'Mel frames per utterance',
+                                (25, 50, 100, 200, 400, 800, 1600, 3200))
+AUDIO_SECONDS = REGISTRY.histogram('glados_utterance_audio_seconds', 'Seconds of audio per utterance',
+                                   (0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0))
+REAL_TIME_FACTOR = REGISTRY.histogram('glados_real_time_factor',
+                                      'Synthesis seconds per second of audio, per model call',
+                                      (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0))
+SYNTHESES = REGISTRY.counter('glados_syntheses_total', 'Cache misses synthesized by this process')
+COALESCED_REQUESTS = REGISTRY.counter('glados_coalesced_requests_total',
+                                      'Requests answered by an identical synthesis already in flight')
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, name)
+
+
+def observe_utterance(tokens: int, mel_frames: int, audio_seconds: float) -> None:
+    TOKENS.observe(tokens)
+    MEL_FRAMES.observe(mel_frames)
+    AUDIO_SECONDS.observe(audio_seconds)
+
+
+def observe_real_time_factor(seconds: float, audio_seconds: float) -> None:
+    if audio_seconds > 0:
+        REAL_TIME_FACTOR.observe(seconds / audio_seconds)
+
+
+def render() -> str:
+    return REGISTRY.render()
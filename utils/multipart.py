@@ -0,0 +1,202 @@
+'''
+Framing of /synthesize/batch responses: the audio of every item follows
+the previous one in a multipart/mixed body or a zip archive, so the items
+can be sent as soon as each is synthesized. Also reads multipart bodies
+incrementally for the client in glados_client.
+
+    --<boundary>
+    Content-Type: audio/wav
+    Content-Disposition: attachment; filename="000.wav"
+    X-Item-Index: 0
+
+    <audio>
+    --<boundary>
+    Content-Type: text/plain; charset=utf-8
+    X-Item-Index: 1
+    X-Item-Status: 413
+
+    <error message>
+    --<boundary>--
+
+Only the standard library is used, the client does not need torch.
+'''
+
+import json
+import uuid
+import zipfile
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+CONTAINERS = ('multipart', 'zip')
+# items of one batch request
+MAX_ITEMS = 64
+
+
+class BatchItem(NamedTuple):
+    index: int
+    content_type: str
+    data: bytes
+    # http status of a failed item, None when data holds its audio
+    status: Optional[int] = None
+    # name the server gave the audio, e.g. 003.flac
+    filename: Optional[str] = None
+
+    @property
+    def error(self) -> Optional[str]:
+        return self.data.decode('utf-8', 'replace') if self.status is not None else None
+
+
+def parse_request(body: bytes) -> List[dict]:
+    '''
+    @param body: json list of texts, or of objects with "text" and optional "format" and "rate"
+    @return: list of {"text", "format", "rate"} in request order, missing options are None
+    raises ValueError for anything else and for more than MAX_ITEMS items
+    '''
+    try:
+        items = json.loads(body)
+    except ValueError:
+        raise ValueError("the body has to be a json list of texts")
+    if not isinstance(items, list) or not items:
+        raise ValueError("the body has to be a non-empty json list of texts")
+    if len(items) > MAX_ITEMS:
+        raise ValueError(f"at most {MAX_ITEMS} items per batch, got {len(items)}")
+    parsed = []
+    for item in items:
+        if isinstance(item, str):
+            item = {'text': item}
+        if not isinstance(item, dict) or not isinstance(item.get('text'), str) or not item['text']:
+            raise ValueError(f"invalid item: {item!r}")
+        rate = item.get('rate')
+        parsed.append({'text': item['text'], 'format': item.get('format'),
+                       'rate': str(rate) if rate is not None else None})
+    return parsed
+
+
+def container_of(container: Optional[str] = None, accept: Optional[str] = None) -> str:
+    ''' the container asked for with ?container=, otherwise zip when the Accept header prefers it '''
+    if container:
+        return container
+    if accept and 'application/zip' in accept and 'multipart/' not in accept:
+        return 'zip'
+    return 'multipart'
+
+
+class _Chunks:
+    ''' write-only file collecting what zipfile writes, without seek or tell zipfile streams '''
+
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+class BatchEncoder:
+    '''
+    turns the items of a batch into the bytes of the response body,
+    call item or error once per item in order, then close
+    '''
+
+    def __init__(self, container: str = 'multipart') -> None:
+        if container not in CONTAINERS:
+            raise ValueError(f"Unsupported container: {container}, supported: {', '.join(CONTAINERS)}")
+        self.container = container
+        self.boundary = uuid.uuid4().hex
+        self._chunks = _Chunks()
+        # audio hardly compresses, stored entries keep the archive cheap to write
+        self._zip = zipfile.ZipFile(self._chunks, 'w', zipfile.ZIP_STORED) if container == 'zip' else None
+
+    @property
+    def content_type(self) -> str:
+        if self._zip is not None:
+            return 'application/zip'
+        return f"multipart/mixed; boundary={self.boundary}"
+
+    def item(self, index: int, data: bytes, content_type: str, extension: str) -> bytes:
+        name = f"{index:03d}.{extension}"
+        if self._zip is not None:
+            self._zip.writestr(name, data)
+            return self._chunks.take()
+        return self._part({'Content-Type': content_type,
+                           'Content-Disposition': f'attachment; filename="{name}"',
+                           'X-Item-Index': str(index)}, data)
+
+    def error(self, index: int, status: int, message: str) -> bytes:
+        data = message.encode('utf-8')
+        if self._zip is not None:
+            self._zip.writestr(f"{index:03d}.error-{status}.txt", data)
+            return self._chunks.take()
+        return self._part({'Content-Type': 'text/plain; charset=utf-8',
+                           'X-Item-Index': str(index), 'X-Item-Status': str(status)}, data)
+
+    def close(self) -> bytes:
+        if self._zip is not None:
+            self._zip.close()
+            return self._chunks.take()
+        return f"--{self.boundary}--\r\n".encode('ascii')
+
+    def _part(self, headers: Dict[str, str], data: bytes) -> bytes:
+        head = ''.join(f"{name}: {value}\r\n" for name, value in headers.items())
+        return f"--{self.boundary}\r\n{head}\r\n".encode('utf-8') + data + b'\r\n'
+
+
+def boundary_of(content_type: str) -> str:
+    for parameter in content_type.split(';')[1:]:
+        name, _, value = parameter.strip().partition('=')
+        if name.lower() == 'boundary':
+            return value.strip('"')
+    raise ValueError(f"no boundary in {content_type!r}")
+
+
+class MultipartReader:
+    '''
+    incremental reader of a multipart/mixed body, feed the received chunks
+    and take every part as soon as it is complete
+    '''
+
+    def __init__(self, content_type: str) -> None:
+        self.delimiter = f"--{boundary_of(content_type)}".encode('ascii')
+        self.buffer = b''
+        self.finished = False
+
+    def feed(self, chunk: bytes) -> Iterator[BatchItem]:
+        self.buffer += chunk
+        while not self.finished:
+            start = self.buffer.find(self.delimiter)
+            if start < 0:
+                return
+            after = start + len(self.delimiter)
+            if self.buffer[after:after + 2] == b'--':
+                self.finished = True
+                return
+            # the part ends with CRLF before the next delimiter
+            end = self.buffer.find(b'\r\n' + self.delimiter, after)
+            if end < 0:
+                return
+            yield self._parse(self.buffer[after:end])
+            self.buffer = self.buffer[end + 2:]
+
+    @staticmethod
+    def _parse(part: bytes) -> BatchItem:
+        head, _, data = part.lstrip(b'\r\n').partition(b'\r\n\r\n')
+        headers = {}
+        for line in head.decode('utf-8').split('\r\n'):
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        status = headers.get('x-item-status')
+        _, _, filename = headers.get('content-disposition', '').partition('filename=')
+        return BatchItem(int(headers['x-item-index']), headers.get('content-type', ''), data,
+                         int(status) if status else None, filename.strip('"') or None)
+
+
+def read_multipart(content_type: str, chunks: Iterator[bytes]) -> Iterator[BatchItem]:
+    reader = MultipartReader(content_type)
+    for chunk in chunks:
+        yield from reader.feed(chunk)
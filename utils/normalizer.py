@@ -0,0 +1,151 @@
+'''
+Single pass, table driven text normalizer used by english_cleaners.
+
+Units and abbreviations are merged into one alternation regex and replaced
+through dict lookups, then the text is transliterated with unidecode and
+numbers are expanded with memoized inflect calls.
+
+Additional tables can be loaded from JSON lexicon files without touching
+the code, either passed to Normalizer or listed (os.pathsep separated) in
+the GLADOS_NORMALIZER_LEXICONS environment variable:
+
+    {"units": {"km/h": "kilometers per hour"},
+     "abbreviations": {"approx": "approximately"}}
+
+Units are replaced case sensitively wherever they occur, abbreviations
+match case insensitively at the start of a word and must be followed by
+a period, like the tables below. Abbreviations written without a space in
+between ("mr.co.") behave as in the chained passes, which replace one table
+entry after the other: an abbreviation directly after the expansion of an
+earlier table entry no longer starts a word and is kept ("misterco."),
+directly after a later one it is still expanded ("co.mr." becomes
+"companymister").
+
+The output equals the chained english_cleaners passes, except that
+abbreviations are expanded before unidecode and number expansion, so
+abbreviations only spelled out after transliteration and an abbreviation
+directly followed by a euro amount (e.g. "co.5 EUR") are handled
+differently.
+'''
+
+import json
+import os
+import re
+from typing import Dict, Iterable, Optional
+
+from unidecode import unidecode
+
+from utils.numbers import normalize_numbers
+
+LEXICONS_VARIABLE = 'GLADOS_NORMALIZER_LEXICONS'
+
+# replaced wherever they occur, in this order of precedence
+UNITS: Dict[str, str] = {
+    '°C': 'degrees selsius',
+    '°F': 'degrees fahrenheit',
+    '°c': 'degrees selsius',
+    '°f': 'degrees fahrenheit',
+    '°': 'degrees',
+    'hPa': 'hecto pascals',
+    'g/m³': 'grams per cubic meter',
+    '% (RH)': 'percent relative humidity',
+}
+
+# replaced when written as "<abbreviation>." at the start of a word
+ABBREVIATIONS: Dict[str, str] = {
+    'mrs': 'misess',
+    'mr': 'mister',
+    'dr': 'doctor',
+    'st': 'saint',
+    'co': 'company',
+    'jr': 'junior',
+    'maj': 'major',
+    'gen': 'general',
+    'drs': 'doctors',
+    'rev': 'reverend',
+    'lt': 'lieutenant',
+    'hon': 'honorable',
+    'sgt': 'sergeant',
+    'capt': 'captain',
+    'esq': 'esquire',
+    'ltd': 'limited',
+    'col': 'colonel',
+    'ft': 'fort',
+}
+
+_word_char_re = re.compile(r'\w')
+
+
+class Normalizer:
+
+    def __init__(self,
+                 units: Optional[Dict[str, str]] = None,
+                 abbreviations: Optional[Dict[str, str]] = None,
+                 lexicons: Iterable[str] = ()) -> None:
+        self.units = dict(UNITS if units is None else units)
+        self.abbreviations = {k.lower(): v for k, v in (ABBREVIATIONS if abbreviations is None else abbreviations).items()}
+        for path in lexicons:
+            self.load_lexicon(path, compile=False)
+        self._compile()
+
+    def load_lexicon(self, path: str, compile: bool = True) -> None:
+        '''
+        @param path: String, path to a JSON file with "units" and/or "abbreviations" tables
+        adds the tables of the file, entries of the file take precedence
+        '''
+        with open(path, encoding='utf-8') as file:
+            lexicon = json.load(file)
+        self.units.update(lexicon.get('units', {}))
+        self.abbreviations.update({k.lower(): v for k, v in lexicon.get('abbreviations', {}).items()})
+        if compile:
+            self._compile()
+
+    def _compile(self) -> None:
+        # longest keys first so that e.g. "°C" wins over "°" and "mrs" over "mr"
+        units = sorted(self.units, key=len, reverse=True)
+        abbreviations = sorted(self.abbreviations, key=len, reverse=True)
+        alternatives = []
+        if units:
+            alternatives.append('(?P<unit>%s)' % '|'.join(re.escape(u) for u in units))
+        if abbreviations:
+            alternatives.append(r'(?<!\w)(?P<abbreviation>(?i:%s))\.' % '|'.join(re.escape(a) for a in abbreviations))
+        self._table_re = re.compile('|'.join(alternatives)) if alternatives else None
+        # a replacement ending in a letter glues onto a following abbreviation
+        self._unit_ends_in_word = {u: bool(_word_char_re.match(r[-1:])) for u, r in self.units.items()}
+        self._abbreviation_ends_in_word = {a: bool(_word_char_re.match(r[-1:])) for a, r in self.abbreviations.items()}
+        # position of every abbreviation in the chained passes, units run before all of them
+        self._abbreviation_order = {a: position for position, a in enumerate(self.abbreviations)}
+
+    def expand_tables(self, text: str) -> str:
+        if self._table_re is None:
+            return text
+        # end and chained pass position of the previous replacement that glues onto what follows
+        glued = [-1, -1]
+
+        def replace(match: re.Match) -> str:
+            unit = match.group('unit') if self.units else None
+            if unit is not None:
+                glued[:] = [match.end() if self._unit_ends_in_word[unit] else -1, -1]
+                return self.units[unit]
+            abbreviation = match.group('abbreviation').lower()
+            order = self._abbreviation_order[abbreviation]
+            if match.start() == glued[0] and glued[1] < order:
+                # the chained pass of this abbreviation found it glued to an expansion
+                glued[0] = -1
+                return match.group(0)
+            glued[:] = [match.end() if self._abbreviation_ends_in_word[abbreviation] else -1, order]
+            return self.abbreviations[abbreviation]
+
+        return self._table_re.sub(replace, text)
+
+    def __call__(self, text: str) -> str:
+        text = self.expand_tables(text)
+        if not text.isascii():
+            text = unidecode(text)
+        text = normalize_numbers(text)
+        return text
+
+    @classmethod
+    def from_environment(cls) -> 'Normalizer':
+        paths = os.environ.get(LEXICONS_VARIABLE, '')
+        return cls(lexicons=[path for path in paths.split(os.pathsep) if path])
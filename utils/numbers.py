@@ -1,10 +1,9 @@
 """ from https://github.com/keithito/tacotron """
 
-import inflect
+import functools
 import re
 
 
-_inflect = inflect.engine()
 _comma_number_re = re.compile(r'([0-9][0-9\,]+[0-9])')
 _decimal_number_re = re.compile(r'([0-9]+\.[0-9]+)')
 _pounds_re = re.compile(r'£([0-9\,]*[0-9]+)')
@@ -12,6 +11,14 @@ _dollars_re = re.compile(r'\$([0-9\.\,]*[0-9]+)')
 _euros_re = re.compile(r'([0-9\.\,]*[0-9]+)(\s?EUR)')
 _ordinal_re = re.compile(r'[0-9]+(st|nd|rd|th)')
 _number_re = re.compile(r'[0-9]+')
+_digit_re = re.compile(r'[0-9]')
+
+
+@functools.lru_cache(maxsize=None)
+def _inflect():
+  # importing inflect is slow, only texts containing numbers need it
+  import inflect
+  return inflect.engine()
 
 
 def _remove_commas(m):
@@ -46,8 +53,8 @@ def _expand_dollars(m):
 def _expand_euros(m):
   match = m.group(1)
   parts = match.split('.')
-  if len(parts) > 2:
-    return match + ' euros'  # Unexpected format
+  if len(parts) > 2 or not all(part.isdigit() for part in parts if part):
+    return match + ' euros'  # Unexpected format, e.g. ",3.5" after an abbreviation
   euros = int(parts[0]) if parts[0] else 0
   cents = int(parts[1]) if len(parts) > 1 and parts[1] else 0
   if euros and cents:
@@ -63,30 +70,45 @@ def _expand_euros(m):
   else:
     return 'zero euros'
 
+@functools.lru_cache(maxsize=4096)
+def _ordinal_words(ordinal):
+  return _inflect().number_to_words(ordinal)
+
+
 def _expand_ordinal(m):
-  return _inflect.number_to_words(m.group(0))
+  return _ordinal_words(m.group(0))
 
 
-def _expand_number(m):
-  num = int(m.group(0))
+@functools.lru_cache(maxsize=4096)
+def _number_words(num):
   if num > 1000 and num < 3000:
     if num == 2000:
       return 'two thousand'
     elif num > 2000 and num < 2010:
-      return 'two thousand ' + _inflect.number_to_words(num % 100)
+      return 'two thousand ' + _inflect().number_to_words(num % 100)
     elif num % 100 == 0:
-      return _inflect.number_to_words(num // 100) + ' hundred'
+      return _inflect().number_to_words(num // 100) + ' hundred'
     else:
-      return _inflect.number_to_words(num, andword='', zero='oh', group=2).replace(', ', ' ')
+      return _inflect().number_to_words(num, andword='', zero='oh', group=2).replace(', ', ' ')
   else:
-    return _inflect.number_to_words(num, andword='')
+    return _inflect().number_to_words(num, andword='')
+
+
+def _expand_number(m):
+  return _number_words(int(m.group(0)))
 
 
 def normalize_numbers(text):
+  # every pattern needs a digit, most sentences have none
+  if not _digit_re.search(text):
+    return text
   text = re.sub(_comma_number_re, _remove_commas, text)
-  text = re.sub(_pounds_re, r'\1 pounds', text)
-  text = re.sub(_dollars_re, _expand_dollars, text)
-  text = re.sub(_euros_re, _expand_euros, text)
+  if '£' in text:
+    text = re.sub(_pounds_re, r'\1 pounds', text)
+  if '$' in text:
+    text = re.sub(_dollars_re, _expand_dollars, text)
+  if 'EUR' in text:
+    text = re.sub(_euros_re, _expand_euros, text)
   text = re.sub(_decimal_number_re, _expand_decimal_point, text)
   text = re.sub(_ordinal_re, _expand_ordinal, text)
   text = re.sub(_number_re, _expand_number, text)
@@ -0,0 +1,191 @@
+'''
+Local playback through one long-lived player process that reads raw 16 bit
+mono PCM from its stdin. Clips are queued by priority and written to the
+pipe back to back by a feeder thread, so consecutive clips play without
+gaps and without starting a process or touching a file per clip.
+
+    GLADOS_PLAYER="ffplay -nodisp -loglevel quiet -f s16le -ar {rate} -ac 1 -"   replaces aplay
+'''
+
+import heapq
+import itertools
+import logging
+import os
+import shlex
+import subprocess
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from utils import metrics
+from utils.wav import SAMPLE_RATE
+
+PLAYER_VARIABLE = 'GLADOS_PLAYER'
+# a short device buffer keeps interruptions quick, pipe writes block while it is full
+DEFAULT_PLAYER = 'aplay -q -t raw -f S16_LE -c 1 -r {rate} --buffer-time=200000 -'
+# bytes written to the player at a time, a clip can be interrupted between two writes
+CHUNK_BYTES = 4096
+
+QUEUED_CLIPS = metrics.REGISTRY.gauge('glados_playback_queued_clips', 'Clips waiting for local playback')
+
+logger = logging.getLogger(__name__)
+
+
+class Clip:
+
+    def __init__(self, pcm: bytes, priority: int = 0, label: str = '') -> None:
+        self.pcm = memoryview(pcm).cast('B')
+        self.priority = priority
+        self.label = label
+
+    @property
+    def seconds(self) -> float:
+        return len(self.pcm) / 2 / SAMPLE_RATE
+
+
+class Player:
+    '''
+    plays queued clips in order of priority, clips of the same priority in
+    the order they were queued. a clip queued with interrupt=True cuts off
+    the clip that is playing, flush=True additionally restarts the player
+    to drop what is still buffered in the audio device
+    '''
+
+    def __init__(self, command: Optional[str] = None, rate: int = SAMPLE_RATE) -> None:
+        self.command = shlex.split((command or os.environ.get(PLAYER_VARIABLE) or DEFAULT_PLAYER).format(rate=rate))
+        self.played = 0
+        self.interrupted = 0
+        self.failed = 0
+        self.current: Optional[Clip] = None
+        # (-priority, sequence, clip)
+        self._queue: List[Tuple[int, int, Clip]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._interrupt = False
+        self._process: Optional[subprocess.Popen] = None
+        self._worker: Optional[threading.Thread] = None
+        self._running = False
+
+    def enqueue(self, pcm: bytes, priority: int = 0, interrupt: bool = False, flush: bool = False,
+                label: str = '') -> int:
+        '''
+        @param pcm: 16 bit mono samples at the player rate
+        @param priority: higher priorities play first
+        @param interrupt: stops the clip that is playing, this one follows unless a higher priority is queued
+        @param flush: with interrupt, also drops the audio the device still buffers
+        @return: clips queued ahead of this one, never blocks
+        '''
+        clip = Clip(pcm, priority, label)
+        with self._condition:
+            self._start()
+            ahead = sum(1 for queued in self._queue if queued[0] <= -priority)
+            heapq.heappush(self._queue, (-priority, next(self._sequence), clip))
+            QUEUED_CLIPS.set(len(self._queue))
+            if interrupt and self.current is not None:
+                self._interrupt = True
+                if flush:
+                    self._stop_process()
+                ahead = sum(1 for queued in self._queue if queued[0] < -priority)
+            self._condition.notify()
+        return ahead
+
+    def clear(self, interrupt: bool = True) -> int:
+        ''' drops every queued clip and by default the one that is playing, returns the number dropped '''
+        with self._condition:
+            dropped = len(self._queue)
+            self._queue.clear()
+            QUEUED_CLIPS.set(0)
+            if interrupt and self.current is not None:
+                self._interrupt = True
+                self._stop_process()
+        return dropped
+
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> Dict[str, object]:
+        with self._condition:
+            queued_seconds = sum(clip.seconds for _, _, clip in self._queue)
+            current = self.current
+        return {
+            'depth': len(self._queue),
+            'queued_seconds': round(queued_seconds, 3),
+            'playing': current.label if current is not None else None,
+            'played': self.played,
+            'interrupted': self.interrupted,
+            'failed': self.failed,
+        }
+
+    def stop(self) -> None:
+        ''' cuts off the clip that is playing and ends the player, queued clips are dropped '''
+        with self._condition:
+            self._running = False
+            self._interrupt = True
+            self._stop_process()
+            self._condition.notify()
+        if self._worker is not None:
+            self._worker.join()
+
+    def _start(self) -> None:
+        # the feeder thread and player process start with the first clip
+        if self._running:
+            return
+        self._running = True
+        self._worker = threading.Thread(target=self._run, name="glados-playback", daemon=True)
+        self._worker.start()
+
+    def _pipe(self):
+        # spawned under the same lock the teardown holds, so an interruption either
+        # kills this process or happens before it, and a stopped player spawns none
+        with self._condition:
+            if not self._running:
+                raise ValueError("player stopped")
+            if self._process is None or self._process.poll() is not None:
+                # unbuffered, every write reaches the player right away
+                self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, bufsize=0,
+                                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            return self._process.stdin
+
+    def _stop_process(self) -> None:
+        # callers hold self._condition
+        process, self._process = self._process, None
+        if process is not None:
+            process.kill()
+            process.wait()
+
+    def _next(self) -> Optional[Clip]:
+        with self._condition:
+            while self._running and not self._queue:
+                self._condition.wait()
+            if not self._running:
+                return None
+            _, _, self.current = heapq.heappop(self._queue)
+            self._interrupt = False
+            QUEUED_CLIPS.set(len(self._queue))
+            return self.current
+
+    def _play(self, clip: Clip) -> None:
+        pipe = self._pipe()
+        for start in range(0, len(clip.pcm), CHUNK_BYTES):
+            if self._interrupt:
+                self.interrupted += 1
+                return
+            pipe.write(clip.pcm[start:start + CHUNK_BYTES])
+        self.played += 1
+
+    def _run(self) -> None:
+        while True:
+            clip = self._next()
+            if clip is None:
+                return
+            try:
+                self._play(clip)
+            except (OSError, ValueError) as error:
+                # the player was restarted by an interruption or died, the next clip starts a new one
+                if not self._interrupt:
+                    self.failed += 1
+                    logger.warning(f"Playback of {clip.label or 'clip'} failed: {error}")
+                else:
+                    self.interrupted += 1
+            finally:
+                with self._condition:
+                    self.current = None
@@ -0,0 +1,122 @@
+'''
+Post-processing of the vocoder output on the vocoder's device: optional peak
+or loudness (RMS) normalization, clipping to full scale, trimming of leading
+and trailing silence and short fades at both ends. A batch is padded into one
+tensor and processed by the same few operations. The only values that reach
+the host before the samples are the trim bounds, so trimmed silence is never
+copied off the device or sent to clients.
+
+    python3 engine.py --normalize peak --target-db -1 --trim-db -45 --fade-ms 5
+
+Trimming compares the peak of every 10 ms frame with the peak of the whole
+utterance, it keeps --trim-padding-ms around the first and last loud frame.
+'''
+
+import argparse
+from typing import List, NamedTuple, Optional
+
+import torch
+
+from utils.wav import SAMPLE_RATE
+
+NORMALIZATIONS = ('peak', 'rms')
+# frames whose silence is detected at once
+FRAME_SECONDS = 0.01
+# the quietest peak or rms normalization still amplifies, quieter output is left alone
+MIN_LEVEL = 1e-4
+
+
+def db_to_gain(db: float) -> float:
+    return 10.0 ** (db / 20.0)
+
+
+class PostProcess(NamedTuple):
+    # None, 'peak' or 'rms'; target_db is the peak or rms level in dBFS
+    normalize: Optional[str] = None
+    target_db: float = -1.0
+    # frames this far below the utterance peak count as silence, None keeps the silence
+    trim_db: Optional[float] = -45.0
+    trim_padding: float = 0.04
+    fade: float = 0.005
+
+    @property
+    def variant(self) -> str:
+        ''' part of the audio cache version, settings that change the samples change it '''
+        return f"n{self.normalize or '-'}{self.target_db:g}t{self.trim_db}p{self.trim_padding:g}f{self.fade:g}"
+
+
+DEFAULT_POSTPROCESS = PostProcess()
+
+
+def process_batch(waveforms: List[torch.Tensor], settings: PostProcess = DEFAULT_POSTPROCESS,
+                  sample_rate: int = SAMPLE_RATE) -> List[torch.Tensor]:
+    '''
+    @param waveforms: float tensors, vocoder output of one utterance each on the same device
+    @return: processed float tensors in -1..1 on that device, views into one padded batch
+    '''
+    if not waveforms:
+        return []
+    waveforms = [waveform.reshape(-1) for waveform in waveforms]
+    audio = torch.nn.utils.rnn.pad_sequence(waveforms, batch_first=True)
+    lengths = torch.tensor([waveform.shape[0] for waveform in waveforms], device=audio.device)
+    positions = torch.arange(audio.shape[1], device=audio.device)
+    # padding is zero, so it changes neither peaks nor sums
+    peak = audio.abs().amax(dim=1)
+
+    if settings.normalize is not None:
+        target = db_to_gain(settings.target_db)
+        if settings.normalize == 'rms':
+            rms = (audio.square().sum(dim=1) / lengths.clamp(min=1)).sqrt()
+            # loudness normalization must not push the peak into clipping
+            gain = torch.minimum(target / rms.clamp(min=MIN_LEVEL), 1.0 / peak.clamp(min=MIN_LEVEL))
+        else:
+            gain = target / peak.clamp(min=MIN_LEVEL)
+        audio = audio * gain.unsqueeze(1)
+        peak = peak * gain
+    audio = audio.clamp(-1.0, 1.0)
+
+    start = torch.zeros_like(lengths)
+    end = lengths
+    if settings.trim_db is not None and audio.shape[1] > 0:
+        frame = max(1, int(sample_rate * FRAME_SECONDS))
+        levels = torch.nn.functional.max_pool1d(audio.abs().unsqueeze(1), frame, frame, ceil_mode=True).squeeze(1)
+        loud = levels > (peak.clamp(max=1.0) * db_to_gain(settings.trim_db)).unsqueeze(1)
+        frames = loud.shape[1]
+        first = loud.to(torch.uint8).argmax(dim=1)
+        last = frames - 1 - loud.flip(1).to(torch.uint8).argmax(dim=1)
+        padding = int(sample_rate * settings.trim_padding)
+        # silent utterances keep their length
+        has_sound = loud.any(dim=1)
+        start = torch.where(has_sound, (first * frame - padding).clamp(min=0), start)
+        end = torch.where(has_sound, torch.minimum((last + 1) * frame + padding, lengths), end)
+
+    fade = int(sample_rate * settings.fade)
+    if fade > 0:
+        rising = (positions.unsqueeze(0) - start.unsqueeze(1) + 1) / fade
+        falling = (end.unsqueeze(1) - positions.unsqueeze(0)) / fade
+        audio = audio * torch.minimum(rising, falling).clamp(0.0, 1.0).to(audio.dtype)
+
+    bounds = torch.stack((start, end), dim=1).tolist()
+    return [audio[row, row_start:row_end] for row, (row_start, row_end) in enumerate(bounds)]
+
+
+def process(waveform: torch.Tensor, settings: PostProcess = DEFAULT_POSTPROCESS,
+            sample_rate: int = SAMPLE_RATE) -> torch.Tensor:
+    return process_batch([waveform], settings, sample_rate)[0]
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    ''' post-processing options of the engines and bulk synthesis '''
+    parser.add_argument('--normalize', choices=NORMALIZATIONS, default=None,
+                        help="normalize every utterance to --target-db peak or rms level")
+    parser.add_argument('--target-db', type=float, default=DEFAULT_POSTPROCESS.target_db)
+    parser.add_argument('--trim-db', type=float, default=DEFAULT_POSTPROCESS.trim_db,
+                        help="trim leading and trailing audio this many dB below the peak, 0 keeps it")
+    parser.add_argument('--trim-padding-ms', type=float, default=DEFAULT_POSTPROCESS.trim_padding * 1000)
+    parser.add_argument('--fade-ms', type=float, default=DEFAULT_POSTPROCESS.fade * 1000,
+                        help="fade in and out at the ends of every utterance, 0 for none")
+
+
+def from_arguments(args: argparse.Namespace) -> PostProcess:
+    return PostProcess(args.normalize, args.target_db, args.trim_db or None,
+                       args.trim_padding_ms / 1000, args.fade_ms / 1000)
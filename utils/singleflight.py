@@ -0,0 +1,58 @@
+import threading
+from concurrent.futures import CancelledError, Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    '''
+    runs at most one call per key at a time: callers arriving while a call
+    for their key is in flight wait for it and receive its result (or its
+    exception) instead of running the function again. a call cancelled on
+    behalf of its caller is run again by the callers that waited for it
+    '''
+
+    def __init__(self) -> None:
+        self.executions = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Tuple[Any, bool]:
+        '''
+        @return: result of function, and whether it was shared with an earlier caller
+        '''
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = self._calls[key] = Future()
+                    self.executions += 1
+                else:
+                    self.coalesced += 1
+            if leader:
+                break
+            try:
+                return future.result(), True
+            except CancelledError:
+                continue
+        try:
+            result = function()
+        except BaseException as exception:
+            self._forget(key)
+            future.set_exception(exception)
+            raise
+        self._forget(key)
+        future.set_result(result)
+        return result, False
+
+    def _forget(self, key: Hashable) -> None:
+        # before the waiters wake up, so a retry after a cancelled call starts a new one
+        with self._lock:
+            del self._calls[key]
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        return {'executions': self.executions, 'coalesced': self.coalesced, 'in_flight': self.in_flight()}
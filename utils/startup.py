@@ -0,0 +1,50 @@
+import contextlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional
+
+
+class StartupProfile:
+    '''
+    wall clock seconds spent in each phase of bringing the engine up:
+    imports, model load, warm-up and the first request
+    '''
+
+    def __init__(self) -> None:
+        self.phases: 'OrderedDict[str, float]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record_once(self, name: str, seconds: float) -> bool:
+        ''' records the phase unless it was recorded before, true when it was recorded now '''
+        with self._lock:
+            if name in self.phases:
+                return False
+            self.phases[name] = seconds
+            return True
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()}
+
+    def report(self, logger: Optional[logging.Logger] = None) -> str:
+        ''' one line breakdown in milliseconds, logged when a logger is given '''
+        phases = self.as_dict()
+        line = "Startup: " + ", ".join(f"{name} {ms:.1f} ms" for name, ms in phases.items())
+        line += f", total {sum(phases.values()):.1f} ms"
+        if logger is not None:
+            logger.info(line)
+        return line
@@ -1,5 +1,7 @@
 from typing import List
 
+import numpy
+
 from utils.symbols import phonemes
 
 
@@ -8,9 +10,24 @@ class Tokenizer:
     def __init__(self) -> None:
         self.symbol_to_id = {s: i for i, s in enumerate(phonemes)}
         self.id_to_symbol = {i: s for i, s in enumerate(phonemes)}
+        # codepoint -> id, the last entry (-1) catches every unknown codepoint
+        self.lookup = numpy.full(max(ord(s) for s in phonemes) + 2, -1, dtype=numpy.int32)
+        for s, i in self.symbol_to_id.items():
+            self.lookup[ord(s)] = i
 
     def __call__(self, text: str) -> List[int]:
-        return [self.symbol_to_id[t] for t in text if t in self.symbol_to_id]
+        return self.encode(text).tolist()
+
+    def encode(self, text: str) -> numpy.ndarray:
+        '''
+        @param text: String, phonemes
+        @return: int32 array of symbol ids, unknown symbols are skipped
+        '''
+        codepoints = numpy.frombuffer(text.encode('utf-32-le'), dtype=numpy.uint32)
+        ids = self.lookup[numpy.minimum(codepoints, len(self.lookup) - 1)]
+        if (ids < 0).any():
+            ids = ids[ids >= 0]
+        return ids
 
     def decode(self, sequence: List[int]) -> str:
         text = [self.id_to_symbol[s] for s in sequence if s in self.id_to_symbol]
@@ -1,11 +1,45 @@
+import functools
+import re
+from typing import List
+
 import torch
 
-from utils.cleaners import Cleaner
-from utils.tokenizer import Tokenizer
+from utils.frontend import TextFrontend
+from utils.normalizer import ABBREVIATIONS
+
+# built on first use, owns the long-lived espeak session
+@functools.lru_cache(maxsize=None)
+def _frontend() -> TextFrontend:
+    return TextFrontend.default()
+
+def prepare_text(text: str)->torch.Tensor:
+    return _frontend()(text)
+
+def prepare_texts(texts: List[str], njobs: int = 1) -> List[torch.Tensor]:
+    '''
+    phonemizes all texts in one espeak call and returns one token tensor per text
+    '''
+    frontend = _frontend()
+    return [torch.from_numpy(frontend.encode(p)).unsqueeze(0)
+            for p in frontend.phonemize_batch(texts, njobs)]
+
+_sentence_end_re = re.compile(r'(?<=[.!?…])\s+')
 
-def prepare_text(text: str)->str:
-    if not ((text[-1] == '.') or (text[-1] == '?') or (text[-1] == '!')):
-        text = text + '.'
-    cleaner = Cleaner('english_cleaners', True, 'en-us')
-    tokenizer = Tokenizer()
-    return torch.as_tensor(tokenizer(cleaner(text)), dtype=torch.int, device='cpu').unsqueeze(0)
\ No newline at end of file
+def split_sentences(text: str) -> List[str]:
+    '''
+    splits text after sentence final punctuation, abbreviations like "Dr." do not end a sentence
+    '''
+    sentences = []
+    current = ''
+    for part in _sentence_end_re.split(text.strip()):
+        if not part:
+            continue
+        current = f"{current} {part}" if current else part
+        last_word = current.rsplit(None, 1)[-1]
+        if last_word.endswith('.') and last_word[:-1].lower() in ABBREVIATIONS:
+            continue
+        sentences.append(current)
+        current = ''
+    if current:
+        sentences.append(current)
+    return sentences
@@ -0,0 +1,62 @@
+from typing import Callable, Iterator, Optional
+
+import torch
+
+
+class ChunkedVocoder:
+    '''
+    runs the vocoder over fixed size mel windows instead of the whole utterance,
+    so peak memory depends on the window size and not on the text length.
+    consecutive windows share `overlap` frames whose audio is linearly crossfaded
+    '''
+
+    def __init__(self,
+                 vocoder: Callable[[torch.Tensor], torch.Tensor],
+                 window: int = 256,
+                 overlap: int = 16,
+                 hop_length: Optional[int] = None) -> None:
+        if window <= overlap:
+            raise ValueError(f'window ({window}) has to be larger than overlap ({overlap})')
+        self.vocoder = vocoder
+        self.window = window
+        self.overlap = overlap
+        # samples per mel frame, measured on the first window when not given
+        self.hop_length = hop_length
+
+    def stream(self, mel: torch.Tensor) -> Iterator[torch.Tensor]:
+        '''
+        @param mel: mel spectrogram (..., n_mels, frames)
+        @return: generator of audio chunks (..., samples), concatenated they form the utterance
+        '''
+        frames = mel.shape[-1]
+        if frames <= self.window + self.overlap:
+            yield self._vocode(mel)
+            return
+        pending = None
+        ramp = None
+        start = 0
+        while start < frames:
+            begin = max(0, start - self.overlap)
+            end = min(frames, start + self.window)
+            audio = self._vocode(mel[..., begin:end])
+            if self.hop_length is None:
+                self.hop_length = audio.shape[-1] // (end - begin)
+            fade = self.overlap * self.hop_length
+            if ramp is None:
+                ramp = torch.linspace(0.0, 1.0, fade, device=audio.device, dtype=audio.dtype)
+            if pending is not None:
+                blended = pending * (1.0 - ramp) + audio[..., :fade] * ramp
+                audio = torch.cat([blended, audio[..., fade:]], dim=-1)
+            if end < frames:
+                pending = audio[..., -fade:]
+                audio = audio[..., :-fade]
+            yield audio
+            start = end
+
+    def __call__(self, mel: torch.Tensor) -> torch.Tensor:
+        return torch.cat(list(self.stream(mel)), dim=-1)
+
+    def _vocode(self, mel: torch.Tensor) -> torch.Tensor:
+        audio = self.vocoder(mel)
+        # flatten the channel dimension of (batch, 1, samples) outputs
+        return audio.reshape(*mel.shape[:-2], -1)
@@ -0,0 +1,36 @@
+import struct
+
+# sample rate of the vocoder output
+SAMPLE_RATE = 22050
+
+# RIFF and data sizes announced when the length is not known up front,
+# players treat the stream as ending when the connection closes
+STREAMING_SIZE = 0xFFFFFFFF
+
+# size of the headers written by wav_header
+WAV_HEADER_SIZE = 44
+
+
+def wav_header(sample_rate: int = SAMPLE_RATE, data_size: int = None, channels: int = 1, bits: int = 16) -> bytes:
+    '''
+    @param data_size: length of the PCM data in bytes, None for a stream of unknown length
+    @return: 44 byte RIFF/WAVE header for PCM data
+    '''
+    block_align = channels * bits // 8
+    if data_size is None:
+        riff_size = data_size = STREAMING_SIZE
+    else:
+        riff_size = 36 + data_size
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', riff_size, b'WAVE',
+                       b'fmt ', 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits,
+                       b'data', data_size)
+
+
+def encode_wav(audio, sample_rate: int = SAMPLE_RATE) -> bytes:
+    '''
+    @param audio: int16 numpy array, mono audio data
+    @return: complete wav file, built in memory with a single copy of the PCM buffer
+    '''
+    pcm = memoryview(audio).cast('B')
+    return b''.join((wav_header(sample_rate, pcm.nbytes), pcm))